@@ -0,0 +1,353 @@
+"""
+Benchmark de las etapas del pipeline de reabastecimiento.
+
+Mide, para varias escalas de datos sintéticos (tiendas x SKUs x días):
+- tiempo de pared (s)
+- memoria de la etapa (MB): RSS pico durante la etapa menos el RSS base tras cargar los datos
+- throughput (series/s)
+
+Cada etapa corre en un proceso nuevo (spawn). En Linux el pico se reinicia después de cargar
+los datos (/proc/self/clear_refs), así la memoria de la etapa no incluye la carga; en otros
+sistemas el pico es el de todo el proceso (`peak_reset` = false en el JSON).
+Los resultados se guardan en JSON y se pueden comparar contra una corrida anterior:
+
+    python benchmarks/bench_pipeline.py --scales 10x8x90 50x20x180 --out bench.json
+    python benchmarks/bench_pipeline.py --scales 10x8x90 --compare bench.json --threshold 0.2
+"""
+import argparse
+import gc
+import json
+import logging
+import multiprocessing as mp
+import os
+import platform
+import queue as queue_mod
+import resource
+import sys
+import time
+import warnings
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+sys.path.insert(0, SRC_DIR)
+
+STAGES = (
+    "sales_daily",
+    "master_store",
+    "fit_predict_week",
+    "fit_predict_week_fourier",
+    "compute_order_quantity",
+    "compute_order_quantities",
+    "planner_run",
+)
+
+
+def _quiet() -> None:
+    warnings.filterwarnings("ignore")
+    # El logger se deshabilita antes de importar cmdstanpy: al importarse solo le agrega handlers
+    for name in ("cmdstanpy", "prophet"):
+        logging.getLogger(name).disabled = True
+
+
+def _proc_status_mb(field: str) -> Optional[float]:
+    try:
+        with open("/proc/self/status", encoding="ascii") as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def _max_rss_mb() -> float:
+    # ru_maxrss está en KB en Linux y en bytes en macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+
+def _rss_mb() -> float:
+    """RSS actual del proceso (sin /proc, el pico como cota superior)."""
+    rss = _proc_status_mb("VmRSS")
+    return _max_rss_mb() if rss is None else rss
+
+
+def _reset_peak_rss() -> bool:
+    """Reinicia el pico de RSS del proceso (VmHWM, Linux >= 4.0); False si no se puede."""
+    try:
+        with open("/proc/self/clear_refs", "w", encoding="ascii") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def _peak_rss_mb() -> float:
+    peak = _proc_status_mb("VmHWM")
+    return _max_rss_mb() if peak is None else peak
+
+
+def _child_peak_rss_mb(pid: int) -> Optional[float]:
+    """Pico de RSS (VmHWM) de otro proceso vivo; None si no hay /proc o ya terminó."""
+    try:
+        with open(f"/proc/{pid}/status", encoding="ascii") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def parse_scale(text: str) -> Tuple[int, int, int]:
+    stores, skus, days = (int(x) for x in text.lower().split("x"))
+    return stores, skus, days
+
+
+def ensure_data(data_root: str, scale: Tuple[int, int, int], sparsity: float, seed: int) -> str:
+    from synthetic_data import generate_supply_data
+
+    stores, skus, days = scale
+    out_dir = os.path.join(data_root, f"{stores}x{skus}x{days}_s{sparsity:g}_seed{seed}")
+    if not os.path.exists(os.path.join(out_dir, "ventas_historicas.csv")):
+        generate_supply_data(out_dir, n_stores=stores, n_skus=skus, n_days=days, sparsity=sparsity, seed=seed)
+    return out_dir
+
+
+def _repo(data_dir: str):
+    from data_source import DataSource
+
+    return DataSource(
+        ventas_path=os.path.join(data_dir, "ventas_historicas.csv"),
+        inventario_path=os.path.join(data_dir, "inventario_actual.csv"),
+        catalogo_path=os.path.join(data_dir, "catalogo_productos.csv"),
+        tiendas_path=os.path.join(data_dir, "maestro_tiendas.csv"),
+    ).load()
+
+
+def _prepare(stage: str, data_dir: str) -> Tuple[Callable[[], Any], int]:
+    """
+    Arma (fuera del cronómetro) la función a medir y el número de series que procesa la
+    etapa: pares tienda-producto con ventas para el panel y el forecast, filas de la tabla
+    maestra (inventario) para las demás.
+    """
+    import numpy as np
+    from forecast import DemandForecaster
+    from optimizer import InventoryOptimizer, ReplenishmentPlanner
+
+    repo = _repo(data_dir)
+    n_series = len(repo.inventario)
+
+    if stage == "sales_daily":
+        n_pairs = len(repo.ventas[["id_tienda", "id_producto"]].drop_duplicates())
+        return repo.sales_daily, n_pairs
+    if stage == "master_store":
+        return repo.master_store, n_series
+    if stage in ("fit_predict_week", "fit_predict_week_fourier"):
+        panel = repo.sales_matrix()
+        engine = "fourier" if stage.endswith("fourier") else "prophet"
+        forecaster = DemandForecaster(engine=engine)
+        return (lambda: forecaster.fit_predict_week(panel)), panel.n_series
+    if stage == "compute_order_quantity":
+        master = repo.master_store()
+        optimizer = InventoryOptimizer()
+        rows = list(zip(
+            master["stock_actual"].to_numpy(dtype=float),
+            master["margen_unitario"].to_numpy(dtype=float),
+            master["costo_overstock"].to_numpy(dtype=float),
+        ))
+
+        def run():
+            return [
+                optimizer.compute_order_quantity(50.0, 10.0, stock, cu, co)
+                for stock, cu, co in rows
+            ]
+
+        return run, n_series
+    if stage == "compute_order_quantities":
+        master = repo.master_store()
+        optimizer = InventoryOptimizer()
+        stock = master["stock_actual"].to_numpy(dtype=float)
+        cu = master["margen_unitario"].to_numpy(dtype=float)
+        co = master["costo_overstock"].to_numpy(dtype=float)
+        mu = np.full(len(stock), 50.0)
+        sigma = np.full(len(stock), 10.0)
+        return (lambda: optimizer.compute_order_quantities(mu, sigma, stock, cu, co)), n_series
+    if stage == "planner_run":
+        planner = ReplenishmentPlanner(repo, DemandForecaster(), InventoryOptimizer())
+        return planner.run, n_series
+    raise ValueError(f"Etapa desconocida: {stage}")
+
+
+def _stage_worker(stage: str, data_dir: str, queue) -> None:
+    _quiet()
+    try:
+        fn, n_series = _prepare(stage, data_dir)
+        gc.collect()
+        rss_base = _rss_mb()
+        peak_reset = _reset_peak_rss()
+        t0 = time.perf_counter()
+        fn()
+        wall = time.perf_counter() - t0
+        peak = _peak_rss_mb()
+        queue.put({
+            "wall_s": wall,
+            "stage_rss_mb": max(0.0, peak - rss_base),
+            "peak_rss_mb": peak,
+            "rss_base_mb": rss_base,
+            "peak_reset": peak_reset,
+            "n_series": n_series,
+            "series_per_s": n_series / wall if wall > 0 else float("inf"),
+        })
+    except Exception as exc:  # se reporta en el JSON en lugar de abortar la suite
+        queue.put({"error": f"{type(exc).__name__}: {exc}"})
+
+
+def _wait_result(proc, queue, poll_s: float = 0.5) -> Dict[str, Any]:
+    """
+    Espera el resultado del proceso de la etapa sin bloquearse si muere sin reportar
+    (p. ej. OOM-killer): en ese caso devuelve un error con su exit code y el último pico
+    de RSS observado mientras corría.
+    """
+    peak = None
+    while True:
+        try:
+            return queue.get(timeout=poll_s)
+        except queue_mod.Empty:
+            pass
+        if proc.is_alive():
+            peak = _child_peak_rss_mb(proc.pid) or peak
+            continue
+        try:
+            # Pudo reportar justo antes de terminar
+            return queue.get(timeout=poll_s)
+        except queue_mod.Empty:
+            proc.join()
+            if peak is None:
+                # Sin /proc: pico de los hijos ya terminados (cota superior, incluye corridas previas)
+                rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+                peak = rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+            return {
+                "error": f"el proceso de la etapa terminó sin resultado (exit code {proc.exitcode})",
+                "exitcode": proc.exitcode,
+                "peak_rss_mb": peak,
+            }
+
+
+def run_stage(stage: str, data_dir: str, repeat: int = 1) -> Dict[str, Any]:
+    """Corre la etapa `repeat` veces (cada una en un proceso nuevo) y se queda con la más rápida."""
+    ctx = mp.get_context("spawn")
+    best: Optional[Dict[str, Any]] = None
+    for _ in range(repeat):
+        queue = ctx.Queue()
+        proc = ctx.Process(target=_stage_worker, args=(stage, data_dir, queue))
+        proc.start()
+        result = _wait_result(proc, queue)
+        proc.join()
+        if "error" in result:
+            return result
+        if best is None or result["wall_s"] < best["wall_s"]:
+            best = result
+    return best
+
+
+def run_suite(
+    scales: List[Tuple[int, int, int]],
+    stages: List[str],
+    data_root: str,
+    sparsity: float = 0.3,
+    seed: int = 42,
+    repeat: int = 1,
+) -> Dict[str, Any]:
+    results = []
+    for scale in scales:
+        data_dir = ensure_data(data_root, scale, sparsity, seed)
+        scale_name = "x".join(str(x) for x in scale)
+        for stage in stages:
+            res = run_stage(stage, data_dir, repeat=repeat)
+            res.update({"stage": stage, "scale": scale_name})
+            results.append(res)
+            if "error" in res:
+                print(f"{scale_name:>16} {stage:<24} ERROR {res['error']}")
+            else:
+                print(
+                    f"{scale_name:>16} {stage:<24} {res['wall_s']:9.3f}s "
+                    f"{res['stage_rss_mb']:9.1f}MB {res['series_per_s']:12.1f} series/s"
+                )
+    return {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "cpu_count": os.cpu_count(),
+            "sparsity": sparsity,
+            "seed": seed,
+            "repeat": repeat,
+        },
+        "results": results,
+    }
+
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any], threshold: float) -> List[Dict[str, Any]]:
+    """Etapas cuya `wall_s` o `stage_rss_mb` empeoró más de `threshold` (relativo) vs. `baseline`."""
+    base = {(r["stage"], r["scale"]): r for r in baseline["results"] if "error" not in r}
+    regressions = []
+    for r in current["results"]:
+        b = base.get((r["stage"], r["scale"]))
+        if b is None or "error" in r:
+            continue
+        for metric in ("wall_s", "stage_rss_mb"):
+            # Corridas anteriores a `stage_rss_mb` no tienen la métrica
+            if metric in b and b[metric] > 0 and (r[metric] - b[metric]) / b[metric] > threshold:
+                regressions.append({
+                    "stage": r["stage"],
+                    "scale": r["scale"],
+                    "metric": metric,
+                    "baseline": b[metric],
+                    "current": r[metric],
+                    "change": (r[metric] - b[metric]) / b[metric],
+                })
+    return regressions
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark del pipeline de reabastecimiento")
+    parser.add_argument("--scales", nargs="+", default=["5x4x120", "10x10x180"],
+                        help="Escalas tiendas x skus x días (p. ej. 1000x5000x730)")
+    parser.add_argument("--stages", nargs="+", default=list(STAGES), choices=STAGES)
+    parser.add_argument("--data-root", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), ".data"))
+    parser.add_argument("--sparsity", type=float, default=0.3)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--out", default="bench_results.json")
+    parser.add_argument("--compare", help="JSON de una corrida anterior")
+    parser.add_argument("--threshold", type=float, default=0.2, help="Regresión relativa tolerada")
+    args = parser.parse_args(argv)
+
+    report = run_suite(
+        [parse_scale(s) for s in args.scales],
+        args.stages,
+        args.data_root,
+        sparsity=args.sparsity,
+        seed=args.seed,
+        repeat=args.repeat,
+    )
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        report["regressions"] = compare(report, baseline, args.threshold)
+        for reg in report["regressions"]:
+            print(
+                f"REGRESIÓN {reg['scale']} {reg['stage']} {reg['metric']}: "
+                f"{reg['baseline']:.3f} -> {reg['current']:.3f} ({reg['change']:+.0%})"
+            )
+
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"Resultados en {args.out}")
+    return 1 if report.get("regressions") else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,233 @@
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+import copy
+import math
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from scipy import stats
+
+from data_source import SalesMatrix, SharedTables
+from forecast import DemandForecaster, SeriesPanel
+
+
+@dataclass
+class BacktestResult:
+    """
+    Resultado del backtest rolling-origin.
+
+    - predictions: una fila por (serie, corte) con mu, intervalo [lower, upper] y demanda real
+    - per_series: WAPE, sesgo y cobertura del intervalo por serie sobre todos los cortes
+    - overall: las mismas métricas agregadas sobre todas las filas
+    """
+    predictions: pd.DataFrame
+    per_series: pd.DataFrame
+    overall: Dict[str, float]
+
+
+def _metrics(actual: np.ndarray, mu: np.ndarray, lower: np.ndarray, upper: np.ndarray) -> Dict[str, float]:
+    total = float(actual.sum())
+    return {
+        "wape": float(np.abs(actual - mu).sum()) / total if total > 0 else float("nan"),
+        "bias": float((mu - actual).sum()) / total if total > 0 else float("nan"),
+        "coverage": float(np.mean((actual >= lower) & (actual <= upper))) if len(actual) else float("nan"),
+        "n": int(len(actual)),
+    }
+
+
+def _long_panel(tiendas, productos, Y: np.ndarray, fechas: pd.DatetimeIndex, start, end) -> pd.DataFrame:
+    """Panel largo (días con venta) de las filas de Y, para forecasters que reciben ventas crudas."""
+    cols = np.arange(Y.shape[1])
+    rows, days = np.nonzero((Y != 0) & (cols[None, :] >= start[:, None]) & (cols[None, :] <= end[:, None]))
+    return pd.DataFrame({
+        "fecha": fechas[days],
+        "id_tienda": tiendas[rows],
+        "id_producto": productos[rows],
+        "unidades_vendidas": Y[rows, days].astype(float),
+    })
+
+
+def _forecast_block(forecaster, tiendas, productos, Y, fechas, start, end, horizon_days: int):
+    """
+    (mu, lower, upper) para las series dadas, con historia hasta la última columna de Y.
+
+    - forecast.DemandForecaster: `fit_predict_week` sobre vistas de Y; intervalo Normal
+      mu ± z·sigma con el `interval_width` del forecaster.
+    - demand.DemandForecaster: `train` + `predict` sobre el panel largo de esas series.
+    """
+    n = len(tiendas)
+    if hasattr(forecaster, "fit_predict_week"):
+        fc = forecaster.fit_predict_week(SeriesPanel(Y, tiendas, productos, fechas, start, end), horizon_days)
+        mu = fc["mu_semana"].to_numpy(dtype=float)
+        sigma = fc["sigma_semana"].to_numpy(dtype=float)
+        z = stats.norm.ppf((1.0 + getattr(forecaster, "interval_width", 0.95)) / 2.0)
+        return mu, np.maximum(0.0, mu - z * sigma), mu + z * sigma
+
+    ventas = _long_panel(tiendas, productos, Y, fechas, start, end)
+    forecaster.train(ventas)
+    fc = forecaster.predict(ventas)
+    keys = pd.MultiIndex.from_arrays([fc["id_tienda"].astype(str), fc["id_producto"].astype(str)])
+    pos = keys.get_indexer(pd.MultiIndex.from_arrays([tiendas.astype(str), productos.astype(str)]))
+    found = pos >= 0
+    mu, lower, upper = np.zeros(n), np.zeros(n), np.zeros(n)
+    mu[found] = fc["demanda_pronosticada"].to_numpy(dtype=float)[pos[found]]
+    lower[found] = fc["demanda_lower"].to_numpy(dtype=float)[pos[found]]
+    upper[found] = fc["demanda_upper"].to_numpy(dtype=float)[pos[found]]
+    return mu, lower, upper
+
+
+def _run_task(forecaster, data, task: Tuple[int, int, int], horizon_days: int):
+    """
+    Un corte sobre un bloque de series. `data` son los arreglos (modo serial) o el `spec`
+    de `SharedTables` (workers): en ambos casos la historia es una vista, no una copia.
+    """
+    shared = None
+    if isinstance(data, dict):
+        shared = SharedTables.attach(data)
+        matrix, rango = shared["ventas"], shared["rango"]
+        tiendas, productos, Y, fechas = matrix.id_tienda, matrix.id_producto, matrix.values, matrix.fechas
+        start, end = rango["start"].to_numpy(np.int64), rango["end"].to_numpy(np.int64)
+    else:
+        tiendas, productos, Y, fechas, start, end = data
+
+    try:
+        cutoff, a, b = task
+        rows = a + np.flatnonzero(start[a:b] <= cutoff)
+        # Si todas las series del bloque ya existían al corte, Y[a:b, :corte+1] es una vista
+        sel = slice(a, b) if len(rows) == b - a else rows
+        hist_end = np.minimum(end[sel], cutoff)
+        mu, lower, upper = _forecast_block(
+            forecaster,
+            tiendas[sel], productos[sel],
+            Y[sel, :cutoff + 1], fechas[:cutoff + 1],
+            start[sel], hist_end,
+            horizon_days,
+        )
+        actual = Y[sel, cutoff + 1:cutoff + 1 + horizon_days].sum(axis=1, dtype=np.float64)
+        return rows, mu, lower, upper, actual
+    finally:
+        if shared is not None:
+            shared.close()
+
+
+class RollingOriginBacktest:
+    """
+    Evaluación rolling-origin: para cada uno de `n_cutoffs` cortes (separados `step_days`,
+    el último a `horizon_days` del final) se pronostica la semana siguiente usando sólo la
+    historia hasta el corte y se compara con la demanda real.
+
+    El panel se convierte una sola vez a la matriz (series x días) y cada corte usa vistas
+    Y[:, :corte+1]. Con `n_jobs > 1` la matriz se publica en memoria compartida y las tareas
+    (corte x bloque de series) se reparten en un pool de procesos.
+
+    Acepta `forecast.DemandForecaster` (Prophet / fourier / ...) y `demand.DemandForecaster`
+    (Random Forest semanal).
+    """
+
+    def __init__(
+        self,
+        forecaster,
+        n_cutoffs: int = 4,
+        horizon_days: int = 7,
+        step_days: int = 7,
+        n_jobs: int = 1,
+        series_per_task: Optional[int] = None,
+    ):
+        self.forecaster = forecaster
+        self.n_cutoffs = n_cutoffs
+        self.horizon_days = horizon_days
+        self.step_days = step_days
+        self.n_jobs = n_jobs
+        self.series_per_task = series_per_task
+
+    def cutoffs(self, n_days: int) -> List[int]:
+        """Columnas de corte (último día de historia), de la más antigua a la más reciente."""
+        last = n_days - 1 - self.horizon_days
+        return [c for c in (last - k * self.step_days for k in reversed(range(self.n_cutoffs))) if c >= 0]
+
+    def _worker_forecaster(self):
+        # En los workers cada tarea ya es un proceso: el forecaster no abre su propio pool
+        forecaster = copy.copy(self.forecaster)
+        if getattr(forecaster, "n_jobs", 1) > 1:
+            forecaster.n_jobs = 1
+        return forecaster
+
+    def run(self, sales_panel) -> BacktestResult:
+        """`sales_panel`: panel largo (`sales_daily()`) o matriz densa (`sales_matrix()`)."""
+        tiendas, productos, Y, fechas, start, end = DemandForecaster._panel_arrays(sales_panel)
+        tiendas = np.asarray(tiendas, dtype=object)
+        productos = np.asarray(productos, dtype=object)
+        n = len(tiendas)
+        cutoffs = self.cutoffs(len(fechas))
+
+        block = self.series_per_task or max(1, math.ceil(n / max(1, self.n_jobs)))
+        tasks = [(c, a, min(n, a + block)) for c in cutoffs for a in range(0, n, block)]
+
+        if self.n_jobs <= 1:
+            data = (tiendas, productos, Y, fechas, start, end)
+            results = [_run_task(self.forecaster, data, task, self.horizon_days) for task in tasks]
+        else:
+            tables = {
+                "ventas": SalesMatrix(np.asarray(Y, dtype=np.float32), tiendas, productos, fechas),
+                "rango": pd.DataFrame({"start": start, "end": end}),
+            }
+            with SharedTables.publish(tables) as shared:
+                forecaster = self._worker_forecaster()
+                with ProcessPoolExecutor(max_workers=self.n_jobs) as pool:
+                    results = list(pool.map(
+                        _run_task,
+                        [forecaster] * len(tasks),
+                        [shared.spec] * len(tasks),
+                        tasks,
+                        [self.horizon_days] * len(tasks),
+                    ))
+
+        parts = []
+        for (cutoff, _, _), (rows, mu, lower, upper, actual) in zip(tasks, results):
+            parts.append(pd.DataFrame({
+                "id_tienda": tiendas[rows],
+                "id_producto": productos[rows],
+                "corte": fechas[cutoff],
+                "mu": mu,
+                "lower": lower,
+                "upper": upper,
+                "real": actual,
+            }))
+        predictions = (
+            pd.concat(parts, ignore_index=True) if parts
+            else pd.DataFrame(columns=["id_tienda", "id_producto", "corte", "mu", "lower", "upper", "real"])
+        )
+        predictions = predictions.sort_values(["id_tienda", "id_producto", "corte"]).reset_index(drop=True)
+
+        per_series = self._per_series(predictions)
+        overall = _metrics(
+            predictions["real"].to_numpy(float), predictions["mu"].to_numpy(float),
+            predictions["lower"].to_numpy(float), predictions["upper"].to_numpy(float),
+        )
+        overall["n_cutoffs"] = len(cutoffs)
+        return BacktestResult(predictions=predictions, per_series=per_series, overall=overall)
+
+    @staticmethod
+    def _per_series(predictions: pd.DataFrame) -> pd.DataFrame:
+        """Métricas por serie en forma vectorizada (sumas por grupo, sin apply por serie)."""
+        p = predictions.assign(
+            abs_err=(predictions["real"] - predictions["mu"]).abs(),
+            err=predictions["mu"] - predictions["real"],
+            cubierto=(predictions["real"] >= predictions["lower"]) & (predictions["real"] <= predictions["upper"]),
+        )
+        g = p.groupby(["id_tienda", "id_producto"], sort=True).agg(
+            real=("real", "sum"),
+            abs_err=("abs_err", "sum"),
+            err=("err", "sum"),
+            coverage=("cubierto", "mean"),
+            n_cutoffs=("corte", "size"),
+        )
+        real = g["real"].where(g["real"] > 0)
+        return pd.DataFrame({
+            "wape": g["abs_err"] / real,
+            "bias": g["err"] / real,
+            "coverage": g["coverage"],
+            "n_cutoffs": g["n_cutoffs"],
+            "real": g["real"],
+        }).reset_index()
@@ -1,6 +1,12 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, field, replace
+import json
+import os
+import shutil
+import uuid
+from multiprocessing import shared_memory
+import numpy as np
 import pandas as pd
-from typing import Tuple
+from typing import Any, Dict, List, Optional, Tuple, Union
 
 @dataclass(frozen=True)
 class PipelineConfig:
@@ -12,42 +18,919 @@ class PipelineConfig:
     fractil_clip: Tuple[float, float] = (0.01, 0.99)
 
 
+# ----------------------------
+# Snapshot columnar (cache tipado de los CSV)
+# ----------------------------
+
+SNAPSHOT_VERSION = 3
+# Versión del formato de `SalesMatrix.save` (independiente de los snapshots de tablas)
+MATRIX_VERSION = 1
+_DATE_COLUMNS = ("fecha",)
+
+
+def _source_signature(path: str) -> Dict[str, int]:
+    st = os.stat(path)
+    return {"size": int(st.st_size), "mtime_ns": int(st.st_mtime_ns)}
+
+
+def _encode_column(name: str, s: pd.Series) -> Tuple[str, Dict[str, np.ndarray]]:
+    """
+    Convierte una columna a su representación columnar tipada:
+    - ids y textos -> categórica (códigos enteros + categorías)
+    - fechas (también las leídas como texto del CSV, que se parsean aquí) -> días desde epoch (int32)
+    - numéricos -> dtype más angosto sin pérdida (int32 / float32 como mínimo)
+    """
+    if name in _DATE_COLUMNS:
+        fechas = pd.to_datetime(s)
+        if (fechas == fechas.dt.normalize()).all():
+            dias = fechas.to_numpy().astype("datetime64[D]").astype(np.int64)
+            return "date", {"values": dias.astype(np.int32)}
+        return "datetime", {"values": fechas.to_numpy().astype("datetime64[ns]")}
+
+    if name.startswith("id_") or not pd.api.types.is_numeric_dtype(s):
+        cat = pd.Categorical(s)
+        n = len(cat.categories)
+        code_dtype = np.int16 if n < np.iinfo(np.int16).max else np.int32
+        categories = np.asarray(cat.categories)
+        if categories.dtype == object:
+            categories = categories.astype(str)
+        return "category", {"codes": cat.codes.astype(code_dtype), "categories": categories}
+
+    if pd.api.types.is_bool_dtype(s):
+        return "numeric", {"values": s.to_numpy()}
+
+    if pd.api.types.is_integer_dtype(s):
+        # int32 como piso: evita overflow en sumas/restas posteriores (márgenes, costos)
+        values = s.to_numpy()
+        info = np.iinfo(np.int32)
+        if len(values) == 0 or (values.min() >= info.min and values.max() <= info.max):
+            values = values.astype(np.int32)
+        return "numeric", {"values": values}
+
+    values = s.to_numpy(dtype=np.float64)
+    narrow = values.astype(np.float32)
+    if np.array_equal(narrow.astype(np.float64), values, equal_nan=True):
+        values = narrow
+    return "numeric", {"values": values}
+
+
+def _decode_column(kind: str, arrays: Dict[str, np.ndarray]):
+    if kind == "date":
+        return pd.to_datetime(np.asarray(arrays["values"]).astype("datetime64[D]").astype("datetime64[ns]"))
+    if kind == "datetime":
+        return pd.to_datetime(np.asarray(arrays["values"]))
+    if kind == "category":
+        return pd.Categorical.from_codes(np.asarray(arrays["codes"]), categories=arrays["categories"])
+    return arrays["values"]
+
+
+def _restore_dtype(values, dtype: Optional[str]):
+    """`values` con el dtype original de la columna (`dtype` None = se deja como está)."""
+    if dtype is None or str(values.dtype) == dtype:
+        return values
+    return pd.Series(values, copy=False).astype(dtype).array
+
+
+def write_snapshot(df: pd.DataFrame, snapshot_path: str, source: Dict[str, int]) -> None:
+    """Escribe `df` como un directorio de arrays .npy (uno por columna) más un manifest JSON."""
+    tmp_path = snapshot_path + ".tmp"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+
+    columns = []
+    for i, name in enumerate(df.columns):
+        kind, arrays = _encode_column(name, df[name])
+        files = {}
+        for part, arr in arrays.items():
+            fname = f"col_{i}_{part}.npy"
+            np.save(os.path.join(tmp_path, fname), arr, allow_pickle=False)
+            files[part] = fname
+        columns.append({"name": name, "kind": kind, "files": files})
+
+    manifest = {"version": SNAPSHOT_VERSION, "source": source, "n_rows": len(df), "columns": columns}
+    with open(os.path.join(tmp_path, "manifest.json"), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False)
+
+    shutil.rmtree(snapshot_path, ignore_errors=True)
+    os.replace(tmp_path, snapshot_path)
+
+
+def read_snapshot(snapshot_path: str, source: Optional[Dict[str, int]] = None) -> Optional[pd.DataFrame]:
+    """
+    Lee un snapshot con memory-map. Retorna None si no existe, es de otra versión
+    o (si se pasa `source`) el CSV de origen cambió de tamaño o mtime.
+
+    Las columnas vuelven tipadas: ids y textos como categóricas y numéricos en su dtype
+    angosto, sin copia (memory-map); `fecha` como datetime64 (la única columna que se
+    convierte al leer, desde días int32). Quien necesite ids como
+    texto o floats de 64 bits los normaliza al usarlos (`astype(str)`, `to_numpy(dtype=float)`).
+    """
+    manifest_path = os.path.join(snapshot_path, "manifest.json")
+    if not os.path.exists(manifest_path):
+        return None
+    with open(manifest_path, encoding="utf-8") as f:
+        manifest = json.load(f)
+    if manifest.get("version") != SNAPSHOT_VERSION:
+        return None
+    if source is not None and manifest.get("source") != source:
+        return None
+
+    data = {}
+    for col in manifest["columns"]:
+        arrays = {
+            part: np.load(os.path.join(snapshot_path, fname), mmap_mode="r", allow_pickle=False)
+            for part, fname in col["files"].items()
+        }
+        data[col["name"]] = _decode_column(col["kind"], arrays)
+    return pd.DataFrame(data, copy=False)
+
+
+@dataclass
+class SalesMatrix:
+    """
+    Panel de ventas denso: una fila por serie (id_tienda, id_producto) y una columna por día.
+
+    - values: float32 de forma (n_series, n_days)
+    - id_tienda / id_producto: fila -> tienda / producto (ordenadas como el groupby del panel largo)
+    - fechas: columna -> fecha (rango diario continuo)
+
+    Las matrices creadas por `append` o `load` son la vista [:, :n_days] de un buffer con
+    columnas de reserva, de modo que los días nuevos se escriben en su lugar (también sobre
+    el memmap persistido) en vez de copiar todo el histórico en cada delta.
+    """
+    values: np.ndarray
+    id_tienda: np.ndarray
+    id_producto: np.ndarray
+    fechas: pd.DatetimeIndex
+    _buffer: Optional[np.ndarray] = field(default=None, repr=False)
+    # Columnas en uso del buffer, compartido entre las matrices que lo usan: solo la más
+    # reciente puede seguir escribiendo en la reserva (las anteriores no ven cambios)
+    _filled: Optional[List[int]] = field(default=None, repr=False)
+
+    # Reserva mínima de días al (re)asignar el buffer; crece un 25% para amortizar las copias
+    RESERVE_DAYS = 28
+
+    @classmethod
+    def _capacity(cls, n_days: int) -> int:
+        return n_days + max(cls.RESERVE_DAYS, n_days // 4)
+
+    @property
+    def n_series(self) -> int:
+        return self.values.shape[0]
+
+    @property
+    def n_days(self) -> int:
+        return self.values.shape[1]
+
+    def iter_series(self):
+        """Itera (id_tienda, id_producto, y, fechas) sin copiar: `y` es una vista de la fila."""
+        for i in range(self.n_series):
+            yield self.id_tienda[i], self.id_producto[i], self.values[i], self.fechas
+
+    def to_panel(self) -> pd.DataFrame:
+        """Reconstruye el panel largo equivalente a `DataSource.sales_daily()`."""
+        return pd.DataFrame({
+            "id_tienda": np.repeat(self.id_tienda, self.n_days),
+            "id_producto": np.repeat(self.id_producto, self.n_days),
+            "fecha": np.tile(self.fechas.to_numpy(), self.n_series),
+            "unidades_vendidas": self.values.ravel().astype(np.float64),
+        })
+
+    @property
+    def watermark(self) -> pd.Timestamp:
+        """Última fecha incorporada a la matriz."""
+        return self.fechas[-1]
+
+    def append(self, delta: pd.DataFrame) -> "SalesMatrix":
+        """
+        Incorpora un delta de ventas crudas (mismo esquema que ventas_historicas).
+
+        Solo se agregan las filas con fecha posterior al watermark: la matriz crece en
+        columnas hasta la nueva fecha máxima y en filas para los pares nuevos, sin re-agregar
+        el histórico. Si no hay pares nuevos y los días caben en la reserva del buffer, se
+        escriben en su lugar; si no, se copia el histórico a un buffer nuevo con más reserva.
+        """
+        fechas = pd.to_datetime(delta["fecha"]).to_numpy().astype("datetime64[D]")
+        watermark = np.datetime64(self.watermark.date(), "D")
+        mask = fechas > watermark
+        if not mask.any():
+            return self
+
+        fechas = fechas[mask]
+        tiendas = delta["id_tienda"].astype(str).to_numpy()[mask]
+        productos = delta["id_producto"].astype(str).to_numpy()[mask]
+        units = (
+            pd.to_numeric(delta["unidades_vendidas"], errors="coerce").fillna(0.0)
+            .to_numpy(dtype=np.float32)[mask]
+        )
+
+        old_pairs = pd.MultiIndex.from_arrays([self.id_tienda, self.id_producto])
+        delta_pairs = pd.MultiIndex.from_arrays([tiendas, productos])
+        pairs = old_pairs.union(delta_pairs.unique(), sort=True)
+
+        start = np.datetime64(self.fechas[0].date(), "D")
+        n_days = int((fechas.max() - start).astype(np.int64)) + 1
+
+        buffer = self._buffer
+        in_place = (
+            buffer is not None
+            and len(pairs) == self.n_series
+            and n_days <= buffer.shape[1]
+            and self._filled[0] == self.n_days
+            and buffer.flags.writeable
+        )
+        if in_place:
+            filled = self._filled
+            buffer[:, self.n_days:n_days] = 0.0
+        else:
+            filled = [0]
+            buffer = np.zeros((len(pairs), self._capacity(n_days)), dtype=np.float32)
+            if len(pairs) == self.n_series:
+                buffer[:, :self.n_days] = self.values
+            else:
+                buffer[pairs.get_indexer(old_pairs), :self.n_days] = self.values
+
+        row_codes = pairs.get_indexer(delta_pairs).astype(np.int64)
+        day_codes = (fechas - start).astype(np.int64)
+        np.add.at(buffer.reshape(-1), row_codes * buffer.shape[1] + day_codes, units)
+        filled[0] = n_days
+
+        return SalesMatrix(
+            values=buffer[:, :n_days],
+            id_tienda=np.asarray(pairs.get_level_values(0), dtype=object),
+            id_producto=np.asarray(pairs.get_level_values(1), dtype=object),
+            fechas=pd.date_range(start=self.fechas[0], periods=n_days, freq="D"),
+            _buffer=buffer,
+            _filled=filled,
+        )
+
+    def save(self, path: str) -> None:
+        """
+        Persiste la matriz (.npy memory-mappable, con las columnas de reserva del buffer) y su
+        watermark en `path`.
+        """
+        buffer = self._buffer
+        if buffer is None or buffer.shape[0] != self.n_series or self._filled[0] != self.n_days:
+            buffer = np.zeros((self.n_series, self._capacity(self.n_days)), dtype=np.float32)
+            buffer[:, :self.n_days] = self.values
+        tmp_path = path + ".tmp"
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+        np.save(os.path.join(tmp_path, "values.npy"), buffer, allow_pickle=False)
+        np.save(os.path.join(tmp_path, "id_tienda.npy"), self.id_tienda.astype(str), allow_pickle=False)
+        np.save(os.path.join(tmp_path, "id_producto.npy"), self.id_producto.astype(str), allow_pickle=False)
+        self._write_manifest(tmp_path)
+        shutil.rmtree(path, ignore_errors=True)
+        os.replace(tmp_path, path)
+
+    def _write_manifest(self, path: str) -> None:
+        """El manifest define cuántas columnas del buffer son válidas (reemplazo atómico)."""
+        manifest = {
+            "version": MATRIX_VERSION,
+            "start": str(self.fechas[0].date()),
+            "watermark": str(self.watermark.date()),
+            "n_series": self.n_series,
+            "n_days": self.n_days,
+        }
+        tmp_manifest = os.path.join(path, "manifest.json.tmp")
+        with open(tmp_manifest, "w", encoding="utf-8") as f:
+            json.dump(manifest, f)
+        os.replace(tmp_manifest, os.path.join(path, "manifest.json"))
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = True, writable: bool = False) -> Optional["SalesMatrix"]:
+        """
+        Carga una matriz persistida con `save`; None si no existe. Con `writable` (y `mmap`)
+        el memmap se abre en modo "r+" y `append` escribe los días nuevos directo al archivo.
+        """
+        manifest_path = os.path.join(path, "manifest.json")
+        if not os.path.exists(manifest_path):
+            return None
+        with open(manifest_path, encoding="utf-8") as f:
+            manifest = json.load(f)
+        if manifest.get("version") != MATRIX_VERSION:
+            return None
+        mmap_mode = ("r+" if writable else "r") if mmap else None
+        buffer = np.load(os.path.join(path, "values.npy"), mmap_mode=mmap_mode)
+        n_days = manifest["n_days"]
+        return cls(
+            values=buffer[:, :n_days],
+            id_tienda=np.load(os.path.join(path, "id_tienda.npy")).astype(object),
+            id_producto=np.load(os.path.join(path, "id_producto.npy")).astype(object),
+            fechas=pd.date_range(start=manifest["start"], periods=n_days, freq="D"),
+            _buffer=buffer,
+            _filled=[n_days],
+        )
+
+
+# ----------------------------
+# Memoria compartida entre procesos
+# ----------------------------
+
+@dataclass
+class SharedTables:
+    """
+    Tablas publicadas en bloques de `multiprocessing.shared_memory`.
+
+    `spec` es un dict pequeño y picklable (nombres de bloques, shapes, dtypes y categorías,
+    más el dtype original de cada columna para restaurar textos e ids al hacer attach)
+    que se envía a los workers; cada worker llama `SharedTables.attach(spec)` y obtiene
+    las mismas tablas apuntando a la memoria compartida, sin copiar el panel.
+
+    Quien publica debe llamar `unlink()` al terminar (o usarlo como context manager).
+    """
+    spec: Dict[str, Any]
+    tables: Dict[str, Union[pd.DataFrame, SalesMatrix]] = field(default_factory=dict)
+    _blocks: List[shared_memory.SharedMemory] = field(default_factory=list, repr=False)
+    _owner: bool = False
+
+    @staticmethod
+    def _put(arr: np.ndarray, prefix: str, blocks: List[shared_memory.SharedMemory]) -> Dict[str, Any]:
+        arr = np.ascontiguousarray(arr)
+        shm = shared_memory.SharedMemory(
+            create=True, size=max(1, arr.nbytes), name=f"{prefix}_{len(blocks)}"
+        )
+        np.ndarray(arr.shape, dtype=arr.dtype, buffer=shm.buf)[...] = arr
+        blocks.append(shm)
+        return {"shm": shm.name, "shape": list(arr.shape), "dtype": arr.dtype.str}
+
+    @staticmethod
+    def _get(ref: Dict[str, Any], blocks: List[shared_memory.SharedMemory]) -> np.ndarray:
+        shm = shared_memory.SharedMemory(name=ref["shm"], track=False)
+        blocks.append(shm)
+        return np.ndarray(tuple(ref["shape"]), dtype=np.dtype(ref["dtype"]), buffer=shm.buf)
+
+    @classmethod
+    def publish(
+        cls,
+        tables: Dict[str, Union[pd.DataFrame, SalesMatrix]],
+        prefix: Optional[str] = None,
+    ) -> "SharedTables":
+        prefix = prefix or f"tostao_{uuid.uuid4().hex[:12]}"
+        blocks: List[shared_memory.SharedMemory] = []
+        spec: Dict[str, Any] = {}
+        try:
+            for name, table in tables.items():
+                if isinstance(table, SalesMatrix):
+                    tiendas = pd.Categorical(table.id_tienda)
+                    productos = pd.Categorical(table.id_producto)
+                    spec[name] = {
+                        "type": "matrix",
+                        "values": cls._put(table.values, prefix, blocks),
+                        "id_tienda": cls._put(tiendas.codes, prefix, blocks),
+                        "id_producto": cls._put(productos.codes, prefix, blocks),
+                        "tienda_categories": np.asarray(tiendas.categories).astype(str),
+                        "producto_categories": np.asarray(productos.categories).astype(str),
+                        "start": str(table.fechas[0].date()),
+                        "n_days": table.n_days,
+                    }
+                    continue
+
+                columns = []
+                for col in table.columns:
+                    kind, arrays = _encode_column(col, table[col])
+                    entry = {"name": col, "kind": kind, "dtype": str(table[col].dtype), "refs": {}}
+                    for part, arr in arrays.items():
+                        if part == "categories":
+                            entry["categories"] = arr
+                        else:
+                            entry["refs"][part] = cls._put(arr, prefix, blocks)
+                    columns.append(entry)
+                spec[name] = {"type": "frame", "columns": columns}
+        except Exception:
+            for shm in blocks:
+                shm.close()
+                shm.unlink()
+            raise
+
+        shared = cls(spec=spec, _blocks=blocks, _owner=True)
+        shared.tables = cls._build_tables(spec, blocks)
+        return shared
+
+    @classmethod
+    def attach(cls, spec: Dict[str, Any]) -> "SharedTables":
+        """Se conecta (zero-copy) a tablas publicadas por otro proceso."""
+        blocks: List[shared_memory.SharedMemory] = []
+        return cls(spec=spec, tables=cls._build_tables(spec, blocks, attach=True), _blocks=blocks)
+
+    @classmethod
+    def _build_tables(
+        cls,
+        spec: Dict[str, Any],
+        blocks: List[shared_memory.SharedMemory],
+        attach: bool = False,
+    ) -> Dict[str, Union[pd.DataFrame, SalesMatrix]]:
+        owned = {shm.name: shm for shm in blocks}
+
+        def get(ref):
+            if not attach:
+                shm = owned[ref["shm"]]
+                return np.ndarray(tuple(ref["shape"]), dtype=np.dtype(ref["dtype"]), buffer=shm.buf)
+            return cls._get(ref, blocks)
+
+        tables: Dict[str, Union[pd.DataFrame, SalesMatrix]] = {}
+        for name, entry in spec.items():
+            if entry["type"] == "matrix":
+                tables[name] = SalesMatrix(
+                    values=get(entry["values"]),
+                    id_tienda=entry["tienda_categories"][get(entry["id_tienda"])].astype(object),
+                    id_producto=entry["producto_categories"][get(entry["id_producto"])].astype(object),
+                    fechas=pd.date_range(start=entry["start"], periods=entry["n_days"], freq="D"),
+                )
+                continue
+
+            data = {}
+            for col in entry["columns"]:
+                arrays = {part: get(ref) for part, ref in col["refs"].items()}
+                if "categories" in col:
+                    arrays["categories"] = col["categories"]
+                values = _decode_column(col["kind"], arrays)
+                if col["kind"] == "category":
+                    # Textos e ids vuelven a su dtype original (la categórica es solo transporte);
+                    # los numéricos se dejan en su dtype angosto, sin pérdida y sin copia
+                    values = _restore_dtype(values, col.get("dtype"))
+                data[col["name"]] = values
+            tables[name] = pd.DataFrame(data, copy=False)
+        return tables
+
+    def __getitem__(self, name: str) -> Union[pd.DataFrame, SalesMatrix]:
+        return self.tables[name]
+
+    def close(self) -> None:
+        self.tables = {}
+        for shm in self._blocks:
+            try:
+                shm.close()
+            except BufferError:
+                # Aún hay vistas vivas sobre el bloque; el SO lo libera al terminar el proceso
+                pass
+
+    def unlink(self) -> None:
+        """Libera los bloques (solo el proceso que publicó)."""
+        self.close()
+        if self._owner:
+            for shm in self._blocks:
+                shm.unlink()
+            self._blocks = []
+
+    def __enter__(self) -> "SharedTables":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        if self._owner:
+            self.unlink()
+        else:
+            self.close()
+
+
+# ----------------------------
+# Tabla maestra indexada por (tienda, producto)
+# ----------------------------
+
+def _gather(values: np.ndarray, pos: np.ndarray) -> np.ndarray:
+    """values[pos] con NaN donde pos == -1 (equivalente a un left-merge sin match)."""
+    missing = pos < 0
+    if not missing.any():
+        return values[pos]
+    if values.dtype.kind in "iub":
+        values = values.astype(np.float64)
+    elif values.dtype.kind not in "fc":
+        values = values.astype(object)
+    out = values[np.where(missing, 0, pos)] if len(values) else np.empty(len(pos), dtype=values.dtype)
+    out[missing] = np.nan
+    return out
+
+
+def _first_positions(keys: pd.Series, wanted: np.ndarray) -> np.ndarray:
+    """Fila de `keys` de cada id de `wanted` (-1 si falta); con ids repetidos, la primera."""
+    keys = keys.astype(str)
+    first = np.flatnonzero(~keys.duplicated().to_numpy())
+    if len(first) == 0:
+        return np.full(len(wanted), -1, dtype=np.int64)
+    pos = pd.Index(keys.to_numpy()[first]).get_indexer(wanted)
+    return np.where(pos >= 0, first[np.maximum(pos, 0)], -1)
+
+
+@dataclass
+class MasterIndex:
+    """
+    Versión compacta de `DataSource.master_store()`: columnas respaldadas por arrays (una
+    entrada por fila de inventario) con códigos enteros de tienda y producto, y una matriz
+    densa (n_tiendas, n_productos) -> fila que permite lookups O(1) y joins por gather.
+    """
+    tiendas: pd.Index           # código -> id_tienda
+    productos: pd.Index         # código -> id_producto
+    tienda_code: np.ndarray     # int32 por fila
+    producto_code: np.ndarray   # int32 por fila
+    columns: Dict[str, np.ndarray]
+    _pos: np.ndarray = field(repr=False, default=None)
+
+    def __post_init__(self):
+        if self._pos is None:
+            self._pos = np.full((len(self.tiendas), len(self.productos)), -1, dtype=np.int32)
+            # Si un par aparece repetido, el lookup apunta a su primera fila
+            rows = np.arange(len(self.tienda_code), dtype=np.int32)[::-1]
+            self._pos[self.tienda_code[::-1], self.producto_code[::-1]] = rows
+
+    @classmethod
+    def build(cls, inventario: pd.DataFrame, catalogo: pd.DataFrame, tiendas: pd.DataFrame) -> "MasterIndex":
+        """
+        Una fila por fila de inventario. Si el catálogo o el maestro de tiendas repiten un id
+        se usa su primera fila (el merge de `master_store()` duplicaría la fila de inventario).
+        """
+        inv_tiendas = inventario["id_tienda"].astype(str).to_numpy()
+        inv_productos = inventario["id_producto"].astype(str).to_numpy()
+        tienda_codes, tienda_index = pd.factorize(inv_tiendas, sort=True)
+        producto_codes, producto_index = pd.factorize(inv_productos, sort=True)
+
+        cat_pos = _first_positions(catalogo["id_producto"], inv_productos)
+        tds_pos = _first_positions(tiendas["id_tienda"], inv_tiendas)
+
+        columns: Dict[str, np.ndarray] = {
+            "id_tienda": inv_tiendas.astype(object),
+            "id_producto": inv_productos.astype(object),
+        }
+        for col in inventario.columns:
+            if col not in columns:
+                columns[col] = inventario[col].to_numpy()
+        for col in catalogo.columns:
+            if col != "id_producto":
+                columns[col] = _gather(catalogo[col].to_numpy(), cat_pos)
+        for col in tiendas.columns:
+            if col != "id_tienda":
+                columns[col] = _gather(tiendas[col].to_numpy(), tds_pos)
+
+        # Mismas definiciones que master_store()
+        columns["margen_unitario"] = np.maximum(columns["precio_venta"] - columns["costo_unitario"], 0)
+        columns["costo_overstock"] = np.maximum(
+            columns["costo_unitario"] + columns["costo_almacenamiento_semanal"], 0
+        )
+
+        return cls(
+            tiendas=pd.Index(tienda_index),
+            productos=pd.Index(producto_index),
+            tienda_code=tienda_codes.astype(np.int32),
+            producto_code=producto_codes.astype(np.int32),
+            columns=columns,
+        )
+
+    def __len__(self) -> int:
+        return len(self.tienda_code)
+
+    def codes(self, tiendas, productos) -> Tuple[np.ndarray, np.ndarray]:
+        """Códigos enteros (vectorizado); -1 para ids desconocidos."""
+        tc = self.tiendas.get_indexer(np.asarray(tiendas).astype(str))
+        pc = self.productos.get_indexer(np.asarray(productos).astype(str))
+        return tc, pc
+
+    def rows(self, tiendas, productos) -> np.ndarray:
+        """Fila de la tabla maestra para cada par (vectorizado); -1 si no existe."""
+        tc, pc = self.codes(tiendas, productos)
+        valid = (tc >= 0) & (pc >= 0)
+        out = np.full(len(tc), -1, dtype=np.int64)
+        out[valid] = self._pos[tc[valid], pc[valid]]
+        return out
+
+    def lookup(self, tienda, producto) -> int:
+        """Fila de un par (O(1)); -1 si no existe."""
+        tc = self.tiendas.get_indexer([str(tienda)])[0]
+        pc = self.productos.get_indexer([str(producto)])[0]
+        if tc < 0 or pc < 0:
+            return -1
+        return int(self._pos[tc, pc])
+
+    def align(self, tiendas, productos) -> np.ndarray:
+        """
+        Inverso de `rows`: para cada fila maestra, la posición del par en (tiendas, productos);
+        -1 si el par no está. Sirve para traer columnas externas (p. ej. el forecast) por gather.
+        """
+        tc, pc = self.codes(tiendas, productos)
+        valid = np.flatnonzero((tc >= 0) & (pc >= 0))
+        # Claves planas tienda*n_productos+producto ordenadas + searchsorted: sin matriz densa
+        # por llamada. Con pares repetidos gana la última aparición (orden estable + side="right").
+        n_productos = len(self.productos)
+        keys = tc[valid].astype(np.int64) * n_productos + pc[valid]
+        order = np.argsort(keys, kind="stable")
+        keys = keys[order]
+        wanted = self.tienda_code.astype(np.int64) * n_productos + self.producto_code
+        at = np.searchsorted(keys, wanted, side="right") - 1
+        found = at >= 0
+        found[found] = keys[at[found]] == wanted[found]
+        out = np.full(len(wanted), -1, dtype=np.int64)
+        out[found] = valid[order[at[found]]]
+        return out
+
+    def get(self, column: str, rows: Optional[np.ndarray] = None) -> np.ndarray:
+        values = self.columns[column]
+        return values if rows is None else _gather(values, np.asarray(rows))
+
+    def to_frame(self) -> pd.DataFrame:
+        return pd.DataFrame(self.columns)
+
+
 @dataclass
 class DataSource:
     ventas_path: str = '../data/01_supply_optimization/ventas_historicas.csv'
     inventario_path: str = '../data/01_supply_optimization/inventario_actual.csv'
     catalogo_path: str = '../data/01_supply_optimization/catalogo_productos.csv'
     tiendas_path: str = '../data/01_supply_optimization/maestro_tiendas.csv'
+    # Si se define, cada CSV se convierte una vez a un snapshot columnar tipado y
+    # las cargas siguientes lo leen con memory-map (se reconstruye si el CSV cambia).
+    snapshot_dir: Optional[str] = None
+    # Layout particionado (ver `write_partitions`): si se define, ventas e inventario se
+    # leen solo de las particiones indicadas (None = todas).
+    partitions_dir: Optional[str] = None
+    partitions: Optional[List[str]] = None
+
+    def _read_table(self, path: str, table: str) -> pd.DataFrame:
+        if self.snapshot_dir is None:
+            return pd.read_csv(path)
+
+        snapshot_path = os.path.join(self.snapshot_dir, table)
+        source = _source_signature(path)
+        df = read_snapshot(snapshot_path, source)
+        if df is None:
+            os.makedirs(self.snapshot_dir, exist_ok=True)
+            write_snapshot(pd.read_csv(path), snapshot_path, source)
+            df = read_snapshot(snapshot_path, source)
+        return df
 
     def load(self) -> "DataSource":
-        self.ventas = pd.read_csv(self.ventas_path)
-        self.inventario = pd.read_csv(self.inventario_path)
-        self.catalogo = pd.read_csv(self.catalogo_path)
-        self.tiendas = pd.read_csv(self.tiendas_path)
+        self._master_index = None
+        if self.partitions_dir is not None:
+            return self._load_partitions()
+        self.ventas = self._read_table(self.ventas_path, "ventas")
+        self.inventario = self._read_table(self.inventario_path, "inventario")
+        self.catalogo = self._read_table(self.catalogo_path, "catalogo")
+        self.tiendas = self._read_table(self.tiendas_path, "tiendas")
         return self
 
-    def sales_daily(self) -> pd.DataFrame:
-        v = self.ventas.copy()
+    # ----------------------------
+    # Layout particionado por tienda / ciudad
+    # ----------------------------
 
-        v["id_tienda"] = v["id_tienda"].astype(str)
-        v["id_producto"] = v["id_producto"].astype(str)
+    PARTITION_MANIFEST = "partitions.json"
+    # Partición de las tiendas sin ciudad (ausentes de maestro_tiendas o con ciudad nula)
+    SIN_CIUDAD = "__sin_ciudad__"
 
-        v["fecha"] = pd.to_datetime(v["fecha"])
-        min_date, max_date = v["fecha"].min(), v["fecha"].max()
-        all_dates = pd.date_range(start=min_date, end=max_date, freq="D")
+    def write_partitions(self, root: str, by: str = "id_tienda") -> Dict[str, Any]:
+        """
+        Escribe ventas e inventario en una partición por valor de `by` (`"id_tienda"` o
+        `"ciudad"` de maestro_tiendas) bajo `root/<by>=<valor>/`. Catálogo y tiendas se
+        escriben completos en `root` y un manifest JSON registra qué tiendas tiene cada
+        partición y su rango de fechas de venta. Con `by="ciudad"`, las tiendas sin ciudad
+        en maestro_tiendas van a la partición `SIN_CIUDAD` en lugar de perderse.
+        """
+        if by not in ("id_tienda", "ciudad"):
+            raise ValueError("by debe ser 'id_tienda' o 'ciudad'")
 
-        pairs = v[["id_tienda", "id_producto"]].drop_duplicates()
-        idx = pairs.merge(pd.DataFrame({"fecha": all_dates}), how="cross")
+        tds = self.tiendas.copy()
+        tds["id_tienda"] = tds["id_tienda"].astype(str)
+        ventas_tienda = self.ventas["id_tienda"].astype(str)
+        inv_tienda = self.inventario["id_tienda"].astype(str)
+
+        tiendas = pd.Index(ventas_tienda.unique()).union(inv_tienda.unique())
+        if by == "id_tienda":
+            partition_of = pd.Series(tiendas, index=tiendas)
+        else:
+            ciudad = tds.drop_duplicates("id_tienda").set_index("id_tienda")["ciudad"]
+            ciudad = ciudad.reindex(ciudad.index.union(tiendas))
+            partition_of = ciudad.astype(object).where(ciudad.notna(), self.SIN_CIUDAD).astype(str)
+
+        os.makedirs(root, exist_ok=True)
+        manifest: Dict[str, Any] = {"by": by, "partitions": {}}
+        for value, stores in partition_of.groupby(partition_of).groups.items():
+            value = str(value)
+            stores = sorted(str(t) for t in stores)
+            dirname = f"{by}={value}".replace(os.sep, "_")
+            part_path = os.path.join(root, dirname)
+            os.makedirs(part_path, exist_ok=True)
+            ventas = self.ventas[ventas_tienda.isin(stores).to_numpy()]
+            ventas.to_csv(os.path.join(part_path, "ventas_historicas.csv"), index=False)
+            self.inventario[inv_tienda.isin(stores).to_numpy()].to_csv(
+                os.path.join(part_path, "inventario_actual.csv"), index=False
+            )
+            manifest["partitions"][value] = {"dir": dirname, "tiendas": stores}
+            if len(ventas):
+                fechas = pd.to_datetime(ventas["fecha"])
+                manifest["partitions"][value]["fechas"] = [
+                    str(fechas.min().date()),
+                    str(fechas.max().date()),
+                ]
 
-        daily = (
+        self.catalogo.to_csv(os.path.join(root, "catalogo_productos.csv"), index=False)
+        self.tiendas.to_csv(os.path.join(root, "maestro_tiendas.csv"), index=False)
+        with open(os.path.join(root, self.PARTITION_MANIFEST), "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+        return manifest
+
+    @classmethod
+    def read_partition_manifest(cls, root: str) -> Dict[str, Any]:
+        with open(os.path.join(root, cls.PARTITION_MANIFEST), encoding="utf-8") as f:
+            return json.load(f)
+
+    @classmethod
+    def from_partitions(
+        cls,
+        root: str,
+        partitions: Optional[List[str]] = None,
+        snapshot_dir: Optional[str] = None,
+    ) -> "DataSource":
+        """DataSource (sin cargar) sobre un layout particionado, opcionalmente restringido."""
+        return cls(
+            ventas_path=os.path.join(root, "ventas_historicas.csv"),
+            inventario_path=os.path.join(root, "inventario_actual.csv"),
+            catalogo_path=os.path.join(root, "catalogo_productos.csv"),
+            tiendas_path=os.path.join(root, "maestro_tiendas.csv"),
+            snapshot_dir=snapshot_dir,
+            partitions_dir=root,
+            partitions=partitions,
+        )
+
+    def with_partitions(self, partitions: List[str]) -> "DataSource":
+        """Copia de este DataSource limitada a `partitions`, ya cargada."""
+        if self.partitions_dir is None:
+            raise ValueError("El DataSource no usa un layout particionado (partitions_dir)")
+        return replace(self, partitions=list(partitions)).load()
+
+    def _load_partitions(self) -> "DataSource":
+        manifest = self.read_partition_manifest(self.partitions_dir)
+        available = manifest["partitions"]
+        selected = list(available) if self.partitions is None else [str(p) for p in self.partitions]
+        unknown = [p for p in selected if p not in available]
+        if unknown:
+            raise ValueError(f"Particiones inexistentes: {unknown}")
+
+        ventas, inventario = [], []
+        for value in selected:
+            dirname = available[value]["dir"]
+            part_path = os.path.join(self.partitions_dir, dirname)
+            ventas.append(self._read_table(
+                os.path.join(part_path, "ventas_historicas.csv"), os.path.join(dirname, "ventas")
+            ))
+            inventario.append(self._read_table(
+                os.path.join(part_path, "inventario_actual.csv"), os.path.join(dirname, "inventario")
+            ))
+
+        self.ventas = pd.concat(ventas, ignore_index=True)
+        self.inventario = pd.concat(inventario, ignore_index=True)
+        self.catalogo = self._read_table(self.catalogo_path, "catalogo")
+        self.tiendas = self._read_table(self.tiendas_path, "tiendas")
+        return self
+
+    @staticmethod
+    def _normalize_ventas(v: pd.DataFrame) -> pd.DataFrame:
+        v["id_tienda"] = v["id_tienda"].astype(str)
+        v["id_producto"] = v["id_producto"].astype(str)
+        # Resolución fija: el CSV parseado y el snapshot darían unidades distintas (us / ns)
+        v["fecha"] = pd.to_datetime(v["fecha"]).astype("datetime64[ns]")
+        return v
+
+    @staticmethod
+    def _aggregate_daily(v: pd.DataFrame) -> pd.DataFrame:
+        return (
             v.groupby(["id_tienda", "id_producto", "fecha"], as_index=False)["unidades_vendidas"]
             .sum()
         )
 
+    @staticmethod
+    def _expand_panel(
+        pairs: pd.DataFrame, daily: pd.DataFrame, date_range: Optional[Tuple[pd.Timestamp, pd.Timestamp]] = None
+    ) -> pd.DataFrame:
+        min_date, max_date = date_range or (daily["fecha"].min(), daily["fecha"].max())
+        all_dates = pd.date_range(start=min_date, end=max_date, freq="D")
+
+        idx = pairs.merge(pd.DataFrame({"fecha": all_dates}), how="cross")
+
         panel = idx.merge(daily, on=["id_tienda", "id_producto", "fecha"], how="left")
         panel["unidades_vendidas"] = panel["unidades_vendidas"].fillna(0.0)
         return panel
 
+    def sales_daily(self, date_range: Optional[Tuple[pd.Timestamp, pd.Timestamp]] = None) -> pd.DataFrame:
+        """
+        Panel largo (tienda, producto, fecha) con relleno 0. `date_range` fija la grilla de
+        fechas (p. ej. `sales_date_range()` de todo el origen, al planificar por bloques);
+        por defecto va de la primera a la última venta de `self.ventas`.
+        """
+        v = self._normalize_ventas(self.ventas.copy())
+
+        pairs = v[["id_tienda", "id_producto"]].drop_duplicates()
+        daily = self._aggregate_daily(v)
+
+        return self._expand_panel(pairs, daily, date_range)
+
+    def sales_date_range(self) -> Optional[Tuple[pd.Timestamp, pd.Timestamp]]:
+        """
+        Primera y última fecha de venta de todo el origen (con layout particionado, de las
+        particiones seleccionadas, desde el manifest cuando lo registra). None si no hay ventas.
+        """
+        if self.partitions_dir is not None:
+            available = self.read_partition_manifest(self.partitions_dir)["partitions"]
+            selected = list(available) if self.partitions is None else [str(p) for p in self.partitions]
+            bounds = []
+            for value in selected:
+                entry = available[value]
+                if "fechas" in entry:
+                    bounds += entry["fechas"]
+                else:
+                    # Manifest anterior al registro de fechas: basta con leer la columna fecha
+                    path = os.path.join(self.partitions_dir, entry["dir"], "ventas_historicas.csv")
+                    fechas = pd.to_datetime(pd.read_csv(path, usecols=["fecha"])["fecha"])
+                    bounds += list(fechas.agg(["min", "max"]).dropna())
+            fechas = pd.to_datetime(pd.Series(bounds, dtype=object))
+        else:
+            fechas = pd.to_datetime(self.ventas["fecha"])
+        if len(fechas) == 0:
+            return None
+        return fechas.min().normalize(), fechas.max().normalize()
+
+    def sales_daily_streaming(self, chunksize: int = 1_000_000) -> pd.DataFrame:
+        """
+        Igual a `sales_daily()` pero leyendo `ventas_path` por bloques de `chunksize` filas
+        (no requiere `load()`). Cada bloque se agrega a (tienda, producto, fecha) y los
+        parciales se compactan a medida que crecen, de modo que la memoria pico es
+        proporcional a la salida agregada y no al archivo transaccional.
+        """
+        partials, pair_parts = [], []
+        # pending_rows: filas agregadas desde la última compactación (sin contar el compactado)
+        pending_rows, compacted_rows = 0, 0
+
+        for chunk in pd.read_csv(self.ventas_path, chunksize=chunksize):
+            chunk = self._normalize_ventas(chunk)
+            pair_parts.append(chunk[["id_tienda", "id_producto"]].drop_duplicates())
+            part = self._aggregate_daily(chunk)
+            partials.append(part)
+            pending_rows += len(part)
+
+            # Compactar cuando lo nuevo supera lo ya agregado: cada compactación cuesta
+            # a lo sumo el doble de lo nuevo, así que el costo amortizado es lineal
+            if pending_rows > max(compacted_rows, chunksize):
+                partials = [self._aggregate_daily(pd.concat(partials, ignore_index=True))]
+                pair_parts = [pd.concat(pair_parts, ignore_index=True).drop_duplicates()]
+                compacted_rows = len(partials[0])
+                pending_rows = 0
+
+        # drop_duplicates conserva la primera aparición: mismo orden de pares que sales_daily()
+        pairs = pd.concat(pair_parts, ignore_index=True).drop_duplicates()
+        daily = self._aggregate_daily(pd.concat(partials, ignore_index=True))
+
+        return self._expand_panel(pairs, daily)
+
+    def sales_matrix(self, date_range: Optional[Tuple[pd.Timestamp, pd.Timestamp]] = None) -> SalesMatrix:
+        """
+        Alternativa densa a `sales_daily()`: en lugar de cruzar cada par con cada fecha,
+        acumula las ventas crudas con un único scatter-add sobre una matriz float32
+        (n_series, n_days). `date_range` fija las columnas como en `sales_daily()`.
+        """
+        v = self.ventas
+        tiendas = v["id_tienda"].astype(str).to_numpy()
+        productos = v["id_producto"].astype(str).to_numpy()
+        fechas = pd.to_datetime(v["fecha"]).to_numpy().astype("datetime64[D]")
+
+        pair_codes, pairs = pd.MultiIndex.from_arrays([tiendas, productos]).factorize(sort=True)
+        if date_range is None:
+            min_date, max_date = fechas.min(), fechas.max()
+        else:
+            min_date, max_date = (np.datetime64(pd.Timestamp(d).date(), "D") for d in date_range)
+        day_codes = (fechas - min_date).astype(np.int64)
+        n_days = int((max_date - min_date).astype(np.int64)) + 1
+
+        values = np.zeros((len(pairs), n_days), dtype=np.float32)
+        units = pd.to_numeric(v["unidades_vendidas"], errors="coerce").fillna(0.0).to_numpy(dtype=np.float32)
+        np.add.at(values.reshape(-1), pair_codes.astype(np.int64) * n_days + day_codes, units)
+
+        return SalesMatrix(
+            values=values,
+            id_tienda=np.asarray(pairs.get_level_values(0), dtype=object),
+            id_producto=np.asarray(pairs.get_level_values(1), dtype=object),
+            fechas=pd.date_range(start=pd.Timestamp(min_date), periods=n_days, freq="D"),
+        )
+
+    def update_sales_matrix(self, state_dir: str, delta_path: Optional[str] = None) -> SalesMatrix:
+        """
+        Modo incremental del panel: mantiene la matriz y su watermark en `state_dir`.
+
+        - Primera corrida (sin estado): construye la matriz completa desde `self.ventas`.
+        - Corridas siguientes: lee solo `delta_path` (las ventas nuevas) y agrega los días
+          posteriores al watermark persistido. Si caben en la reserva del archivo se escriben
+          en su lugar sobre el memmap y solo se reescribe el manifest; el archivo completo se
+          reescribe únicamente al agotar la reserva o al aparecer pares nuevos.
+        """
+        matrix = SalesMatrix.load(state_dir, mmap=True, writable=delta_path is not None)
+        if matrix is None:
+            self.sales_matrix().save(state_dir)
+        elif delta_path is not None:
+            updated = matrix.append(pd.read_csv(delta_path))
+            if updated._buffer is not matrix._buffer:
+                updated.save(state_dir)
+            elif updated is not matrix:
+                # Días nuevos ya escritos sobre el memmap: basta con publicar el nuevo n_days
+                updated._buffer.flush()
+                updated._write_manifest(state_dir)
+        else:
+            return matrix
+        return SalesMatrix.load(state_dir, mmap=True)
+
     def master_store(self) -> pd.DataFrame:
         inv = self.inventario.copy()
         cat = self.catalogo.copy()
@@ -65,4 +948,23 @@ class DataSource:
         # Costo de overstock: costo de mantener inventario por semana
         m["costo_overstock"] = (m["costo_unitario"] + m["costo_almacenamiento_semanal"]).clip(lower=0.0)
 
-        return m
\ No newline at end of file
+        return m
+
+    def master_index(self) -> MasterIndex:
+        """`MasterIndex` construido una vez por carga (snapshot) y reutilizado."""
+        if getattr(self, "_master_index", None) is None:
+            self._master_index = MasterIndex.build(self.inventario, self.catalogo, self.tiendas)
+        return self._master_index
+
+    def publish_shared(self, dense: bool = True, prefix: Optional[str] = None) -> SharedTables:
+        """
+        Publica el panel de ventas (`"ventas"`: matriz densa si `dense`, si no el panel largo)
+        y `master_store()` (`"master"`) en memoria compartida para workers multi-proceso.
+
+        Uso:
+            shared = repo.publish_shared()
+            pool.map(worker, [(shared.spec, ...), ...])   # worker: SharedTables.attach(spec)
+            shared.unlink()
+        """
+        panel = self.sales_matrix() if dense else self.sales_daily()
+        return SharedTables.publish({"ventas": panel, "master": self.master_store()}, prefix=prefix)
@@ -194,7 +194,7 @@ class InventoryOptimizer:
         costo_esperado = np.mean(costos)
         return costo_esperado
     
-    def optimizar_cantidad_pedido(self, df_pronosticos, df_inventario):
+    def optimizar_cantidad_pedido(self, df_pronosticos, df_inventario, master_index=None):
         """
         Optimiza la cantidad de pedido para cada SKU-Tienda
         
@@ -202,7 +202,18 @@ class InventoryOptimizer:
         1. Ratio de margen (margen_unitario / costo_overstock)
         2. Incertidumbre del pronóstico
         3. Stock actual
+
+        master_index: opcional, `data_source.MasterIndex` ya construido; si no se pasa,
+        el stock se indexa una sola vez por (tienda, producto) en lugar de filtrar
+        df_inventario en cada fila.
         """
+        if master_index is None:
+            stock_lookup = (
+                df_inventario.drop_duplicates(['id_tienda', 'id_producto'])
+                .set_index(['id_tienda', 'id_producto'])['stock_actual']
+                .to_dict()
+            )
+        
         resultados = []
         
         for _, row in df_pronosticos.iterrows():
@@ -216,15 +227,11 @@ class InventoryOptimizer:
             costo_almacenamiento = prod_info['costo_almacenamiento_semanal']
             
             # Obtener stock actual
-            stock_actual = df_inventario[
-                (df_inventario['id_tienda'] == tienda) & 
-                (df_inventario['id_producto'] == producto)
-            ]['stock_actual'].values
-            
-            if len(stock_actual) == 0:
-                stock_actual = 0
+            if master_index is None:
+                stock_actual = stock_lookup.get((tienda, producto), 0)
             else:
-                stock_actual = stock_actual[0]
+                fila = master_index.lookup(tienda, producto)
+                stock_actual = master_index.columns['stock_actual'][fila] if fila >= 0 else 0
             
             # Parámetros del pronóstico
             demanda_pronostico = row['demanda_pronosticada']
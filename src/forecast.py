@@ -1,12 +1,22 @@
 from dataclasses import dataclass
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from contextlib import contextmanager
+import hashlib
+import json
+import math
+import os
+import time
+import zlib
 import pandas as pd
 import numpy as np
-from typing import Tuple, List, Optional
+from typing import Any, Dict, Tuple, List, Optional
 
 import matplotlib.pyplot as plt
 from scipy import stats
 
 from prophet import Prophet
+from prophet.serialize import model_to_json, model_from_json
 
 
 @dataclass(frozen=True)
@@ -18,6 +28,299 @@ class ForecastResult:
     last_date: pd.Timestamp
 
 
+@dataclass
+class ForecastArrays:
+    """
+    Pronóstico multi-horizonte en formato struct-of-arrays (sin un objeto por serie).
+
+    Fila i = serie (tiendas[tienda_code[i]], productos[producto_code[i]]); columna k = semana
+    k+1 después de `last_date[i]` (último día observado). `mu` / `sigma` son la media y la
+    desviación de la demanda de cada bloque de `week_days` días.
+    """
+    tiendas: np.ndarray
+    productos: np.ndarray
+    tienda_code: np.ndarray
+    producto_code: np.ndarray
+    mu: np.ndarray
+    sigma: np.ndarray
+    last_date: np.ndarray
+    week_days: int = 7
+
+    @classmethod
+    def from_labels(cls, tiendas, productos, mu, sigma, last_date, week_days: int = 7, dtype=np.float32):
+        t_code, t_uniq = pd.factorize(np.asarray(tiendas, dtype=object))
+        p_code, p_uniq = pd.factorize(np.asarray(productos, dtype=object))
+        return cls(
+            tiendas=np.asarray(t_uniq, dtype=object),
+            productos=np.asarray(p_uniq, dtype=object),
+            tienda_code=t_code.astype(np.int32),
+            producto_code=p_code.astype(np.int32),
+            mu=np.asarray(mu, dtype=dtype),
+            sigma=np.asarray(sigma, dtype=dtype),
+            last_date=np.asarray(last_date, dtype="datetime64[D]"),
+            week_days=week_days,
+        )
+
+    @property
+    def n_series(self) -> int:
+        return self.mu.shape[0]
+
+    @property
+    def n_weeks(self) -> int:
+        return self.mu.shape[1]
+
+    @property
+    def id_tienda(self) -> np.ndarray:
+        return self.tiendas[self.tienda_code]
+
+    @property
+    def id_producto(self) -> np.ndarray:
+        return self.productos[self.producto_code]
+
+    def week_end(self, week: int) -> np.ndarray:
+        """Último día cubierto por la semana `week` (0 = próxima semana)."""
+        return self.last_date + np.timedelta64(self.week_days * (week + 1), "D")
+
+    def quantiles(self, q) -> np.ndarray:
+        """Cuantiles Normales truncados en 0: (n, H) para un `q` escalar, (n, H, Q) para una lista."""
+        z = stats.norm.ppf(np.asarray(q, dtype=float))
+        out = self.mu[..., None] + self.sigma[..., None] * z.reshape(1, 1, -1)
+        out = np.maximum(out, 0.0).astype(self.mu.dtype)
+        return out[..., 0] if np.ndim(q) == 0 else out
+
+    def cumulative(self) -> Tuple[np.ndarray, np.ndarray]:
+        """Demanda acumulada hasta cada semana: (mu, sigma) con semanas independientes."""
+        mu = np.cumsum(self.mu, axis=1, dtype=np.float64)
+        sigma = np.sqrt(np.cumsum(np.square(self.sigma, dtype=np.float64), axis=1))
+        return mu.astype(self.mu.dtype), sigma.astype(self.sigma.dtype)
+
+    def week_frame(self, week: int = 0) -> pd.DataFrame:
+        """La semana `week` con el esquema de `fit_predict_week`."""
+        return pd.DataFrame({
+            "id_tienda": self.id_tienda,
+            "id_producto": self.id_producto,
+            "mu_semana": self.mu[:, week].astype(float),
+            "sigma_semana": self.sigma[:, week].astype(float),
+            "last_date": pd.DatetimeIndex(self.week_end(week)),
+        })
+
+    def to_frame(self) -> pd.DataFrame:
+        """Formato largo (una fila por serie y semana)."""
+        n, h = self.mu.shape
+        return pd.DataFrame({
+            "id_tienda": np.repeat(self.id_tienda, h),
+            "id_producto": np.repeat(self.id_producto, h),
+            "semana": np.tile(np.arange(1, h + 1, dtype=np.int16), n),
+            "mu_semana": self.mu.reshape(-1),
+            "sigma_semana": self.sigma.reshape(-1),
+            "last_date": pd.DatetimeIndex(
+                (self.last_date[:, None] + np.arange(1, h + 1) * np.timedelta64(self.week_days, "D")).reshape(-1)
+            ),
+        })
+
+
+@dataclass
+class SeriesPanel:
+    """
+    Series diarias en una matriz sobre la grilla `fechas` (p. ej. agregados de la jerarquía
+    o el subconjunto de series que va a un motor). Expone la misma interfaz que `SalesMatrix` (`values`, `id_tienda`, `id_producto`,
+    `fechas`, `iter_series()`); cada serie se recorta a su primer/último día con datos.
+    """
+    values: np.ndarray
+    id_tienda: np.ndarray
+    id_producto: np.ndarray
+    fechas: pd.DatetimeIndex
+    start: np.ndarray
+    end: np.ndarray
+
+    def iter_series(self):
+        for i in range(len(self.values)):
+            s, e = int(self.start[i]), int(self.end[i]) + 1
+            yield self.id_tienda[i], self.id_producto[i], self.values[i, s:e], self.fechas[s:e]
+
+
+class ModelCache:
+    """
+    Cache en disco de modelos Prophet ajustados.
+
+    La llave es un hash de los valores de la serie, su fecha inicial y los hiperparámetros
+    del forecaster: si la historia no cambió, el modelo se carga en lugar de re-ajustarse.
+    Cada entrada guarda también los pronósticos semanales ya calculados por horizonte,
+    de modo que una re-corrida sin cambios tampoco vuelve a predecir.
+
+    Al superar `max_bytes` se eliminan las entradas usadas menos recientemente hasta bajar a
+    `low_watermark` · max_bytes, así cada evicción deja margen para varias escrituras. El
+    orden de uso (mtime en disco) se mantiene en memoria: el directorio se recorre una vez
+    por proceso, en la primera escritura.
+    """
+
+    def __init__(self, cache_dir: str, max_bytes: int = 1 << 30, low_watermark: float = 0.9):
+        if not 0.0 <= low_watermark <= 1.0:
+            raise ValueError("low_watermark debe estar en [0, 1]")
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.low_watermark = low_watermark
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        os.makedirs(cache_dir, exist_ok=True)
+        # ruta -> tamaño, de menos a más recientemente usada (None = aún no se recorrió el directorio)
+        self._index: "Optional[OrderedDict[str, int]]" = None
+        self._size = 0
+
+    def __getstate__(self) -> Dict[str, Any]:
+        # Cada proceso arma su propio índice: otros procesos pueden escribir en el directorio
+        state = self.__dict__.copy()
+        state["_index"] = None
+        state["_size"] = 0
+        return state
+
+    @staticmethod
+    def make_key(y: np.ndarray, start: pd.Timestamp, params: Dict[str, Any]) -> str:
+        h = hashlib.sha1()
+        h.update(np.ascontiguousarray(y, dtype=np.float64).tobytes())
+        h.update(str(pd.Timestamp(start).date()).encode("utf-8"))
+        h.update(json.dumps(params, sort_keys=True).encode("utf-8"))
+        return h.hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], f"{key}.json")
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        path = self._path(key)
+        try:
+            with open(path, encoding="utf-8") as f:
+                entry = json.load(f)
+            os.utime(path)  # marca de uso para la evicción LRU
+        except (FileNotFoundError, json.JSONDecodeError):
+            self.misses += 1
+            return None
+        if self._index is not None and path in self._index:
+            self._index.move_to_end(path)
+        self.hits += 1
+        return entry
+
+    def put(self, key: str, entry: Dict[str, Any]) -> None:
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(entry, f)
+        os.replace(tmp_path, path)
+
+        index = self._load_index()
+        size = os.path.getsize(path)
+        self._size += size - index.pop(path, 0)
+        index[path] = size
+        if self._size > self.max_bytes:
+            self._evict()
+
+    def refresh(self) -> None:
+        """Descarta el índice en memoria; se vuelve a leer del disco en la próxima escritura."""
+        self._index = None
+        self._size = 0
+
+    def _entries(self) -> List[Tuple[float, int, str]]:
+        entries = []
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                if name.endswith(".json"):
+                    full = os.path.join(root, name)
+                    try:
+                        st = os.stat(full)
+                    except FileNotFoundError:
+                        continue
+                    entries.append((st.st_mtime, st.st_size, full))
+        return entries
+
+    def _load_index(self) -> "OrderedDict[str, int]":
+        if self._index is None:
+            self._index = OrderedDict((full, size) for _, size, full in sorted(self._entries()))
+            self._size = sum(self._index.values())
+        return self._index
+
+    def _evict(self) -> None:
+        target = self.low_watermark * self.max_bytes
+        while self._index and self._size > target:
+            full, size = self._index.popitem(last=False)
+            try:
+                os.remove(full)
+                self.evictions += 1
+            except FileNotFoundError:
+                pass
+            self._size -= size
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+
+class ModelRegistry:
+    """
+    Registro LRU en memoria de modelos Prophet ajustados, por (tienda, producto).
+
+    Cada entrada guarda la huella de la serie con que se ajustó (ver `ModelCache.make_key`),
+    el modelo y las predicciones ya calculadas para graficar; si la serie cambió, la entrada
+    no se reutiliza. `save` / `load` persisten los modelos entre sesiones.
+    """
+
+    def __init__(self, max_models: int = 128):
+        self.max_models = max_models
+        self._entries: "OrderedDict[Tuple[str, str], Dict[str, Any]]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, series: Tuple[str, str]) -> bool:
+        return series in self._entries
+
+    def get(self, tienda: str, producto: str, key: str) -> Optional[Dict[str, Any]]:
+        entry = self._entries.get((tienda, producto))
+        if entry is None or entry["key"] != key:
+            return None
+        self._entries.move_to_end((tienda, producto))
+        return entry
+
+    def put(self, tienda: str, producto: str, key: str, model: Prophet) -> Dict[str, Any]:
+        entry = {"key": key, "model": model, "predictions": {}}
+        self._entries[(tienda, producto)] = entry
+        self._entries.move_to_end((tienda, producto))
+        while len(self._entries) > self.max_models:
+            self._entries.popitem(last=False)
+        return entry
+
+    def to_json(self, series: Optional[List[Tuple[str, str]]] = None) -> Dict[str, Dict[str, str]]:
+        """Modelos serializados (todos, o sólo las combinaciones de `series` presentes)."""
+        keys = list(self._entries) if series is None else [s for s in series if s in self._entries]
+        return {
+            f"{t}|{p}": {"key": self._entries[(t, p)]["key"], "model": model_to_json(self._entries[(t, p)]["model"])}
+            for t, p in keys
+        }
+
+    def update_from_json(self, payload: Dict[str, Dict[str, str]]) -> None:
+        for name, item in payload.items():
+            tienda, producto = name.split("|", 1)
+            self.put(tienda, producto, item["key"], model_from_json(item["model"]))
+
+    def save(self, path: str) -> None:
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.to_json(), f)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str, max_models: int = 128) -> "ModelRegistry":
+        registry = cls(max_models)
+        with open(path, encoding="utf-8") as f:
+            registry.update_from_json(json.load(f))
+        return registry
+
+
 class DemandForecaster:
     """
     Pronóstico con Prophet:
@@ -38,7 +341,60 @@ class DemandForecaster:
         yearly_seasonality: bool = False,
         seasonality_mode: str = "additive",
         changepoint_prior_scale: float = 0.05,
+        n_jobs: int = 1,
+        chunk_size: Optional[int] = None,
+        random_state: Optional[int] = None,
+        engine: str = "prophet",
+        fourier_order: int = 3,
+        fourier_window_days: Optional[int] = 182,
+        model_cache: Optional[ModelCache] = None,
+        warm_start: bool = False,
+        registry_size: int = 128,
+        hierarchy: Optional[str] = None,
+        store_city: Optional[Dict[str, str]] = None,
+        reconciliation: str = "top_down",
+        share_window_days: int = 56,
+        intermittent: Optional[str] = None,
+        intermittent_classes: Tuple[str, ...] = ("intermittent", "lumpy"),
+        intermittent_alpha: float = 0.1,
     ):
+        """
+        intermittent: None (todas las series al motor) o "croston" / "sba" / "tsb": las
+            series se clasifican por ADI/CV² (`classify_demand`) y las de
+            `intermittent_classes` se pronostican con ese estimador vectorizado en lugar de
+            Prophet. La salida agrega la columna `clase_demanda`.
+        intermittent_alpha: constante de suavizamiento de tamaño/intervalo (y probabilidad en TSB).
+        hierarchy: None (un modelo por tienda x producto) o el nivel agregado que se modela:
+            "producto", "ciudad_producto" (requiere `store_city`, tienda -> ciudad) o "tienda".
+            Los pronósticos del nivel agregado se reparten a tienda x producto con la
+            participación histórica de los últimos `share_window_days` días.
+        reconciliation: "top_down" (sólo participaciones) o "mint" (MinT-WLS: combina el
+            pronóstico agregado con un pronóstico base barato de cada hija, ponderando por
+            varianzas, de forma que las hijas suman exactamente el pronóstico reconciliado).
+        registry_size: modelos Prophet recientes que se conservan en `registry` (LRU) para
+            que los gráficos reutilicen los ajustes de `fit_predict_week` (0 = desactivado).
+            Se persiste entre sesiones con `registry.save(path)` / `ModelRegistry.load(path)`.
+        warm_start: si True, cada ajuste Prophet parte de los parámetros (k, m, delta, beta,
+            sigma_obs) del ajuste anterior de la misma serie en lugar de la inicialización por
+            defecto; el optimizador converge en menos iteraciones cuando la serie sólo ganó
+            unos días. Los parámetros viven en `warm_params` y se persisten entre corridas con
+            `save_warm_params` / `load_warm_params`; `fit_time_report()` compara los tiempos
+            de la última llamada de pronóstico.
+        model_cache: `ModelCache` opcional; las series cuya historia no cambió reutilizan
+            el modelo (y el pronóstico) guardados en lugar de re-ajustar Prophet.
+        engine: "prophet" (un modelo Prophet por serie) o "fourier" (regresión global
+            vectorizada: tendencia lineal + términos de Fourier semanales, resuelta para
+            todas las series con una única pseudo-inversa compartida).
+        fourier_order: número de armónicos semanales del motor "fourier".
+        fourier_window_days: días finales de historia usados por el motor "fourier" (None = todos).
+        n_jobs: procesos para `fit_predict_week` (1 = serial).
+        chunk_size: series por tarea enviada al pool (None = ~4 tareas por proceso).
+        random_state: None (por defecto) deja el RNG global sin tocar, como siempre: sigma
+            depende del estado global y la salida en paralelo no es reproducible. Con un entero,
+            cada serie usa una semilla derivada de (tienda, producto) para el muestreo de
+            incertidumbre de Prophet, así la salida es reproducible e idéntica en serial y en
+            paralelo (el RNG global se restaura después de cada serie).
+        """
         self.min_history_days = min_history_days
         self.interval_width = interval_width
         self.daily_seasonality = daily_seasonality
@@ -46,6 +402,56 @@ class DemandForecaster:
         self.yearly_seasonality = yearly_seasonality
         self.seasonality_mode = seasonality_mode
         self.changepoint_prior_scale = changepoint_prior_scale
+        self.n_jobs = n_jobs
+        self.chunk_size = chunk_size
+        self.random_state = random_state
+        if engine not in ("prophet", "fourier"):
+            raise ValueError("engine debe ser 'prophet' o 'fourier'")
+        self.engine = engine
+        self.fourier_order = fourier_order
+        self.fourier_window_days = fourier_window_days
+        self.model_cache = model_cache
+        self.warm_start = warm_start
+        self.warm_params: Dict[Tuple[str, str], Dict[str, Any]] = {}
+        self.fit_times: Dict[str, List[float]] = {"warm": [], "cold": []}
+        self.registry = ModelRegistry(registry_size)
+        if hierarchy not in (None, "producto", "ciudad_producto", "tienda"):
+            raise ValueError("hierarchy debe ser None, 'producto', 'ciudad_producto' o 'tienda'")
+        if hierarchy == "ciudad_producto" and store_city is None:
+            raise ValueError("hierarchy='ciudad_producto' requiere store_city")
+        if reconciliation not in ("top_down", "mint"):
+            raise ValueError("reconciliation debe ser 'top_down' o 'mint'")
+        self.hierarchy = hierarchy
+        self.store_city = store_city
+        self.reconciliation = reconciliation
+        self.share_window_days = share_window_days
+        if intermittent not in (None, "croston", "sba", "tsb"):
+            raise ValueError("intermittent debe ser None, 'croston', 'sba' o 'tsb'")
+        self.intermittent = intermittent
+        self.intermittent_classes = tuple(intermittent_classes)
+        self.intermittent_alpha = intermittent_alpha
+
+    def __getstate__(self) -> Dict[str, Any]:
+        # Los workers reciben una copia del forecaster por tarea: no se envían los modelos
+        # del registro (pesados) ni los parámetros de warm start / tiempos de todas las series;
+        # cada bloque recibe los parámetros de sus series y devuelve lo suyo en `_merge_worker_state`
+        state = self.__dict__.copy()
+        state["registry"] = ModelRegistry(self.registry.max_models)
+        state["warm_params"] = {}
+        state["fit_times"] = {"warm": [], "cold": []}
+        return state
+
+    def _model_params(self) -> Dict[str, Any]:
+        """Hiperparámetros que definen el ajuste (parte de la llave del cache)."""
+        return {
+            "interval_width": self.interval_width,
+            "daily_seasonality": self.daily_seasonality,
+            "weekly_seasonality": self.weekly_seasonality,
+            "yearly_seasonality": self.yearly_seasonality,
+            "seasonality_mode": self.seasonality_mode,
+            "changepoint_prior_scale": self.changepoint_prior_scale,
+            "random_state": self.random_state,
+        }
 
     def _make_model(self) -> Prophet:
         return Prophet(
@@ -57,88 +463,965 @@ class DemandForecaster:
             changepoint_prior_scale=self.changepoint_prior_scale,
         )
 
-    def fit_predict_week(self, sales_panel: pd.DataFrame, horizon_days: int = 7) -> pd.DataFrame:
-        df = sales_panel.copy()
-        df["id_tienda"] = df["id_tienda"].astype(str)
-        df["id_producto"] = df["id_producto"].astype(str)
-        df["fecha"] = pd.to_datetime(df["fecha"])
-        df["unidades_vendidas"] = pd.to_numeric(df["unidades_vendidas"], errors="coerce").fillna(0.0)
-
-        last_date_global = df["fecha"].max()
-
-        out = []
-        for (tienda, producto), g in df.groupby(["id_tienda", "id_producto"]):
-            g = g.sort_values("fecha")
-
-            # (1) Asegurar frecuencia diaria (relleno de faltantes con 0 o NaN según tu criterio)
-            # Aquí uso 0.0 (común en demanda: no venta = 0). Si prefieres NaN, cámbialo.
-            idx = pd.date_range(g["fecha"].min(), g["fecha"].max(), freq="D")
-            g2 = g.set_index("fecha").reindex(idx)
-            g2.index.name = "fecha"
-            g2["unidades_vendidas"] = g2["unidades_vendidas"].fillna(0.0)
-
-            y = g2["unidades_vendidas"].to_numpy()
-            last_date = g2.index.max()
-
-            # (2) Fallback si hay poco historial
-            if len(y) < self.min_history_days:
-                mu_d = float(np.mean(y)) if len(y) else 0.0
-                sigma_d = float(np.std(y)) if len(y) else 0.0
-                mu_w = max(0.0, horizon_days * mu_d)
-                sigma_w = max(1.0, np.sqrt(horizon_days) * max(sigma_d, 1.0))
-                forecast_end_date = last_date + pd.Timedelta(days=horizon_days)
-                out.append(
-                    ForecastResult(tienda, producto, mu_w, sigma_w, forecast_end_date)
-                )
-                continue
+    def _fallback_week(self, y: np.ndarray, horizon_days: int) -> Tuple[float, float]:
+        mu_d = float(np.mean(y)) if len(y) else 0.0
+        sigma_d = float(np.std(y)) if len(y) else 0.0
+        mu_w = max(0.0, horizon_days * mu_d)
+        sigma_w = max(1.0, np.sqrt(horizon_days) * max(sigma_d, 1.0))
+        return mu_w, sigma_w
 
+    def _forecast_series(
+        self,
+        tienda: str,
+        producto: str,
+        y: np.ndarray,
+        start: pd.Timestamp,
+        block_days: int,
+        n_blocks: int = 1,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Pronóstico de una serie diaria continua `y` que empieza en `start`, agregado en
+        `n_blocks` bloques consecutivos de `block_days` días: (mu, sigma), cada uno de largo
+        `n_blocks`. El DataFrame ds/y de Prophet sólo se construye si la serie llega a Prophet.
+        """
+        y = np.asarray(y, dtype=float)
+
+        # (2) Fallback si hay poco historial
+        if len(y) < self.min_history_days:
+            mu_w, sigma_w = self._fallback_week(y, block_days)
+            return np.full(n_blocks, mu_w), np.full(n_blocks, sigma_w)
+
+        memo = str(block_days) if n_blocks == 1 else f"{block_days}x{n_blocks}"
+        cache_key, entry = None, None
+        if self.model_cache is not None or self.registry.max_models > 0:
+            cache_key = ModelCache.make_key(y, start, self._model_params())
+        if self.model_cache is not None:
+            entry = self.model_cache.get(cache_key)
+            cached = entry["forecasts"].get(memo) if entry else None
+            if cached is not None:
+                return np.atleast_1d(np.asarray(cached[0], dtype=float)), np.atleast_1d(np.asarray(cached[1], dtype=float))
+
+        registered = self.registry.get(tienda, producto, cache_key) if cache_key else None
+        if registered is not None:
+            m = registered["model"]
+            if self.model_cache is not None and entry is None:
+                entry = {"model": model_to_json(m), "forecasts": {}}
+        elif entry is not None:
+            m = model_from_json(entry["model"])
+        else:
             # (3) Prophet requiere columnas ds, y
-            train = g2.reset_index().rename(columns={"fecha": "ds", "unidades_vendidas": "y"})
+            train = pd.DataFrame({"ds": pd.date_range(start, periods=len(y), freq="D"), "y": y})
 
             m = self._make_model()
             try:
-                m.fit(train)
+                self._fit_model(m, train, tienda, producto)
             except Exception:
                 # fallback robusto si Prophet falla por alguna razón
-                mu_d = float(np.mean(y))
-                sigma_d = float(np.std(y))
-                mu_w = max(0.0, horizon_days * mu_d)
-                sigma_w = max(1.0, np.sqrt(horizon_days) * max(sigma_d, 1.0))
-                forecast_end_date = last_date + pd.Timedelta(days=horizon_days)
-                out.append(
-                    ForecastResult(tienda, producto, mu_w, sigma_w, forecast_end_date)
-                )
-                continue
-
-            # (4) Predecir horizonte diario
-            future = m.make_future_dataframe(periods=horizon_days, freq="D", include_history=False)
+                mu_w, sigma_w = self._fallback_week(y, block_days)
+                return np.full(n_blocks, mu_w), np.full(n_blocks, sigma_w)
+            entry = {"model": model_to_json(m), "forecasts": {}} if self.model_cache is not None else None
+        if registered is None and self.registry.max_models > 0:
+            self.registry.put(tienda, producto, cache_key, m)
+
+        # (4) Predecir horizonte diario
+        with self._seed_series(tienda, producto):
+            future = m.make_future_dataframe(periods=block_days * n_blocks, freq="D", include_history=False)
             fcst = m.predict(future)[["ds", "yhat", "yhat_lower", "yhat_upper"]].copy()
 
-            # (5) Media semanal = suma de yhat (diario)
-            mu_w = float(np.maximum(0.0, fcst["yhat"]).sum())
-
-            # (6) Sigma semanal aproximada usando el ancho del intervalo (asumiendo Normal aprox)
-            z = stats.norm.ppf((1.0 + self.interval_width) / 2.0)
-            sigma_day = (fcst["yhat_upper"] - fcst["yhat_lower"]) / (2.0 * z)
-            sigma_day = sigma_day.clip(lower=1e-6)  # evitar ceros numéricos
-            sigma_w = float(np.sqrt(np.sum(np.square(sigma_day))))
-            sigma_w = max(1.0, sigma_w)
-
-            # Calcular la fecha final del pronóstico
-            forecast_end_date = last_date + pd.Timedelta(days=horizon_days)
-
-            out.append(
-                ForecastResult(
-                    id_tienda=tienda,
-                    id_producto=producto,
-                    mu_semana=mu_w,
-                    sigma_semana=sigma_w,
-                    last_date=forecast_end_date,
+        # (5) Media por bloque = suma de yhat (diario)
+        yhat = fcst["yhat"].to_numpy().reshape(n_blocks, block_days)
+        mu_w = np.maximum(0.0, yhat).sum(axis=1)
+
+        # (6) Sigma por bloque aproximada usando el ancho del intervalo (asumiendo Normal aprox)
+        z = stats.norm.ppf((1.0 + self.interval_width) / 2.0)
+        sigma_day = (fcst["yhat_upper"] - fcst["yhat_lower"]) / (2.0 * z)
+        sigma_day = sigma_day.clip(lower=1e-6).to_numpy().reshape(n_blocks, block_days)  # evitar ceros numéricos
+        sigma_w = np.maximum(1.0, np.sqrt(np.sum(np.square(sigma_day), axis=1)))
+
+        if self.model_cache is not None:
+            if n_blocks == 1:
+                entry["forecasts"][memo] = [float(mu_w[0]), float(sigma_w[0])]
+            else:
+                entry["forecasts"][memo] = [mu_w.tolist(), sigma_w.tolist()]
+            self.model_cache.put(cache_key, entry)
+
+        return mu_w, sigma_w
+
+    _WARM_PARAMS = ("k", "m", "sigma_obs", "delta", "beta")
+
+    def _fit_model(self, m: Prophet, train: pd.DataFrame, tienda: str, producto: str) -> None:
+        """Ajusta `m`; con `warm_start` arranca Stan desde los parámetros previos de la serie."""
+        init = self.warm_params.get((tienda, producto)) if self.warm_start else None
+        t0 = time.perf_counter()
+        if init is not None:
+            # Prophet valida las formas: si delta/beta no coinciden usa la inicialización por defecto
+            m.fit(train, init={
+                name: np.asarray(v, dtype=float) if isinstance(v, list) else v
+                for name, v in init.items()
+            })
+        else:
+            m.fit(train)
+        self.fit_times["warm" if init is not None else "cold"].append(time.perf_counter() - t0)
+
+        if self.warm_start:
+            params = {}
+            for name in self._WARM_PARAMS:
+                values = np.asarray(m.params[name])[0]
+                params[name] = float(values[0]) if name in ("k", "m", "sigma_obs") else values.tolist()
+            self.warm_params[(tienda, producto)] = params
+
+    def fit_time_report(self) -> Dict[str, Any]:
+        """Tiempos de ajuste Prophet con arranque en caliente vs. en frío."""
+        warm, cold = self.fit_times["warm"], self.fit_times["cold"]
+        mean_warm = float(np.mean(warm)) if warm else float("nan")
+        mean_cold = float(np.mean(cold)) if cold else float("nan")
+        return {
+            "n_warm": len(warm),
+            "n_cold": len(cold),
+            "mean_warm_s": mean_warm,
+            "mean_cold_s": mean_cold,
+            "reduction": 1.0 - mean_warm / mean_cold if warm and cold else float("nan"),
+        }
+
+    def save_warm_params(self, path: str) -> None:
+        payload = {f"{t}|{p}": params for (t, p), params in self.warm_params.items()}
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(payload, f)
+        os.replace(tmp_path, path)
+
+    def load_warm_params(self, path: str) -> "DemandForecaster":
+        with open(path, encoding="utf-8") as f:
+            payload = json.load(f)
+        for key, params in payload.items():
+            tienda, producto = key.split("|", 1)
+            self.warm_params[(tienda, producto)] = params
+        return self
+
+    def _registered_model(
+        self, tienda: str, producto: str, y: np.ndarray, fechas: pd.DatetimeIndex
+    ) -> Dict[str, Any]:
+        """
+        Entrada del registro (modelo + predicciones ya hechas) para la serie; si no está o la
+        serie cambió, intenta el `model_cache` y si no ajusta Prophet. Propaga errores de ajuste.
+        """
+        key = ModelCache.make_key(y, fechas[0], self._model_params())
+        registered = self.registry.get(tienda, producto, key)
+        if registered is not None:
+            return registered
+
+        cached = self.model_cache.get(key) if self.model_cache is not None else None
+        if cached is not None:
+            m = model_from_json(cached["model"])
+        else:
+            m = self._make_model()
+            self._fit_model(m, pd.DataFrame({"ds": fechas, "y": y}), tienda, producto)
+        if self.registry.max_models > 0:
+            return self.registry.put(tienda, producto, key, m)
+        return {"key": key, "model": m, "predictions": {}}
+
+    @staticmethod
+    def _registered_predict(entry: Dict[str, Any], horizon_days: int = 0) -> pd.DataFrame:
+        """Predicción sobre el histórico + `horizon_days` días, memorizada en la entrada."""
+        if horizon_days not in entry["predictions"]:
+            m = entry["model"]
+            future = m.make_future_dataframe(periods=horizon_days, freq="D", include_history=True)
+            entry["predictions"][horizon_days] = m.predict(future)[["ds", "yhat", "yhat_lower", "yhat_upper"]]
+        return entry["predictions"][horizon_days]
+
+    @contextmanager
+    def _seed_series(self, tienda: str, producto: str):
+        """
+        Siembra el RNG global (Prophet muestrea la incertidumbre con `np.random`) con una
+        semilla derivada de la serie y restaura el estado previo al salir.
+        """
+        if self.random_state is None:
+            yield
+            return
+        state = np.random.get_state()
+        key = f"{tienda}|{producto}".encode("utf-8")
+        np.random.seed((zlib.crc32(key) + self.random_state) % (2**32))
+        try:
+            yield
+        finally:
+            np.random.set_state(state)
+
+    def _forecast_chunk(self, chunk: list, block_days: int, n_blocks: int = 1) -> Tuple[np.ndarray, np.ndarray]:
+        mu = np.zeros((len(chunk), n_blocks))
+        sigma = np.ones((len(chunk), n_blocks))
+        for i, (tienda, producto, y, start) in enumerate(chunk):
+            mu[i], sigma[i] = self._forecast_series(tienda, producto, y, start, block_days, n_blocks)
+        return mu, sigma
+
+    @staticmethod
+    def _split_panel(
+        sales_panel: pd.DataFrame,
+        value_col: str = "unidades_vendidas",
+        pairs: Optional[List[Tuple[str, str]]] = None,
+    ):
+        """
+        Divide el panel largo en series diarias continuas con un solo ordenamiento.
+
+        Equivale a groupby(id_tienda, id_producto) + reindex diario con relleno 0 (mismo orden
+        de series), pero sin pandas por grupo: se ordena una vez por (serie, día), se calculan
+        los límites de cada grupo y todas las series se escriben en un único buffer plano.
+        Genera (tienda, producto, y, start), donde `y` es una vista del buffer y `start` el
+        primer día de la serie. `pairs` restringe la salida a esas combinaciones.
+        """
+        tiendas = sales_panel["id_tienda"].astype(str).to_numpy()
+        productos = sales_panel["id_producto"].astype(str).to_numpy()
+        values = pd.to_numeric(sales_panel[value_col], errors="coerce").fillna(0.0).to_numpy(dtype=float)
+        days = pd.to_datetime(sales_panel["fecha"]).to_numpy().astype("datetime64[D]").astype(np.int64)
+
+        if pairs is not None:
+            wanted = pd.MultiIndex.from_tuples([(str(t), str(p)) for t, p in pairs])
+            mask = pd.MultiIndex.from_arrays([tiendas, productos]).isin(wanted)
+            tiendas, productos, values, days = tiendas[mask], productos[mask], values[mask], days[mask]
+        if len(days) == 0:
+            return
+
+        t_code, t_uniq = pd.factorize(tiendas, sort=True)
+        p_code, p_uniq = pd.factorize(productos, sort=True)
+        pair = t_code.astype(np.int64) * len(p_uniq) + p_code
+
+        order = np.lexsort((days, pair))
+        pair, days, values = pair[order], days[order], values[order]
+
+        bounds = np.flatnonzero(np.diff(pair)) + 1
+        first = np.concatenate(([0], bounds))
+        last = np.concatenate((bounds, [len(pair)])) - 1
+        starts = days[first]
+        lengths = days[last] - starts + 1
+        offsets = np.concatenate(([0], np.cumsum(lengths)))
+
+        # Un buffer para todas las series; los días faltantes quedan en 0 (no venta)
+        group = np.repeat(np.arange(len(first)), last - first + 1)
+        buf = np.zeros(int(offsets[-1]), dtype=float)
+        np.add.at(buf, offsets[group] + (days - starts[group]), values)
+
+        pair_first = pair[first]
+        start_dates = starts.astype("datetime64[D]")
+        for i in range(len(first)):
+            t_i, p_i = divmod(int(pair_first[i]), len(p_uniq))
+            yield (
+                t_uniq[t_i],
+                p_uniq[p_i],
+                buf[offsets[i]:offsets[i + 1]],
+                pd.Timestamp(start_dates[i]),
+            )
+
+    def _select_series(
+        self,
+        sales_panel: pd.DataFrame,
+        id_tienda: str,
+        id_producto: str,
+        value_col: str = "unidades_vendidas",
+    ) -> Tuple[np.ndarray, pd.DatetimeIndex]:
+        """(y, fechas) diarios de una combinación, sin copiar ni convertir el panel completo."""
+        for _, _, y, start in self._split_panel(sales_panel, value_col, pairs=[(id_tienda, id_producto)]):
+            return y, pd.date_range(start, periods=len(y), freq="D")
+        return np.zeros(0), pd.DatetimeIndex([])
+
+    def fit_predict_week(self, sales_panel, horizon_days: int = 7) -> pd.DataFrame:
+        """
+        `sales_panel` puede ser el panel largo de `DataSource.sales_daily()` o la matriz
+        densa de `DataSource.sales_matrix()` (cualquier objeto con `iter_series()`).
+        """
+        tiendas, productos, last_day, mu, sigma, extra = self._forecast_blocks(sales_panel, horizon_days, 1)
+        out = pd.DataFrame({
+            "id_tienda": tiendas,
+            "id_producto": productos,
+            "mu_semana": mu[:, 0],
+            "sigma_semana": sigma[:, 0],
+            "last_date": last_day + pd.Timedelta(days=horizon_days),
+        })
+        for name, values in extra.items():
+            out[name] = values
+        return out
+
+    def fit_predict_horizons(self, sales_panel, n_weeks: int = 4) -> ForecastArrays:
+        """
+        Pronóstico de las próximas `n_weeks` semanas en una sola pasada: `ForecastArrays` con
+        mu/sigma float32 de forma (n_series, n_weeks) e ids enteros de tienda/producto.
+        Usa el mismo motor que `fit_predict_week`: la media de la semana 1 coincide con su
+        salida. Con Prophet la sigma sale de muestrear trayectorias sobre todo el horizonte,
+        así que la de la semana 1 coincide sólo en distribución (difiere en el ruido del
+        muestreo, unos pocos %); con engine="fourier" la sigma es analítica y coincide exactamente.
+        """
+        tiendas, productos, last_day, mu, sigma, _ = self._forecast_blocks(sales_panel, 7, n_weeks)
+        return ForecastArrays.from_labels(tiendas, productos, mu, sigma, np.asarray(last_day, dtype="datetime64[D]"))
+
+    def fit_predict_week_budget(
+        self,
+        sales_panel,
+        time_budget_s: float,
+        value: Optional[pd.DataFrame] = None,
+        horizon_days: int = 7,
+        recent_days: int = 28,
+    ) -> pd.DataFrame:
+        """
+        Pronóstico con tiempo límite: las series se ajustan con Prophet en orden de valor de
+        negocio hasta agotar `time_budget_s`; el resto queda con el fallback media/std.
+
+        value: tabla con id_tienda, id_producto y margen_unitario (p. ej. `master_store()`);
+            prioridad = margen_unitario x unidades de los últimos `recent_days` días. Sin
+            `value` la prioridad es sólo el volumen reciente.
+
+        Antes de cada ajuste se estima si cabe en lo que queda del presupuesto (con el tiempo
+        medio de los ajustes anteriores), así el límite no se excede por un ajuste largo.
+        La salida agrega la columna `metodo` ("prophet" / "fallback") y el uso del presupuesto
+        queda en `last_budget_report`.
+
+        Con `intermittent`, las series intermitentes se pronostican con el estimador
+        vectorizado (como en `fit_predict_week`, `metodo` = su nombre) sin consumir
+        presupuesto y la salida agrega `clase_demanda`. `engine="fourier"` y `hierarchy`
+        no ajustan un Prophet por serie, así que no se combinan con un presupuesto.
+        """
+        if self.engine != "prophet" or self.hierarchy is not None:
+            raise ValueError(
+                "fit_predict_week_budget reparte ajustes Prophet por serie: no aplica con "
+                "engine='fourier' ni con hierarchy (usar fit_predict_week)"
+            )
+        self.fit_times = {"warm": [], "cold": []}
+        t0 = time.perf_counter()
+        if isinstance(sales_panel, pd.DataFrame):
+            series = list(self._split_panel(sales_panel))
+        else:
+            series = [(t, p, y, fechas[0]) for t, p, y, fechas in sales_panel.iter_series()]
+        n = len(series)
+        tiendas = np.asarray([t for t, _, _, _ in series], dtype=object)
+        productos = np.asarray([p for _, p, _, _ in series], dtype=object)
+        lengths = np.asarray([len(y) for _, _, y, _ in series], dtype=np.int64)
+        volume = np.asarray([float(np.sum(y[-recent_days:])) for _, _, y, _ in series])
+
+        margen = np.ones(n)
+        if value is not None:
+            keys = pd.MultiIndex.from_arrays([value["id_tienda"].astype(str), value["id_producto"].astype(str)])
+            pos = keys.get_indexer(pd.MultiIndex.from_arrays([tiendas.astype(str), productos.astype(str)]))
+            margen = np.where(pos >= 0, value["margen_unitario"].to_numpy(dtype=float)[pos], 0.0)
+        priority = margen * volume
+
+        # Todas las series parten con el fallback barato; Prophet lo reemplaza mientras haya tiempo
+        mu = np.zeros(n)
+        sigma = np.ones(n)
+        for i, (_, _, y, _) in enumerate(series):
+            mu[i], sigma[i] = self._fallback_week(np.asarray(y, dtype=float), horizon_days)
+        metodo = np.full(n, "fallback", dtype=object)
+
+        extra: Dict[str, np.ndarray] = {}
+        routed = np.zeros(n, dtype=bool)
+        if self.intermittent is not None:
+            # Series alineadas a la derecha: fuera de [start, end] la fila es 0
+            width = int(lengths.max()) if n else 0
+            Y = np.zeros((n, width), dtype=np.float32)
+            for i, (_, _, y, _) in enumerate(series):
+                Y[i, width - len(y):] = y
+            start, end = width - lengths, np.full(n, width - 1, dtype=np.int64)
+            clase = self.classify_demand(Y, start, end)
+            routed = np.isin(clase, self.intermittent_classes)
+            idx = np.flatnonzero(routed)
+            if len(idx):
+                mu[idx], sigma[idx] = self._intermittent_week(Y[idx], start[idx], end[idx], horizon_days)
+                metodo[idx] = self.intermittent
+            extra["clase_demanda"] = clase
+
+        eligible = (lengths >= self.min_history_days) & ~routed
+        order = [i for i in np.argsort(-priority, kind="stable") if eligible[i]]
+        if self.n_jobs <= 1:
+            done = self._budget_serial(series, order, horizon_days, t0, time_budget_s, mu, sigma)
+        else:
+            done = self._budget_parallel(series, order, horizon_days, t0, time_budget_s, mu, sigma)
+        metodo[done] = "prophet"
+
+        elapsed = time.perf_counter() - t0
+        total_value = float(priority.sum())
+        self.last_budget_report = {
+            "budget_s": float(time_budget_s),
+            "elapsed_s": elapsed,
+            "budget_used": elapsed / time_budget_s if time_budget_s > 0 else float("inf"),
+            "n_series": n,
+            "n_prophet": len(done),
+            "n_fallback_presupuesto": len(order) - len(done),
+            "n_fallback_historial": int(((lengths < self.min_history_days) & ~routed).sum()),
+            "n_intermitente": int(routed.sum()),
+            "valor_cubierto": float(priority[done].sum()) / total_value if total_value > 0 else 0.0,
+        }
+
+        out = pd.DataFrame({
+            "id_tienda": tiendas,
+            "id_producto": productos,
+            "mu_semana": mu,
+            "sigma_semana": sigma,
+            "last_date": pd.DatetimeIndex([start + pd.Timedelta(days=len(y) - 1 + horizon_days) for _, _, y, start in series]),
+            "metodo": metodo,
+        })
+        for name, values in extra.items():
+            out[name] = values
+        return out
+
+    def _budget_serial(self, series, order, horizon_days, t0, budget, mu, sigma) -> List[int]:
+        done: List[int] = []
+        for i in order:
+            elapsed = time.perf_counter() - t0
+            mean_fit = (elapsed / len(done)) if done else 0.0
+            if elapsed + mean_fit > budget:
+                break
+            tienda, producto, y, start = series[i]
+            mu_i, sigma_i = self._forecast_series(tienda, producto, y, start, horizon_days)
+            mu[i], sigma[i] = mu_i[0], sigma_i[0]
+            done.append(i)
+        return done
+
+    def _budget_parallel(self, series, order, horizon_days, t0, budget, mu, sigma) -> List[int]:
+        """
+        Envía bloques en orden de prioridad, con a lo más 2 * n_jobs en vuelo, mientras los
+        bloques en cola más el nuevo quepan en el presupuesto según el tiempo medio por bloque.
+        """
+        chunk_size = self.chunk_size or 4
+        chunks = [order[k:k + chunk_size] for k in range(0, len(order), chunk_size)]
+        done: List[int] = []
+        chunk_times: List[float] = []
+        in_flight = {}
+
+        def collect(futures):
+            for fut in futures:
+                idx = in_flight.pop(fut)
+                (mu_c, sigma_c), state = fut.result()
+                mu[idx], sigma[idx] = mu_c[:, 0], sigma_c[:, 0]
+                chunk_times.append(state["elapsed_s"])
+                self._merge_worker_state(state)
+                done.extend(idx)
+
+        with ProcessPoolExecutor(max_workers=self.n_jobs) as pool:
+            for idx in chunks:
+                # Sin tiempos medidos aún, sólo un bloque por proceso
+                max_in_flight = 2 * self.n_jobs if chunk_times else self.n_jobs
+                while len(in_flight) >= max_in_flight:
+                    finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                    collect(finished)
+                    max_in_flight = 2 * self.n_jobs
+                # Lo que falta en cola + este bloque, repartido entre los procesos
+                mean_chunk = float(np.mean(chunk_times)) if chunk_times else 0.0
+                projected = math.ceil((len(in_flight) + 1) / self.n_jobs) * mean_chunk
+                if time.perf_counter() - t0 + projected > budget:
+                    break
+                chunk = [series[i] for i in idx]
+                fut = pool.submit(self._forecast_chunk_worker, chunk, horizon_days, 1, self._chunk_warm_params(chunk))
+                in_flight[fut] = idx
+            collect(list(wait(in_flight).done))
+        return done
+
+    def _forecast_blocks(self, sales_panel, block_days: int, n_blocks: int):
+        """
+        Núcleo común: (tiendas, productos, last_day, mu, sigma, extra) con mu/sigma de forma
+        (n_series, n_blocks), `last_day` el último día observado y `extra` columnas adicionales.
+        """
+        self.fit_times = {"warm": [], "cold": []}
+        if self.hierarchy is not None:
+            return self._forecast_hierarchical(sales_panel, block_days, n_blocks)
+        return self._forecast_flat(sales_panel, block_days, n_blocks)
+
+    def _forecast_flat(self, sales_panel, block_days: int, n_blocks: int):
+        if self.intermittent is not None:
+            return self._forecast_routed(sales_panel, block_days, n_blocks)
+        return self._forecast_engine(sales_panel, block_days, n_blocks)
+
+    def _forecast_engine(self, sales_panel, block_days: int, n_blocks: int):
+        if self.engine == "fourier":
+            return self._forecast_fourier(sales_panel, block_days, n_blocks)
+
+        if isinstance(sales_panel, pd.DataFrame):
+            series = self._split_panel(sales_panel)
+        else:
+            series = ((t, p, y, fechas[0]) for t, p, y, fechas in sales_panel.iter_series())
+
+        if self.n_jobs <= 1:
+            tiendas, productos, last_day, mus, sigmas = [], [], [], [], []
+            for tienda, producto, y, start in series:
+                mu_i, sigma_i = self._forecast_series(tienda, producto, y, start, block_days, n_blocks)
+                tiendas.append(tienda)
+                productos.append(producto)
+                last_day.append(start + pd.Timedelta(days=len(y) - 1))
+                mus.append(mu_i)
+                sigmas.append(sigma_i)
+            mu = np.array(mus, dtype=float).reshape(len(mus), n_blocks)
+            sigma = np.array(sigmas, dtype=float).reshape(len(sigmas), n_blocks)
+        else:
+            series = list(series)
+            tiendas = [t for t, _, _, _ in series]
+            productos = [p for _, p, _, _ in series]
+            last_day = [start + pd.Timedelta(days=len(y) - 1) for _, _, y, start in series]
+            mu, sigma = self._forecast_parallel(series, block_days, n_blocks)
+
+        return (
+            np.asarray(tiendas, dtype=object),
+            np.asarray(productos, dtype=object),
+            pd.DatetimeIndex(last_day),
+            mu,
+            sigma,
+            {},
+        )
+
+    # ----------------------------
+    # Demanda intermitente (intermittent=...)
+    # ----------------------------
+
+    @staticmethod
+    def classify_demand(
+        Y: np.ndarray, start: np.ndarray, end: np.ndarray, batch_size: int = 100_000
+    ) -> np.ndarray:
+        """
+        Clasificación Syntetos-Boylan de cada fila de Y en su rango [start, end]:
+        ADI = días / días con venta, CV² = (desv. / media)² de las ventas no nulas.
+
+            ADI < 1.32 y CV² < 0.49 -> "smooth"        ADI < 1.32 y CV² >= 0.49 -> "erratic"
+            ADI >= 1.32 y CV² < 0.49 -> "intermittent"  ADI >= 1.32 y CV² >= 0.49 -> "lumpy"
+
+        Fuera de [start, end] las filas son 0, así que basta con sumar la fila completa.
+        """
+        n = Y.shape[0]
+        n_nz = np.zeros(n)
+        s1 = np.zeros(n)
+        s2 = np.zeros(n)
+        for a in range(0, n, batch_size):
+            block = np.asarray(Y[a:a + batch_size], dtype=np.float64)
+            n_nz[a:a + batch_size] = np.count_nonzero(block, axis=1)
+            s1[a:a + batch_size] = block.sum(axis=1)
+            s2[a:a + batch_size] = np.square(block).sum(axis=1)
+
+        length = (end - start + 1).astype(float)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            adi = np.where(n_nz > 0, length / n_nz, np.inf)
+            mean_nz = np.where(n_nz > 0, s1 / n_nz, 0.0)
+            var_nz = np.maximum(np.where(n_nz > 0, s2 / n_nz, 0.0) - np.square(mean_nz), 0.0)
+            cv2 = np.where(mean_nz > 0, var_nz / np.square(mean_nz), 0.0)
+
+        intermittent = adi >= 1.32
+        erratic = cv2 >= 0.49
+        return np.select(
+            [~intermittent & ~erratic, ~intermittent & erratic, intermittent & ~erratic],
+            ["smooth", "erratic", "intermittent"],
+            default="lumpy",
+        ).astype(object)
+
+    def _intermittent_week(
+        self, Y: np.ndarray, start: np.ndarray, end: np.ndarray, horizon_days: int, batch_size: int = 100_000
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Croston / SBA / TSB vectorizados: se recorren los días una vez, actualizando todas las
+        series del lote a la vez (z = tamaño, p = intervalo, prob = probabilidad de venta).
+
+            croston: f = z / p     sba: f = (1 - alpha/2) z / p     tsb: f = prob * z
+
+        mu_semana = h * f. sigma_semana sale del error cuadrático medio de los pronósticos
+        a un paso dentro de la muestra: sqrt(h * MSE), con piso 1 como el resto del módulo.
+        """
+        alpha = self.intermittent_alpha
+        n, n_days = Y.shape
+        mu = np.zeros(n)
+        sigma = np.ones(n)
+
+        for a in range(0, n, batch_size):
+            b = min(n, a + batch_size)
+            YT = np.ascontiguousarray(np.asarray(Y[a:b], dtype=np.float64).T)
+            s, e = start[a:b], end[a:b]
+            m = b - a
+            z = np.zeros(m)
+            p = np.ones(m)
+            prob = np.zeros(m)
+            q = np.zeros(m)
+            f = np.zeros(m)
+            seen = np.zeros(m, dtype=bool)
+            sse = np.zeros(m)
+            cnt = np.zeros(m)
+
+            for t in range(int(s.min()), int(e.max()) + 1):
+                d = YT[t]
+                active = (s <= t) & (t <= e)
+
+                # Error del pronóstico hecho ayer (sólo una vez inicializada la serie)
+                scored = active & seen
+                sse += np.where(scored, np.square(d - f), 0.0)
+                cnt += scored
+
+                q += active
+                demand = active & (d > 0)
+                first = demand & ~seen
+                update = demand & seen
+                z = np.where(first, d, np.where(update, z + alpha * (d - z), z))
+                p = np.where(first, q, np.where(update, p + alpha * (q - p), p))
+                prob = np.where(
+                    first, 1.0 / np.maximum(q, 1.0),
+                    np.where(active & seen, prob + alpha * (demand - prob), prob),
                 )
+                q = np.where(demand, 0.0, q)
+                seen |= demand
+
+                if self.intermittent == "tsb":
+                    f = prob * z
+                elif self.intermittent == "sba":
+                    f = (1.0 - alpha / 2.0) * z / p
+                else:
+                    f = z / p
+                f = np.where(seen, f, 0.0)
+
+            mu[a:b] = horizon_days * f
+            with np.errstate(invalid="ignore", divide="ignore"):
+                mse = np.where(cnt > 0, sse / cnt, 0.0)
+            sigma[a:b] = np.maximum(1.0, np.sqrt(horizon_days * mse))
+        return mu, sigma
+
+    def _forecast_routed(self, sales_panel, block_days: int, n_blocks: int):
+        """Clasifica las series; las intermitentes van al estimador vectorizado y el resto al motor."""
+        tiendas, productos, Y, fechas, start, end = self._panel_arrays(sales_panel)
+        clase = self.classify_demand(Y, start, end)
+        routed = np.isin(clase, self.intermittent_classes)
+
+        mu = np.zeros((len(tiendas), n_blocks))
+        sigma = np.ones((len(tiendas), n_blocks))
+        idx = np.flatnonzero(routed)
+        if len(idx):
+            # Croston/SBA/TSB dan un pronóstico diario plano: igual en todos los bloques
+            mu_i, sigma_i = self._intermittent_week(Y[idx], start[idx], end[idx], block_days)
+            mu[idx] = mu_i[:, None]
+            sigma[idx] = sigma_i[:, None]
+
+        idx = np.flatnonzero(~routed)
+        if len(idx):
+            _, _, _, mu[idx], sigma[idx], _ = self._forecast_engine(
+                SeriesPanel(Y[idx], tiendas[idx], productos[idx], fechas, start[idx], end[idx]),
+                block_days,
+                n_blocks,
             )
 
-        return pd.DataFrame([r.__dict__ for r in out])
-    
+        return tiendas, productos, fechas[end], mu, sigma, {"clase_demanda": clase}
+
+    # ----------------------------
+    # Modo jerárquico (hierarchy=...)
+    # ----------------------------
+
+    def _parent_labels(self, tiendas: np.ndarray, productos: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Etiquetas (id_tienda, id_producto) del nivel agregado de cada serie; "*" = todas."""
+        if self.hierarchy == "producto":
+            return np.full(len(tiendas), "*", dtype=object), productos
+        if self.hierarchy == "tienda":
+            return tiendas, np.full(len(productos), "*", dtype=object)
+        ciudades = pd.Series(tiendas).map(self.store_city).fillna("?").astype(str).to_numpy(dtype=object)
+        return ciudades, productos
+
+    @staticmethod
+    def _row_window_sums(
+        Y: np.ndarray, lo: np.ndarray, hi: np.ndarray, batch_size: int = 100_000
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Suma y suma de cuadrados de Y[i, lo_i..hi_i] por fila, en lotes de filas."""
+        n, n_days = Y.shape
+        s1 = np.zeros(n)
+        s2 = np.zeros(n)
+        cols = np.arange(n_days)
+        for a in range(0, n, batch_size):
+            b = min(n, a + batch_size)
+            mask = (cols[None, :] >= lo[a:b, None]) & (cols[None, :] <= hi[a:b, None])
+            block = np.where(mask, np.asarray(Y[a:b], dtype=np.float64), 0.0)
+            s1[a:b] = block.sum(axis=1)
+            s2[a:b] = np.square(block).sum(axis=1)
+        return s1, s2
+
+    def _forecast_hierarchical(self, sales_panel, block_days: int, n_blocks: int):
+        """
+        Pronóstico jerárquico de un nivel: se modela cada serie agregada y se reparte a sus
+        hijas (tienda x producto) con participaciones p_i de la ventana reciente.
+
+        top_down:  mu_i = p_i * mu_P ;  sigma_i^2 = (p_i * sigma_P)^2 + p_i (1 - p_i) mu_P
+                   (varianza del padre escalada + variación multinomial del reparto).
+        mint:      con pronósticos base de las hijas b_i (media reciente, varianza w_i) y del
+                   padre (mu_P, w_P = sigma_P^2), la solución MinT-WLS para un nivel es
+                   b~_i = b_i + w_i * (mu_P - sum b) / (w_P + sum w),
+                   con varianza del total reconciliado v_P = w_P * sum w / (w_P + sum w).
+                   Si alguna b~_i queda negativa se recorta a 0 y las hijas del padre se
+                   reescalan para que sigan sumando el total reconciliado T = sum b~.
+                   La varianza de cada hija sale del padre reconciliado como en top_down,
+                   con q_i = b~_i / T: sigma_i^2 = (q_i * sqrt(v_P))^2 + q_i (1 - q_i) T.
+        """
+        tiendas, productos, Y, fechas, start, end = self._panel_arrays(sales_panel)
+        n, n_days = Y.shape
+        if n == 0:
+            return tiendas, productos, fechas[end], np.zeros((0, n_blocks)), np.ones((0, n_blocks)), {}
+
+        # (1) Agregar hijas por padre (un solo reduceat sobre filas ordenadas por padre)
+        parent_t, parent_p = self._parent_labels(tiendas, productos)
+        codes, parents = pd.MultiIndex.from_arrays([parent_t, parent_p]).factorize(sort=True)
+        order = np.argsort(codes, kind="stable")
+        bounds = np.flatnonzero(np.diff(codes[order])) + 1
+        first = np.concatenate(([0], bounds))
+        Yp = np.add.reduceat(np.asarray(Y, dtype=np.float64)[order], first, axis=0)
+        p_start = np.minimum.reduceat(start[order], first)
+        p_end = np.maximum.reduceat(end[order], first)
+
+        agg = SeriesPanel(
+            values=Yp,
+            id_tienda=np.asarray(parents.get_level_values(0), dtype=object),
+            id_producto=np.asarray(parents.get_level_values(1), dtype=object),
+            fechas=fechas,
+            start=p_start,
+            end=p_end,
+        )
+        _, _, _, parent_mu, parent_sigma, _ = self._forecast_flat(agg, block_days, n_blocks)
+        mu_p = parent_mu[codes]
+        sigma_p = parent_sigma[codes]
+
+        # (2) Participaciones en la ventana reciente de cada padre (historia completa si es 0)
+        window = min(self.share_window_days, n_days)
+        lo = np.maximum(p_end[codes] - window + 1, 0)
+        child_recent, _ = self._row_window_sums(Y, lo, np.full(n, n_days - 1))
+        child_total, _ = self._row_window_sums(Y, np.zeros(n, dtype=np.int64), np.full(n, n_days - 1))
+        parent_recent = np.bincount(codes, weights=child_recent, minlength=len(parents))[codes]
+        parent_total = np.bincount(codes, weights=child_total, minlength=len(parents))[codes]
+        n_children = np.bincount(codes, minlength=len(parents))[codes]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            share = np.where(
+                parent_recent > 0, child_recent / parent_recent,
+                np.where(parent_total > 0, child_total / parent_total, 1.0 / n_children),
+            )
+
+        share = share[:, None]
+        if self.reconciliation == "top_down":
+            mu = share * mu_p
+            var = np.square(share * sigma_p) + share * (1.0 - share) * mu_p
+        else:
+            # Pronóstico base barato de cada hija: media y desviación diarias de su ventana
+            lo_c = np.maximum(lo, start)
+            n_obs = np.maximum(end - lo_c + 1, 0)
+            s1, s2 = self._row_window_sums(Y, lo_c, end)
+            mean_d = s1 / np.maximum(n_obs, 1)
+            var_d = np.maximum(s2 / np.maximum(n_obs, 1) - np.square(mean_d), 0.0)
+            base = block_days * mean_d
+            w = block_days * np.maximum(var_d, 1.0)
+
+            w_sum = np.bincount(codes, weights=w, minlength=len(parents))[codes]
+            base_sum = np.bincount(codes, weights=base, minlength=len(parents))[codes]
+            base, w, w_sum, base_sum = base[:, None], w[:, None], w_sum[:, None], base_sum[:, None]
+            denom = np.square(sigma_p) + w_sum
+            mu = base + w * (mu_p - base_sum) / denom
+            var_p = np.square(sigma_p) * w_sum / denom
+
+            # Recortar negativos y reescalar por padre: las hijas suman el total reconciliado
+            total = np.zeros((len(parents), mu.shape[1]))
+            clipped_total = np.zeros_like(total)
+            np.add.at(total, codes, mu)
+            mu = np.maximum(mu, 0.0)
+            np.add.at(clipped_total, codes, mu)
+            total, clipped_total = np.maximum(total, 0.0)[codes], clipped_total[codes]
+            with np.errstate(invalid="ignore", divide="ignore"):
+                mu = np.where(clipped_total > 0, mu * total / clipped_total, 0.0)
+                q = np.where(total > 0, mu / total, 0.0)
+            var = np.square(q) * var_p + q * (1.0 - q) * total
+
+        sigma = np.maximum(1.0, np.sqrt(np.maximum(var, 0.0)))
+        return tiendas, productos, fechas[end], mu, sigma, {}
+
+    # ----------------------------
+    # Motor vectorizado (engine="fourier")
+    # ----------------------------
+
+    @staticmethod
+    def _panel_arrays(sales_panel):
+        """
+        (tiendas, productos, Y, fechas, start, end): matriz (n_series, n_days) sobre la grilla
+        diaria global, con el primer/último día de cada serie (como el reindex por grupo).
+        """
+        if not isinstance(sales_panel, pd.DataFrame):
+            n, t = sales_panel.values.shape
+            start = getattr(sales_panel, "start", None)
+            end = getattr(sales_panel, "end", None)
+            return (
+                np.asarray(sales_panel.id_tienda), np.asarray(sales_panel.id_producto),
+                sales_panel.values, sales_panel.fechas,
+                np.zeros(n, dtype=np.int64) if start is None else np.asarray(start, dtype=np.int64),
+                np.full(n, t - 1, dtype=np.int64) if end is None else np.asarray(end, dtype=np.int64),
+            )
+
+        tiendas = sales_panel["id_tienda"].astype(str).to_numpy()
+        productos = sales_panel["id_producto"].astype(str).to_numpy()
+        dias = pd.to_datetime(sales_panel["fecha"]).to_numpy().astype("datetime64[D]")
+        units = pd.to_numeric(sales_panel["unidades_vendidas"], errors="coerce").fillna(0.0)
+
+        codes, pairs = pd.MultiIndex.from_arrays([tiendas, productos]).factorize(sort=True)
+        min_day = dias.min()
+        day_codes = (dias - min_day).astype(np.int64)
+        n_days = int(day_codes.max()) + 1
+
+        Y = np.zeros((len(pairs), n_days), dtype=np.float32)
+        np.add.at(Y.reshape(-1), codes.astype(np.int64) * n_days + day_codes, units.to_numpy(dtype=np.float32))
+        start = np.full(len(pairs), n_days, dtype=np.int64)
+        end = np.full(len(pairs), -1, dtype=np.int64)
+        np.minimum.at(start, codes, day_codes)
+        np.maximum.at(end, codes, day_codes)
+
+        return (
+            np.asarray(pairs.get_level_values(0), dtype=object),
+            np.asarray(pairs.get_level_values(1), dtype=object),
+            Y,
+            pd.date_range(pd.Timestamp(min_day), periods=n_days, freq="D"),
+            start,
+            end,
+        )
+
+    def _fourier_design(self, t: np.ndarray, t0: float, span: float) -> np.ndarray:
+        cols = [np.ones_like(t, dtype=float), (t - t0) / max(span, 1.0)]
+        for k in range(1, self.fourier_order + 1):
+            ang = 2.0 * np.pi * k * t / 7.0
+            cols.append(np.sin(ang))
+            cols.append(np.cos(ang))
+        return np.column_stack(cols)
+
+    def _forecast_fourier(self, sales_panel, block_days: int, n_blocks: int, batch_size: int = 100_000):
+        """
+        Regresión por mínimos cuadrados en lote. Las series con el mismo rango de fechas
+        comparten la matriz de diseño X, así que B = pinv(X) @ Y resuelve todas a la vez.
+        - mu por bloque: suma de max(0, yhat) en los `block_days` días del bloque
+        - sigma por bloque: sqrt(sum sigma_dia^2), con sigma_dia = s·sqrt(1 + x_f (X'X)^-1 x_f')
+        Series con menos de `min_history_days` usan el mismo fallback media/std que Prophet.
+        """
+        tiendas, productos, Y, fechas, start, end = self._panel_arrays(sales_panel)
+        n = len(tiendas)
+        horizon_days = block_days * n_blocks
+        mu_w = np.zeros((n, n_blocks))
+        sigma_w = np.ones((n, n_blocks))
+
+        spans = np.stack([start, end], axis=1)
+        groups, inverse = np.unique(spans, axis=0, return_inverse=True)
+        inverse = inverse.reshape(-1)
+
+        for g, (s0, s1) in enumerate(groups):
+            rows = np.flatnonzero(inverse == g)
+            length = int(s1 - s0 + 1)
+
+            if length < self.min_history_days:
+                block = Y[rows, s0:s1 + 1].astype(np.float64)
+                mu_d = block.mean(axis=1)
+                sigma_d = block.std(axis=1)
+                mu_w[rows] = np.maximum(0.0, block_days * mu_d)[:, None]
+                sigma_w[rows] = np.maximum(1.0, np.sqrt(block_days) * np.maximum(sigma_d, 1.0))[:, None]
+                continue
+
+            w0 = int(s0)
+            if self.fourier_window_days is not None:
+                w0 = max(w0, int(s1) + 1 - self.fourier_window_days)
+            t_hist = np.arange(w0, s1 + 1, dtype=float)
+            t_fut = np.arange(s1 + 1, s1 + 1 + horizon_days, dtype=float)
+            X = self._fourier_design(t_hist, t_hist[0], len(t_hist))
+            X_f = self._fourier_design(t_fut, t_hist[0], len(t_hist))
+            dof = max(1, len(t_hist) - X.shape[1])
+
+            pinv = np.linalg.pinv(X)                                  # (p, T)
+            leverage = np.einsum("hp,pq,hq->h", X_f, pinv @ pinv.T, X_f)  # x_f (X'X)^-1 x_f'
+
+            for b in range(0, len(rows), batch_size):
+                r = rows[b:b + batch_size]
+                Yb = Y[r, w0:s1 + 1].astype(np.float64).T            # (T, nb)
+                B = pinv @ Yb                                         # (p, nb)
+                resid = Yb - X @ B
+                s = np.sqrt(np.sum(resid * resid, axis=0) / dof)      # (nb,)
+                yhat = X_f @ B                                        # (h, nb)
+
+                mu_w[r] = np.maximum(0.0, yhat).reshape(n_blocks, block_days, -1).sum(axis=1).T
+                sigma_day = np.maximum(s[None, :] * np.sqrt(1.0 + leverage)[:, None], 1e-6)
+                sigma_day = (sigma_day * sigma_day).reshape(n_blocks, block_days, -1)
+                sigma_w[r] = np.maximum(1.0, np.sqrt(np.sum(sigma_day, axis=1))).T
+
+        return tiendas, productos, fechas[end], mu_w, sigma_w, {}
+
+    def _forecast_parallel(self, series: list, block_days: int, n_blocks: int = 1) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Reparte las series en bloques de `chunk_size` sobre un pool de `n_jobs` procesos.
+        `map` conserva el orden de los bloques, así la salida tiene el mismo orden que en serial;
+        los fallbacks por serie ocurren dentro de cada worker igual que en serial.
+        Los bloques se fusionan en orden, así que sólo los modelos de las últimas
+        `registry.max_models` series con historia suficiente pueden quedar en el registro:
+        cada bloque serializa sólo esos y el resto no viaja al proceso principal.
+        """
+        if not series:
+            return np.zeros((0, n_blocks)), np.ones((0, n_blocks))
+        chunk_size = self.chunk_size or max(1, math.ceil(len(series) / (self.n_jobs * 4)))
+        chunks = [series[i:i + chunk_size] for i in range(0, len(series), chunk_size)]
+
+        # Series que ajustan un modelo en los bloques posteriores a cada bloque
+        fitted = np.asarray([sum(len(y) >= self.min_history_days for _, _, y, _ in c) for c in chunks])
+        later = np.cumsum(fitted[::-1])[::-1] - fitted
+        registry_keep = np.maximum(0, self.registry.max_models - later).tolist()
+
+        mus, sigmas = [], []
+        with ProcessPoolExecutor(max_workers=self.n_jobs) as pool:
+            for (mu, sigma), state in pool.map(
+                self._forecast_chunk_worker,
+                chunks,
+                [block_days] * len(chunks),
+                [n_blocks] * len(chunks),
+                [self._chunk_warm_params(chunk) for chunk in chunks],
+                registry_keep,
+            ):
+                mus.append(mu)
+                sigmas.append(sigma)
+                self._merge_worker_state(state)
+        return np.vstack(mus), np.vstack(sigmas)
+
+    def _chunk_warm_params(self, chunk: list) -> Dict[Tuple[str, str], Dict[str, Any]]:
+        # Sólo los parámetros de las series del bloque (el forecaster viaja sin `warm_params`)
+        if not self.warm_start:
+            return {}
+        return {(t, p): self.warm_params[(t, p)] for t, p, _, _ in chunk if (t, p) in self.warm_params}
+
+    def _forecast_chunk_worker(
+        self,
+        chunk: list,
+        block_days: int,
+        n_blocks: int = 1,
+        warm_params: Optional[Dict[Tuple[str, str], Dict[str, Any]]] = None,
+        registry_keep: Optional[int] = None,
+    ):
+        # El worker opera sobre una copia del forecaster (sin registro, parámetros ni tiempos):
+        # se devuelve lo que cambió (contadores del cache, parámetros para warm start, tiempos)
+        self.warm_params.update(warm_params or {})
+        cache = self.model_cache
+        before = cache.stats() if cache is not None else None
+        t0 = time.perf_counter()
+        res = self._forecast_chunk(chunk, block_days, n_blocks)
+
+        state: Dict[str, Any] = {
+            "elapsed_s": time.perf_counter() - t0,
+            "fit_times": self.fit_times,
+            "registry": self._chunk_registry_json(chunk, registry_keep),
+            "warm_params": {
+                (t, p): self.warm_params[(t, p)]
+                for t, p, _, _ in chunk
+                if (t, p) in self.warm_params
+            },
+        }
+        if cache is not None:
+            after = cache.stats()
+            state["cache"] = {k: after[k] - before[k] for k in ("hits", "misses", "evictions")}
+        return res, state
+
+    def _chunk_registry_json(self, chunk: list, keep: Optional[int] = None) -> Dict[str, Dict[str, str]]:
+        # Sólo los últimos `keep` modelos del bloque (por defecto, los que caben en el registro)
+        keep = self.registry.max_models if keep is None else min(keep, self.registry.max_models)
+        if keep <= 0:
+            return {}
+        series = [(t, p) for t, p, _, _ in chunk if (t, p) in self.registry]
+        return self.registry.to_json(series[-keep:])
+
+    def _merge_worker_state(self, state: Dict[str, Any]) -> None:
+        for kind, times in state["fit_times"].items():
+            self.fit_times[kind].extend(times)
+        self.warm_params.update(state["warm_params"])
+        self.registry.update_from_json(state["registry"])
+        if self.model_cache is not None:
+            self.model_cache.hits += state["cache"]["hits"]
+            self.model_cache.misses += state["cache"]["misses"]
+            self.model_cache.evictions += state["cache"]["evictions"]
+            # El worker escribió y evictó en el directorio: el índice de este proceso quedó viejo
+            self.model_cache.refresh()
+
     def plot_time_series(
         self,
         sales_panel: pd.DataFrame,
@@ -154,32 +1437,16 @@ class DemandForecaster:
 
         Nota: esto NO es pronóstico futuro, es el "fit" sobre el histórico.
         """
-        df = sales_panel.copy()
-        df["id_tienda"] = df["id_tienda"].astype(str)
-        df["id_producto"] = df["id_producto"].astype(str)
-        df["fecha"] = pd.to_datetime(df["fecha"])
-        df["unidades_vendidas"] = pd.to_numeric(df["unidades_vendidas"], errors="coerce").fillna(0.0)
-
-        g = df[
-            (df["id_tienda"] == id_tienda) &
-            (df["id_producto"] == id_producto)
-        ].copy().sort_values("fecha")
-
-        if g.empty:
+        y, fechas = self._select_series(sales_panel, id_tienda, id_producto)
+        if len(y) == 0:
             raise ValueError(f"No hay datos para tienda={id_tienda}, producto={id_producto}")
 
-        # Reindex diario para que Prophet tenga frecuencia regular
-        idx = pd.date_range(g["fecha"].min(), g["fecha"].max(), freq="D")
-        g2 = g.set_index("fecha").reindex(idx)
-        g2.index.name = "fecha"
-        g2["unidades_vendidas"] = g2["unidades_vendidas"].fillna(0.0)
-
         fig, ax = plt.subplots(figsize=figsize)
 
         # Serie histórica
         ax.plot(
-            g2.index,
-            g2["unidades_vendidas"].values,
+            fechas,
+            y,
             label="Ventas Históricas (Diarias)",
             alpha=0.75,
             color="steelblue",
@@ -187,25 +1454,23 @@ class DemandForecaster:
 
         # Ajuste Prophet (in-sample)
         if show_prophet_fit:
-            if len(g2) < self.min_history_days:
+            if len(y) < self.min_history_days:
                 # Fallback simple si no alcanza historial
-                mu = float(g2["unidades_vendidas"].mean()) if len(g2) else 0.0
+                mu = float(np.mean(y))
                 ax.hlines(
                     mu,
-                    xmin=g2.index.min(),
-                    xmax=g2.index.max(),
+                    xmin=fechas.min(),
+                    xmax=fechas.max(),
                     colors="orangered",
                     linestyles="--",
                     linewidth=2,
                     label=f"Media histórica (fallback) = {mu:.1f}",
                 )
             else:
-                train = g2.reset_index().rename(columns={"fecha": "ds", "unidades_vendidas": "y"})
-                m = self._make_model()
-                m.fit(train)
+                entry = self._registered_model(id_tienda, id_producto, y, fechas)
 
                 # Predicción sobre el mismo histórico (in-sample)
-                fcst_hist = m.predict(train[["ds"]])[["ds", "yhat", "yhat_lower", "yhat_upper"]]
+                fcst_hist = self._registered_predict(entry)
 
                 ax.plot(
                     fcst_hist["ds"],
@@ -249,31 +1514,14 @@ class DemandForecaster:
         horizon_days: int = 28,
         figsize: Tuple[int, int] = (14, 7),
     ) -> plt.Figure:
-        df = sales_panel.copy()
-        df["id_tienda"] = df["id_tienda"].astype(str)
-        df["id_producto"] = df["id_producto"].astype(str)
-        df["fecha"] = pd.to_datetime(df["fecha"])
-        df["unidades_vendidas"] = pd.to_numeric(df["unidades_vendidas"], errors="coerce").fillna(0.0)
-
-        g = df[(df["id_tienda"] == id_tienda) & (df["id_producto"] == id_producto)].copy()
-        g = g.sort_values("fecha")
-
-        if g.empty:
+        y, fechas = self._select_series(sales_panel, id_tienda, id_producto)
+        if len(y) == 0:
             raise ValueError("No hay datos para esa combinación tienda/producto")
 
-        # daily reindex
-        idx = pd.date_range(g["fecha"].min(), g["fecha"].max(), freq="D")
-        g2 = g.set_index("fecha").reindex(idx)
-        g2.index.name = "fecha"
-        g2["unidades_vendidas"] = g2["unidades_vendidas"].fillna(0.0)
-
-        train = g2.reset_index().rename(columns={"fecha": "ds", "unidades_vendidas": "y"})
-
-        m = self._make_model()
-        m.fit(train)
+        train = pd.DataFrame({"ds": fechas, "y": y})
 
-        future = m.make_future_dataframe(periods=horizon_days, freq="D", include_history=True)
-        fcst = m.predict(future)[["ds", "yhat", "yhat_lower", "yhat_upper"]].copy()
+        entry = self._registered_model(id_tienda, id_producto, y, fechas)
+        fcst = self._registered_predict(entry, horizon_days)
 
         fig, ax = plt.subplots(figsize=figsize)
         ax.plot(train["ds"], train["y"], label="Histórico", color="steelblue", alpha=0.7)
@@ -323,11 +1571,11 @@ class DemandForecaster:
         - Prophet se ajusta sobre datos diarios (reindex D). Si resample_freq != None, el histórico se agrega
           para visualización, pero el fit Prophet sigue siendo diario (y luego se agrega igual).
         """
-        df = sales_panel.copy()
-        df["id_tienda"] = df["id_tienda"].astype(str)
-        df["id_producto"] = df["id_producto"].astype(str)
-        df["fecha"] = pd.to_datetime(df["fecha"])
-        df[metric] = pd.to_numeric(df[metric], errors="coerce").fillna(0.0)
+        # Una sola pasada sobre el panel para todas las combinaciones pedidas
+        series = {
+            (t, p): (y, start)
+            for t, p, y, start in self._split_panel(sales_panel, metric, pairs=combinations)
+        }
 
         fig, ax = plt.subplots(figsize=figsize)
 
@@ -335,23 +1583,20 @@ class DemandForecaster:
         palette = plt.cm.tab20(np.linspace(0, 1, max(1, len(combinations))))
 
         for i, (tienda, producto) in enumerate(combinations):
-            g = df[
-                (df["id_tienda"] == tienda) &
-                (df["id_producto"] == producto)
-            ].copy().sort_values("fecha")
-
-            if g.empty:
+            if (str(tienda), str(producto)) not in series:
                 continue
+            y, start = series[(str(tienda), str(producto))]
+            fechas = pd.date_range(start, periods=len(y), freq="D")
 
             color = palette[i % len(palette)]
 
             # --- Histórico (para plot): opcionalmente agregado ---
-            g_hist = g.set_index("fecha")[[metric]].sort_index()
+            g_hist = pd.Series(y, index=fechas)
 
             if resample_freq:
-                hist_series = g_hist[metric].resample(resample_freq).sum()
+                hist_series = g_hist.resample(resample_freq).sum()
             else:
-                hist_series = g_hist[metric]
+                hist_series = g_hist
 
             ax.plot(
                 hist_series.index,
@@ -369,15 +1614,9 @@ class DemandForecaster:
                 if (max_combinations_fit is not None) and (i >= max_combinations_fit):
                     continue
 
-                # Reindex diario para Prophet
-                idx = pd.date_range(g["fecha"].min(), g["fecha"].max(), freq="D")
-                g2 = g.set_index("fecha").reindex(idx)
-                g2.index.name = "fecha"
-                g2[metric] = g2[metric].fillna(0.0)
-
-                if len(g2) < self.min_history_days:
+                if len(y) < self.min_history_days:
                     # Fallback simple si hay poco historial
-                    mu = float(g2[metric].mean()) if len(g2) else 0.0
+                    mu = float(np.mean(y))
                     # Pintamos una línea horizontal (en la escala agregada, esto es aproximado)
                     ax.hlines(
                         mu if not resample_freq else mu * (7 if resample_freq.startswith("W") else 1),
@@ -390,17 +1629,13 @@ class DemandForecaster:
                     )
                     continue
 
-                train = g2.reset_index().rename(columns={"fecha": "ds", metric: "y"})
-
-                m = self._make_model()
                 try:
-                    m.fit(train)
+                    entry = self._registered_model(str(tienda), str(producto), y, fechas)
                 except Exception:
                     # Si falla, omitimos fit para esa serie
                     continue
 
-                fcst_hist = m.predict(train[["ds"]])[["ds", "yhat", "yhat_lower", "yhat_upper"]].copy()
-                fcst_hist = fcst_hist.set_index("ds")
+                fcst_hist = self._registered_predict(entry).set_index("ds")
 
                 # Si el gráfico está agregado, agregamos también el fit
                 if resample_freq:
@@ -1,10 +1,14 @@
-from dataclasses import dataclass
-from typing import Optional, Tuple, Dict
+from dataclasses import dataclass, field
+from typing import Any, Iterator, Optional, Tuple, Dict, List
+import copy
+import json
+import os
 import numpy as np
 import pandas as pd
 import warnings
+from scipy.special import betainc, gammaincc, ndtr
 
-from data_source import DataSource
+from data_source import DataSource, MasterIndex, read_snapshot, write_snapshot
 from forecast import DemandForecaster
 
 
@@ -19,6 +23,212 @@ class OptimizationResult:
     service_level_approx: float      # Nivel de servicio aproximado
 
 
+@dataclass
+class OptimizationArrays:
+    """Resultados de `compute_order_quantities`: los campos de `OptimizationResult` como arreglos."""
+    Q_objetivo: np.ndarray
+    pedido_sugerido: np.ndarray
+    p_critico: np.ndarray
+    expected_stockout_cost: np.ndarray
+    expected_overstock_cost: np.ndarray
+    service_level_approx: np.ndarray
+
+
+@dataclass
+class StoreConstraints:
+    """
+    Restricciones por tienda para el modo restringido de `ReplenishmentPlanner`.
+
+    - m2_por_unidad: espacio de exhibición (m²) por unidad; si el catálogo trae la columna
+      `m2_por_unidad` se usa por SKU. None = sin restricción de espacio.
+    - ocupacion_max: fracción de `tamaño_m2` disponible para inventario.
+    - presupuesto_semanal: compra máxima por tienda a `costo_unitario` (escalar o dict/Series
+      por id_tienda); si maestro_tiendas trae `presupuesto_semanal` se usa esa columna.
+      None = sin restricción de presupuesto.
+    """
+    m2_por_unidad: Optional[float] = None
+    ocupacion_max: float = 1.0
+    presupuesto_semanal: Optional[Any] = None
+
+
+@dataclass
+class DemandDistributions:
+    """
+    Distribución de la demanda semanal por serie (una fila por SKU-tienda), sin suponer
+    normalidad. Se construye con uno de los constructores:
+
+    - empirical(samples): muestras (n, m), p. ej. sumas semanales históricas; NaN = sin dato
+    - poisson(mu) / negative_binomial(mu, var): conteos enteros (var <= mu -> Poisson)
+    - quantile_grid(levels, values): cuantiles (n, k) del forecast en los niveles `levels`,
+      interpolados linealmente (la masa fuera del grid queda en los extremos)
+
+    `ppf` y `expected_shortage` son vectorizados sobre todas las series: búsquedas en arreglos
+    ordenados (empírica), formas cerradas (Poisson / binomial negativa) o integrales por tramos
+    (grid), sin muestreo Monte Carlo.
+    """
+    kind: str
+    mu: Optional[np.ndarray] = None
+    var: Optional[np.ndarray] = None
+    samples: Optional[np.ndarray] = None    # empírica: filas ordenadas, NaN al final
+    levels: Optional[np.ndarray] = None
+    values: Optional[np.ndarray] = None
+    _nb: Optional[Tuple[np.ndarray, np.ndarray, np.ndarray]] = field(default=None, init=False, repr=False)
+
+    @classmethod
+    def empirical(cls, samples: np.ndarray) -> "DemandDistributions":
+        return cls("empirical", samples=np.sort(np.asarray(samples, dtype=float), axis=1))
+
+    @classmethod
+    def weekly_sums(cls, Y: np.ndarray, start: np.ndarray, n_weeks: int = 26) -> "DemandDistributions":
+        """
+        Empírica con las últimas `n_weeks` semanas completas de la matriz (series x días):
+        semanas que terminan en la última columna; las anteriores al inicio de la serie son NaN.
+        """
+        n, T = Y.shape
+        k = min(n_weeks, T // 7)
+        sums = np.asarray(Y[:, T - 7 * k:], dtype=float).reshape(n, k, 7).sum(axis=2)
+        first_day = T - 7 * k + 7 * np.arange(k)
+        return cls.empirical(np.where(first_day[None, :] >= np.asarray(start)[:, None], sums, np.nan))
+
+    @classmethod
+    def poisson(cls, mu: np.ndarray) -> "DemandDistributions":
+        mu = np.maximum(0.0, np.asarray(mu, dtype=float))
+        return cls("negbin", mu=mu, var=mu.copy())
+
+    @classmethod
+    def negative_binomial(cls, mu: np.ndarray, var: np.ndarray) -> "DemandDistributions":
+        return cls("negbin", mu=np.maximum(0.0, np.asarray(mu, dtype=float)), var=np.asarray(var, dtype=float))
+
+    @classmethod
+    def quantile_grid(cls, levels: np.ndarray, values: np.ndarray) -> "DemandDistributions":
+        levels = np.asarray(levels, dtype=float)
+        if levels.ndim != 1 or len(levels) < 2 or np.any(np.diff(levels) <= 0):
+            raise ValueError("levels debe ser creciente y tener al menos 2 niveles")
+        # Cuantiles cruzados (modelos por nivel) -> monótonos por fila
+        values = np.maximum.accumulate(np.maximum(0.0, np.asarray(values, dtype=float)), axis=1)
+        return cls("quantiles", levels=levels, values=values)
+
+    def take(self, rows: np.ndarray) -> "DemandDistributions":
+        """Subconjunto de series (mismo tipo de distribución)."""
+        pick = lambda a: None if a is None else a[rows]
+        return DemandDistributions(
+            self.kind, mu=pick(self.mu), var=pick(self.var), samples=pick(self.samples),
+            levels=self.levels, values=pick(self.values),
+        )
+
+    def __len__(self) -> int:
+        return len(self.mu) if self.kind == "negbin" else len(self.samples if self.kind == "empirical" else self.values)
+
+    # --- Binomial negativa / Poisson: D·f(d; r, p) = mu·f(d-1; r+1, p) ---
+    def _nb_params(self):
+        # (sobredispersa, r, p) por fila, calculados una vez
+        if self._nb is None:
+            overdispersed = self.var > self.mu * (1 + 1e-9)
+            with np.errstate(invalid="ignore", divide="ignore"):
+                p = np.where(overdispersed, self.mu / self.var, 1.0)
+                r = np.where(overdispersed, self.mu ** 2 / (self.var - self.mu), 1.0)
+            self._nb = (overdispersed, r, p)
+        return self._nb
+
+    def _cdf(self, k: np.ndarray, rows: np.ndarray, shifted: bool = False) -> np.ndarray:
+        # F(k) de las filas `rows` (con r+1 si `shifted`): I_p(r, k+1) para la binomial negativa
+        # y Q(k+1, mu) para Poisson
+        overdispersed, r, p = self._nb_params()
+        od = overdispersed[rows]
+        kk = np.maximum(k, 0) + 1
+        out = np.empty(len(rows))
+        out[od] = betainc(r[rows][od] + (1 if shifted else 0), kk[od], p[rows][od])
+        out[~od] = gammaincc(kk[~od], self.mu[rows][~od])
+        return np.where(k < 0, 0.0, out)
+
+    def _count_ppf(self, p: np.ndarray) -> np.ndarray:
+        # Aproximación Cornish-Fisher y luego pasos enteros hasta el menor Q con F(Q) >= p
+        overdispersed, r, pp = self._nb_params()
+        with np.errstate(invalid="ignore", divide="ignore"):
+            skew = np.where(overdispersed, (2 - pp) / np.sqrt(r * (1 - pp)), 1 / np.sqrt(self.mu))
+        z = InventoryOptimizer._norm_ppf_array(p)
+        guess = self.mu + np.sqrt(np.maximum(self.var, self.mu)) * (z + (z * z - 1) * np.nan_to_num(skew) / 6)
+        Q = np.maximum(0.0, np.floor(np.nan_to_num(guess)))
+        rows = np.flatnonzero(self.mu > 0)
+        up = rows
+        while len(up):
+            up = up[self._cdf(Q[up], up) < p[up]]
+            Q[up] += 1
+        down = rows[Q[rows] > 0]
+        while len(down):
+            down = down[self._cdf(Q[down] - 1, down) >= p[down]]
+            Q[down] -= 1
+            down = down[Q[down] > 0]
+        return np.where(self.mu > 0, Q, 0.0)
+
+    # --- Grid de cuantiles ---
+    def _grid_integral(self, Q: np.ndarray) -> np.ndarray:
+        # ∫_0^1 max(0, q(u) - Q) du con q lineal por tramos y constante fuera del grid
+        lv, V = self.levels, self.values
+        Q = Q[:, None]
+        G = 0.5 * np.maximum(0.0, V - Q) ** 2
+        dq = np.diff(V, axis=1)
+        du = np.diff(lv)[None, :]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            seg = np.where(dq > 0, du * np.diff(G, axis=1) / dq, du * np.maximum(0.0, V[:, :-1] - Q))
+        tails = lv[0] * np.maximum(0.0, V[:, 0] - Q[:, 0]) + (1 - lv[-1]) * np.maximum(0.0, V[:, -1] - Q[:, 0])
+        return seg.sum(axis=1) + tails
+
+    def mean(self) -> np.ndarray:
+        if self.kind == "negbin":
+            return self.mu
+        if self.kind == "empirical":
+            count = (~np.isnan(self.samples)).sum(axis=1)
+            with np.errstate(invalid="ignore", divide="ignore"):
+                return np.where(count > 0, np.nansum(self.samples, axis=1) / count, 0.0)
+        lv, V = self.levels, self.values
+        return (
+            lv[0] * V[:, 0] + (1 - lv[-1]) * V[:, -1]
+            + (np.diff(lv)[None, :] * 0.5 * (V[:, 1:] + V[:, :-1])).sum(axis=1)
+        )
+
+    def ppf(self, p: np.ndarray) -> np.ndarray:
+        """Menor cantidad Q con P(D <= Q) >= p, por fila."""
+        p = np.asarray(p, dtype=float)
+        if self.kind == "negbin":
+            return self._count_ppf(p)
+        if self.kind == "empirical":
+            X = self.samples
+            count = (~np.isnan(X)).sum(axis=1)
+            idx = np.clip(np.ceil(p * count).astype(np.int64) - 1, 0, np.maximum(count - 1, 0))
+            Q = X[np.arange(len(X)), idx] if X.shape[1] else np.zeros(len(X))
+            return np.where(count > 0, Q, 0.0)
+        lv, V = self.levels, self.values
+        j = np.clip(np.searchsorted(lv, p, side="right") - 1, 0, len(lv) - 2)
+        t = np.clip((p - lv[j]) / (lv[j + 1] - lv[j]), 0.0, 1.0)
+        rows = np.arange(len(V))
+        return V[rows, j] + t * (V[rows, j + 1] - V[rows, j])
+
+    def expected_shortage(self, Q: np.ndarray) -> np.ndarray:
+        """E[(D - Q)+] por fila (unidades faltantes esperadas con inventario Q)."""
+        Q = np.asarray(Q, dtype=float)
+        if self.kind == "negbin":
+            # E[D·1{D > k}] - Q·P(D > k), k = floor(Q)
+            k = np.floor(Q)
+            rows = np.flatnonzero(self.mu > 0)
+            out = np.zeros(len(Q))
+            out[rows] = (
+                self.mu[rows] * (1 - self._cdf(k[rows] - 1, rows, shifted=True))
+                - Q[rows] * (1 - self._cdf(k[rows], rows))
+            )
+            return np.maximum(0.0, out)
+        if self.kind == "empirical":
+            X = self.samples
+            count = (~np.isnan(X)).sum(axis=1)
+            csum = np.cumsum(np.nan_to_num(X), axis=1)
+            le = (X <= Q[:, None]).sum(axis=1)
+            total = csum[:, -1] if X.shape[1] else np.zeros(len(X))
+            below = np.where(le > 0, csum[np.arange(len(X)), np.maximum(le - 1, 0)] if X.shape[1] else 0.0, 0.0)
+            with np.errstate(invalid="ignore", divide="ignore"):
+                return np.where(count > 0, (total - below - (count - le) * Q) / count, 0.0)
+        return self._grid_integral(Q)
+
+
 class InventoryOptimizer:
     """
     Optimización de inventario basada en el modelo Newsvendor clásico.
@@ -101,6 +311,391 @@ class InventoryOptimizer:
         den = (((((b[0]*r + b[1])*r + b[2])*r + b[3])*r + b[4])*r + 1)
         return num / den
 
+    # Coeficientes Acklam (los mismos de `_norm_ppf`)
+    _ACKLAM_A = np.array([-3.969683028665376e+01, 2.209460984245205e+02, -2.759285104469687e+02,
+                          1.383577518672690e+02, -3.066479806614716e+01, 2.506628277459239e+00])
+    _ACKLAM_B = np.array([-5.447609879822406e+01, 1.615858368580409e+02, -1.556989798598866e+02,
+                          6.680131188771972e+01, -1.328068155288572e+01, 1.0])
+    _ACKLAM_C = np.array([-7.784894002430293e-03, -3.223964580411365e-01, -2.400758277161838e+00,
+                          -2.549732539343734e+00, 4.374664141464968e+00, 2.938163982698783e+00])
+    _ACKLAM_D = np.array([7.784695709041462e-03, 3.224671290700398e-01, 2.445134137142996e+00,
+                          3.754408661907416e+00, 1.0])
+
+    @classmethod
+    def _norm_ppf_array(cls, p: np.ndarray) -> np.ndarray:
+        """Versión vectorizada de `_norm_ppf` (mismas regiones y coeficientes)."""
+        p = np.asarray(p, dtype=float)
+        out = np.empty_like(p)
+        plow = 0.02425
+        phigh = 1 - plow
+
+        low = (p > 0.0) & (p < plow)
+        high = (p > phigh) & (p < 1.0)
+        mid = (p >= plow) & (p <= phigh)
+
+        q = np.sqrt(-2 * np.log(p[low]))
+        out[low] = np.polyval(cls._ACKLAM_C, q) / np.polyval(cls._ACKLAM_D, q)
+        q = np.sqrt(-2 * np.log(1 - p[high]))
+        out[high] = -np.polyval(cls._ACKLAM_C, q) / np.polyval(cls._ACKLAM_D, q)
+        q = p[mid] - 0.5
+        r = q * q
+        out[mid] = np.polyval(cls._ACKLAM_A, r) * q / np.polyval(cls._ACKLAM_B, r)
+
+        out[p <= 0.0] = -np.inf
+        out[p >= 1.0] = np.inf
+        return out
+
+    @staticmethod
+    def _loss_function_array(z: np.ndarray) -> np.ndarray:
+        """L(z) = φ(z) - z·(1 - Φ(z)) vectorizada (sin importar scipy.stats por llamada)."""
+        z = np.asarray(z, dtype=float)
+        phi = np.exp(-0.5 * z * z) / np.sqrt(2.0 * np.pi)
+        return phi - z * ndtr(-z)
+
+    @staticmethod
+    def _critical_fractiles(Cu: np.ndarray, Co: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Fractil crítico por fila con los casos especiales de `compute_order_quantity`."""
+        both_zero = (Cu == 0) & (Co == 0)
+        only_cu = (Cu > 0) & (Co == 0)
+        only_co = (Cu == 0) & (Co > 0)
+        normal = (Cu > 0) & (Co > 0)
+        if both_zero.any():
+            warnings.warn(
+                f"Cu y Co son ambos cero en {int(both_zero.sum())} filas. "
+                "Usando estrategia conservadora (media)."
+            )
+
+        with np.errstate(invalid="ignore", divide="ignore"):
+            p = np.where(normal, np.clip(Cu / (Cu + Co), 0.01, 0.99), 0.5)
+        p = np.where(only_cu, 0.99, np.where(only_co, 0.01, p))
+        return p, both_zero, normal
+
+    def compute_order_quantities(
+        self,
+        mu_week: np.ndarray,
+        sigma_week: np.ndarray,
+        stock_actual: np.ndarray,
+        margen_unitario: np.ndarray,
+        costo_overstock_unitario: np.ndarray,
+    ) -> OptimizationArrays:
+        """
+        Versión vectorizada de `compute_order_quantity` sobre arreglos (uno por SKU-tienda):
+        mismos casos especiales, recortes y fórmulas, en una sola pasada NumPy.
+        """
+        # fmax (no maximum): un NaN se normaliza al piso igual que `max(0.0, nan)` en la versión escalar
+        mu_week = np.fmax(0.0, np.asarray(mu_week, dtype=float))
+        sigma_week = np.fmax(self.sigma_min, np.asarray(sigma_week, dtype=float))
+        stock_actual = np.fmax(0.0, np.asarray(stock_actual, dtype=float))
+        Cu = np.fmax(0.0, np.asarray(margen_unitario, dtype=float))
+        Co = np.fmax(0.0, np.asarray(costo_overstock_unitario, dtype=float))
+        p, both_zero, normal = self._critical_fractiles(Cu, Co)
+
+        # z: en el caso normal se recorta a z_clip; en los casos extremos (0.99 / 0.01) no
+        z = self._norm_ppf_array(p)
+        z = np.where(normal, np.clip(z, self.z_clip[0], self.z_clip[1]), z)
+        z = np.where(both_zero, 0.0, z)
+
+        Q = np.maximum(0.0, mu_week + z * sigma_week)
+        pedido = np.maximum(0.0, Q - stock_actual)
+
+        expected_stockout_cost = np.where(Cu > 0, Cu * sigma_week * self._loss_function_array(z), 0.0)
+        expected_overstock_cost = np.where(Co > 0, Co * sigma_week * self._loss_function_array(-z), 0.0)
+
+        return OptimizationArrays(
+            Q_objetivo=Q,
+            pedido_sugerido=pedido,
+            p_critico=p,
+            expected_stockout_cost=expected_stockout_cost,
+            expected_overstock_cost=expected_overstock_cost,
+            service_level_approx=p,
+        )
+
+    def compute_order_quantities_constrained(
+        self,
+        store_code: np.ndarray,
+        mu_week: np.ndarray,
+        sigma_week: np.ndarray,
+        stock_actual: np.ndarray,
+        margen_unitario: np.ndarray,
+        costo_overstock_unitario: np.ndarray,
+        espacio_unitario: Optional[np.ndarray] = None,
+        espacio_libre: Optional[np.ndarray] = None,
+        costo_unitario: Optional[np.ndarray] = None,
+        presupuesto: Optional[np.ndarray] = None,
+        n_iter: int = 50,
+        max_rounds: int = 20,
+        tol: float = 1e-3,
+    ) -> Tuple[OptimizationArrays, np.ndarray, np.ndarray]:
+        """
+        Newsvendor multi-SKU con restricciones por tienda (`store_code` en 0..S-1):
+
+            Σ espacio_unitario · pedido <= espacio_libre[tienda]
+            Σ costo_unitario · pedido   <= presupuesto[tienda]
+
+        Relajación Lagrangiana: con multiplicadores (λ, ν) por tienda cada SKU vuelve a ser un
+        newsvendor independiente con fractil p = p0 - (λ·espacio + ν·costo) / (Cu + Co), donde p0
+        es el fractil sin restricciones (= Cu / (Cu + Co) salvo recortes), y el pedido es no
+        creciente en cada multiplicador. Cada multiplicador se busca con regula falsi (Illinois)
+        vectorizada (todas las tiendas a la vez, hasta que la restricción queda justa a `tol`);
+        en las tiendas donde ambas restricciones quedan activas se busca ν (a lo más `max_rounds`
+        pasos) resolviendo λ(ν) en cada paso.
+        Solo se iteran las filas de tiendas donde la solución sin restricciones no es factible;
+        el resto queda idéntico a `compute_order_quantities`.
+
+        Con demanda Normal el pedido de un SKU cae a 0 en un intervalo del multiplicador más
+        angosto que la resolución del float; por eso la solución final combina los extremos
+        factible e infactible de la búsqueda (recuperación primal). La solución siempre es
+        factible y cumple la holgura complementaria: un multiplicador > 0 deja su restricción
+        justa. La distancia al óptimo exacto es del orden de `tol`.
+
+        Retorna (resultados, λ por tienda, ν por tienda): los precios sombra del m² y del peso.
+        """
+        store_code = np.asarray(store_code, dtype=np.int64)
+        n_stores = int(store_code.max()) + 1 if len(store_code) else 0
+        # Los límites por tienda pueden cubrir más tiendas que las presentes en `store_code`
+        for limit in (espacio_libre, presupuesto):
+            if limit is not None:
+                n_stores = max(n_stores, len(limit))
+        base = self.compute_order_quantities(
+            mu_week, sigma_week, stock_actual, margen_unitario, costo_overstock_unitario
+        )
+        has_space = espacio_unitario is not None and espacio_libre is not None
+        has_budget = costo_unitario is not None and presupuesto is not None
+        limits = []   # (peso por fila, límite por tienda): espacio primero
+        if has_space:
+            limits.append((np.asarray(espacio_unitario, dtype=float), np.maximum(0.0, espacio_libre)))
+        if has_budget:
+            limits.append((np.asarray(costo_unitario, dtype=float), np.maximum(0.0, presupuesto)))
+        mults = [np.zeros(n_stores) for _ in limits]
+
+        def shadow() -> Tuple[np.ndarray, np.ndarray]:
+            zero = np.zeros(n_stores)
+            return (mults[0] if has_space else zero), (mults[-1] if has_budget else zero)
+
+        def usage(k, rows, pedido):
+            return np.bincount(store_code[rows], weights=limits[k][0][rows] * pedido, minlength=n_stores)
+
+        def violated(k, rows, pedido):
+            return usage(k, rows, pedido) > limits[k][1] * (1 + 1e-9)
+
+        binding = np.zeros(n_stores, dtype=bool)
+        all_rows = np.arange(len(store_code))
+        for k in range(len(limits)):
+            binding |= violated(k, all_rows, base.pedido_sugerido)
+        if not binding.any():
+            return (base, *shadow())
+
+        mu = np.fmax(0.0, np.asarray(mu_week, dtype=float))
+        sigma = np.fmax(self.sigma_min, np.asarray(sigma_week, dtype=float))
+        stock = np.fmax(0.0, np.asarray(stock_actual, dtype=float))
+        Cu = np.fmax(0.0, np.asarray(margen_unitario, dtype=float))
+        Co = np.fmax(0.0, np.asarray(costo_overstock_unitario, dtype=float))
+        denom = Cu + Co
+        p0 = base.p_critico
+        z0 = self._norm_ppf_array(p0)
+        z0 = np.where((Cu > 0) & (Co > 0), np.clip(z0, self.z_clip[0], self.z_clip[1]), z0)
+        z0 = np.where((Cu == 0) & (Co == 0), 0.0, z0)
+
+        def solve(rows: np.ndarray, penalty: np.ndarray):
+            # penalty = λ·espacio + ν·costo por fila (costo marginal de ordenar una unidad más).
+            # El fractil baja desde p0 (ya recortado) en penalty/(Cu+Co): continuo en el multiplicador
+            pen = penalty > 0
+            d = denom[rows]
+            with np.errstate(invalid="ignore", divide="ignore"):
+                p = np.where(pen & (d > 0), p0[rows] - penalty / d, 0.0)
+            p = np.where(pen, np.maximum(p, 0.0), p0[rows])
+            z = np.where(pen, np.minimum(z0[rows], self._norm_ppf_array(p)), z0[rows])
+            Q = np.maximum(0.0, mu[rows] + z * sigma[rows])
+            return p, z, Q, np.maximum(0.0, Q - stock[rows])
+
+        def bound(k: int, rows: np.ndarray) -> np.ndarray:
+            # Con mult·w >= p0·(Cu + Co) en todas las filas el fractil es 0 y no se pide nada
+            hi = np.zeros(n_stores)
+            w = limits[k][0][rows]
+            np.maximum.at(hi, store_code[rows], np.divide(p0[rows] * denom[rows], w, out=np.zeros(len(rows)), where=w > 0))
+            return hi * (1 + 1e-9) + 1e-12
+
+        def mix(rows: np.ndarray, sol_hi, sol_lo, t: np.ndarray):
+            # Combinación convexa de dos soluciones: el uso de cada restricción es lineal en t.
+            # En las filas combinadas z y el fractil salen del Q resultante
+            p, z, Q, pedido = sol_hi
+            _, _, Q_lo, pedido_lo = sol_lo
+            mixed = (t > 0) & (pedido_lo != pedido)
+            if not mixed.any():
+                return sol_hi
+            pedido_t = pedido + t * (pedido_lo - pedido)
+            Q_t = np.where(pedido_t > 0, stock[rows] + pedido_t, Q + t * (Q_lo - Q))
+            z_t = (Q_t - mu[rows]) / sigma[rows]
+            return (
+                np.where(mixed, ndtr(z_t), p),
+                np.where(mixed, z_t, z),
+                np.where(mixed, Q_t, Q),
+                np.where(mixed, pedido_t, pedido),
+            )
+
+        def blend(k: int, rows: np.ndarray, sol_hi, sol_lo):
+            # Recuperación primal: con demanda Normal el pedido de un SKU cae a 0 en un intervalo
+            # del multiplicador más angosto que la resolución del float, así que la bisección
+            # puede terminar con holgura. Entre el extremo factible (hi) y el infactible (lo)
+            # se toma el punto que deja la restricción k justa
+            limit = limits[k][1]
+            u_hi, u_lo = usage(k, rows, sol_hi[3]), usage(k, rows, sol_lo[3])
+            with np.errstate(invalid="ignore", divide="ignore"):
+                r = np.clip((limit - u_hi) / (u_lo - u_hi), 0.0, 1.0)
+            t = np.where(u_lo > u_hi, r, 0.0)
+            return mix(rows, sol_hi, sol_lo, t[store_code[rows]])
+
+        def illinois(f_lo, f_hi, side, f, active, limit):
+            # Un paso de regula falsi (Illinois) sobre un multiplicador: el uso es no creciente
+            # en él; si el mismo extremo se conserva dos veces, se reduce su peso a la mitad
+            ok = active & (f <= limit * 1e-9)
+            up = active & ~ok
+            f_lo = np.where(ok & (side == 1), 0.5 * f_lo, np.where(up, f, f_lo))
+            f_hi = np.where(up & (side == -1), 0.5 * f_hi, np.where(ok, f, f_hi))
+            side = np.where(ok, 1, np.where(up, -1, side)).astype(np.int8)
+            return ok, up, f_lo, f_hi, side
+
+        def secant(lo, hi, f_lo, f_hi):
+            with np.errstate(invalid="ignore", divide="ignore"):
+                mid = lo + f_lo * (hi - lo) / (f_lo - f_hi)
+            return np.where(np.isfinite(mid) & (mid > lo) & (mid < hi), mid, 0.5 * (lo + hi))
+
+        def fit(k: int, stores: np.ndarray, rows: np.ndarray, other: np.ndarray):
+            # Menor multiplicador k (por tienda) que cumple su restricción en `stores` con la
+            # penalización `other` de las demás fija; devuelve (multiplicador, solución justa)
+            weight, limit = limits[k]
+            sc = store_code[rows]
+            sol_lo = solve(rows, other)
+            f_lo = usage(k, rows, sol_lo[3]) - limit
+            need = stores & (f_lo > limit * 1e-9)
+            hi = np.where(need, bound(k, rows), 0.0)
+            lo = np.zeros(n_stores)
+            f_hi = -limit.copy()
+            side = np.zeros(n_stores, dtype=np.int8)
+            active = need.copy()
+            for _ in range(n_iter):
+                if not active.any():
+                    break
+                sel = active[sc]
+                act = rows[sel]
+                mid = secant(lo, hi, f_lo, f_hi)
+                f = usage(k, act, solve(act, other[sel] + mid[store_code[act]] * weight[act])[3]) - limit
+                ok, up, f_lo, f_hi, side = illinois(f_lo, f_hi, side, f, active, limit)
+                hi = np.where(ok, mid, hi)
+                lo = np.where(up, mid, lo)
+                # Listo cuando la restricción queda justa (tol) o el intervalo ya no se reduce
+                active &= ~(ok & (f >= -limit * tol)) & (hi - lo > 1e-9 * hi)
+            sol_hi = solve(rows, other + hi[sc] * weight[rows])
+            sol_lo = solve(rows, other + lo[sc] * weight[rows])
+            return hi, blend(k, rows, sol_hi, sol_lo)
+
+        def nested(stores: np.ndarray, rows: np.ndarray):
+            # Ambas restricciones activas: Illinois sobre ν y, para cada ν, λ(ν) con su solución
+            # justa en espacio. El uso del presupuesto de esa solución es continuo y no creciente
+            # en ν, así que al converger las dos restricciones quedan justas (holgura complementaria)
+            sc = store_code[rows]
+            weight, limit = limits[1]
+
+            def inner(nu):
+                lam, sol = fit(0, stores, rows, nu[sc] * weight[rows])
+                return lam, sol, usage(1, rows, sol[3]) - limit
+
+            lo = np.zeros(n_stores)
+            hi = np.where(stores, bound(1, rows), 0.0)
+            lam_lo, sol_lo, f_lo = inner(lo)
+            lam_hi, sol_hi, f_hi = inner(hi)
+            side = np.zeros(n_stores, dtype=np.int8)
+            active = stores & (f_lo > limit * 1e-9)
+            for _ in range(max_rounds):
+                if not active.any():
+                    break
+                mid = np.where(active, secant(lo, hi, f_lo, f_hi), hi)
+                lam, sol, f = inner(mid)
+                ok, up, f_lo, f_hi, side = illinois(f_lo, f_hi, side, f, active, limit)
+                sol_hi = tuple(np.where(ok[sc], a, b) for a, b in zip(sol, sol_hi))
+                sol_lo = tuple(np.where(up[sc], a, b) for a, b in zip(sol, sol_lo))
+                lam_hi = np.where(ok, lam, lam_hi)
+                hi = np.where(ok, mid, hi)
+                lo = np.where(up, mid, lo)
+                active &= ~(ok & (f >= -limit * tol)) & (hi - lo > 1e-9 * hi)
+            # Ambos extremos cumplen el espacio: su combinación también, con el presupuesto justo
+            return lam_hi, hi, blend(1, rows, sol_hi, sol_lo)
+
+        rows = np.flatnonzero(binding[store_code])
+        sc = store_code[rows]
+        no_penalty = np.zeros(len(rows))
+        if len(limits) == 1:
+            mults[0], sol = fit(0, binding, rows, no_penalty)
+        else:
+            # Cada restricción por separado; si ninguna de las dos soluciones cumple la otra,
+            # ambas están activas y se resuelven juntas
+            fits = [fit(k, binding, rows, no_penalty) for k in range(len(limits))]
+            single = [binding & ~violated(1 - k, rows, fits[k][1][3]) for k in range(len(limits))]
+            single[1] &= ~single[0]
+            both = binding & ~single[0] & ~single[1]
+            sol = tuple(np.where(single[0][sc], a, b) for a, b in zip(fits[0][1], fits[1][1]))
+            mults[0] = np.where(single[0], fits[0][0], 0.0)
+            mults[1] = np.where(single[1], fits[1][0], 0.0)
+            if both.any():
+                lam, nu, sol_both = nested(both, rows)
+                sol = tuple(np.where(both[sc], a, b) for a, b in zip(sol_both, sol))
+                mults[0] = np.where(both, lam, mults[0])
+                mults[1] = np.where(both, nu, mults[1])
+
+        p, z, Q, pedido = sol
+        pen = np.zeros(len(rows))
+        for k, (weight, _) in enumerate(limits):
+            pen += mults[k][sc] * weight[rows]
+        # Costos con el z efectivo de Q (Q = 0 recorta la cola); sin penalización, el de base
+        mu, sigma, Cu, Co = mu[rows], sigma[rows], Cu[rows], Co[rows]
+        z_cost = np.where(pen > 0, np.maximum(z, -mu / sigma), z)
+
+        out = OptimizationArrays(**{k: v.copy() for k, v in vars(base).items()})
+        out.Q_objetivo[rows] = Q
+        out.pedido_sugerido[rows] = pedido
+        out.p_critico[rows] = p
+        out.service_level_approx[rows] = p
+        out.expected_stockout_cost[rows] = np.where(Cu > 0, Cu * sigma * self._loss_function_array(z_cost), 0.0)
+        out.expected_overstock_cost[rows] = np.where(Co > 0, Co * sigma * self._loss_function_array(-z_cost), 0.0)
+        return (out, *shadow())
+
+    def compute_order_quantities_dist(
+        self,
+        dist: DemandDistributions,
+        stock_actual: np.ndarray,
+        margen_unitario: np.ndarray,
+        costo_overstock_unitario: np.ndarray,
+    ) -> OptimizationArrays:
+        """
+        Newsvendor vectorizado con una distribución de demanda arbitraria (`DemandDistributions`)
+        en lugar de la Normal: Q = F⁻¹(p) y costos con las unidades esperadas en faltante
+        E[(D-Q)+] y en exceso E[(Q-D)+] = Q - E[D] + E[(D-Q)+].
+
+        Mismos casos especiales que `compute_order_quantities`; el recorte z_clip se aplica como
+        p ∈ [Φ(z_clip[0]), Φ(z_clip[1])] en el caso general.
+        """
+        stock_actual = np.fmax(0.0, np.asarray(stock_actual, dtype=float))
+        Cu = np.fmax(0.0, np.asarray(margen_unitario, dtype=float))
+        Co = np.fmax(0.0, np.asarray(costo_overstock_unitario, dtype=float))
+        p, both_zero, normal = self._critical_fractiles(Cu, Co)
+
+        p_lo, p_hi = ndtr(self.z_clip[0]), ndtr(self.z_clip[1])
+        mean = dist.mean()
+        Q = np.where(both_zero, mean, dist.ppf(np.where(normal, np.clip(p, p_lo, p_hi), p)))
+        Q = np.maximum(0.0, Q)
+        pedido = np.maximum(0.0, Q - stock_actual)
+
+        shortage = dist.expected_shortage(Q)
+        overage = np.maximum(0.0, Q - mean + shortage)
+        return OptimizationArrays(
+            Q_objetivo=Q,
+            pedido_sugerido=pedido,
+            p_critico=p,
+            expected_stockout_cost=np.where(Cu > 0, Cu * shortage, 0.0),
+            expected_overstock_cost=np.where(Co > 0, Co * overage, 0.0),
+            service_level_approx=p,
+        )
+
     def compute_order_quantity(
         self,
         mu_week: float,
@@ -196,6 +791,64 @@ class InventoryOptimizer:
 # Orchestration
 # ----------------------------
 
+@dataclass
+class PlanState:
+    """
+    Estado de la última corrida de `ReplenishmentPlanner.run`, para escenarios what-if sin
+    volver a pronosticar: la tabla maestra con el forecast (mu_semana, sigma_semana, ...) y
+    las columnas del plan, una fila por fila maestra, más la distribución de demanda usada.
+
+    `save` / `load` lo persisten como snapshot columnar (.npy por columna, ver `write_snapshot`).
+    """
+    master: MasterIndex
+    frame: pd.DataFrame
+    dist: Optional[DemandDistributions] = None
+
+    def save(self, path: str) -> None:
+        os.makedirs(path, exist_ok=True)
+        write_snapshot(self.frame, os.path.join(path, "frame"), source={})
+        meta: Dict[str, Any] = {
+            "master_columns": list(self.master.columns),
+            "dtypes": {c: str(t) for c, t in self.frame.dtypes.items()},
+            "dist": None,
+        }
+        if self.dist is not None:
+            arrays = {k: getattr(self.dist, k) for k in ("mu", "var", "samples", "levels", "values")}
+            meta["dist"] = {"kind": self.dist.kind, "arrays": [k for k, v in arrays.items() if v is not None]}
+            for k in meta["dist"]["arrays"]:
+                np.save(os.path.join(path, f"dist_{k}.npy"), arrays[k], allow_pickle=False)
+        with open(os.path.join(path, "plan_state.json"), "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, path: str) -> Optional["PlanState"]:
+        """Carga un estado guardado con `save`; None si no existe."""
+        meta_path = os.path.join(path, "plan_state.json")
+        frame = read_snapshot(os.path.join(path, "frame"))
+        if frame is None or not os.path.exists(meta_path):
+            return None
+        with open(meta_path, encoding="utf-8") as f:
+            meta = json.load(f)
+
+        # Copia en memoria (el snapshot es memory-map de solo lectura) con los dtypes del frame
+        # guardado: el snapshot devuelve ids categóricos y numéricos angostados
+        frame = frame.copy(deep=True).astype(meta.get("dtypes", {}))
+        tienda_code, tiendas = pd.factorize(frame["id_tienda"].astype(str).to_numpy(), sort=True)
+        producto_code, productos = pd.factorize(frame["id_producto"].astype(str).to_numpy(), sort=True)
+        master = MasterIndex(
+            tiendas=pd.Index(tiendas),
+            productos=pd.Index(productos),
+            tienda_code=tienda_code.astype(np.int32),
+            producto_code=producto_code.astype(np.int32),
+            columns={c: frame[c].to_numpy() for c in meta["master_columns"]},
+        )
+        dist = None
+        if meta["dist"] is not None:
+            arrays = {k: np.load(os.path.join(path, f"dist_{k}.npy")) for k in meta["dist"]["arrays"]}
+            dist = DemandDistributions(meta["dist"]["kind"], **arrays)
+        return cls(master=master, frame=frame, dist=dist)
+
+
 class ReplenishmentPlanner:
     """
     Orquestador principal que integra pronósticos y optimización de inventario.
@@ -212,12 +865,235 @@ class ReplenishmentPlanner:
         repo: DataSource,
         forecaster: DemandForecaster,
         optimizer: InventoryOptimizer,
+        dense_panel: bool = False,
+        time_budget_s: Optional[float] = None,
+        constraints: Optional[StoreConstraints] = None,
+        demand_model: str = "normal",
+        empirical_weeks: int = 26,
     ):
+        if demand_model not in ("normal", "poisson", "negbin", "empirical"):
+            raise ValueError("demand_model debe ser 'normal', 'poisson', 'negbin' o 'empirical'")
+        if constraints is not None and demand_model != "normal":
+            raise ValueError("constraints solo está disponible con demand_model='normal'")
         self.repo = repo
         self.forecaster = forecaster
         self.optimizer = optimizer
+        # Si True, usa la matriz densa (series x días) en lugar del panel largo cruzado
+        self.dense_panel = dense_panel
+        # Si se define, el pronóstico usa `fit_predict_week_budget` priorizando por
+        # margen_unitario x volumen reciente; el uso del presupuesto queda en `budget_report`
+        self.time_budget_s = time_budget_s
+        self.budget_report: Optional[Dict[str, Any]] = None
+        # Si se define, asigna espacio/presupuesto entre todos los SKUs de cada tienda
+        # (`compute_order_quantities_constrained`) y agrega los precios sombra por tienda
+        self.constraints = constraints
+        # Distribución de la demanda semanal para el newsvendor: "normal" (μ + zσ), "poisson" /
+        # "negbin" (ajustadas a μ, σ² del forecast) o "empirical" (últimas `empirical_weeks`
+        # sumas semanales de la historia); ver `DemandDistributions`
+        self.demand_model = demand_model
+        self.empirical_weeks = empirical_weeks
+        # Entradas y plan de la última corrida, para `what_if`
+        self.last_state: Optional[PlanState] = None
+
+    def _demand_distributions(self, master, df: pd.DataFrame, sales_panel) -> DemandDistributions:
+        """Distribución por fila de `df` según `demand_model`."""
+        mu = df["mu_semana"].to_numpy(dtype=float)
+        if self.demand_model == "poisson":
+            return DemandDistributions.poisson(mu)
+        if self.demand_model == "negbin":
+            return DemandDistributions.negative_binomial(mu, df["sigma_semana"].to_numpy(dtype=float) ** 2)
+
+        if sales_panel is None:
+            return DemandDistributions.empirical(np.empty((len(df), 0)))
+
+        # Empírica: sumas semanales de la matriz de ventas, alineadas a las filas del maestro
+        tiendas, productos, Y, _, start, _ = DemandForecaster._panel_arrays(sales_panel)
+        weekly = DemandDistributions.weekly_sums(Y, start, self.empirical_weeks)
+        samples = np.full((len(df), weekly.samples.shape[1]), np.nan)
+        pos = master.align(np.asarray(tiendas), np.asarray(productos))
+        found = pos >= 0
+        samples[found] = weekly.samples[pos[found]]
+        return DemandDistributions.empirical(samples)
+
+    def _constraint_arrays(
+        self, master, df: pd.DataFrame, rows: Optional[np.ndarray] = None
+    ) -> Dict[str, Optional[np.ndarray]]:
+        """
+        Argumentos de restricción para `compute_order_quantities_constrained`: límites por
+        tienda sobre todo `df` y pesos por fila (solo `rows` si se pasa).
+        """
+        c = self.constraints
+        codes = master.tienda_code
+        n_stores = len(master.tiendas)
+        out: Dict[str, Optional[np.ndarray]] = {}
+
+        if "m2_por_unidad" in df:
+            espacio = df["m2_por_unidad"].to_numpy(dtype=float)
+        elif c.m2_por_unidad is not None:
+            espacio = np.full(len(df), float(c.m2_por_unidad))
+        else:
+            espacio = None
+        if espacio is not None:
+            espacio = np.nan_to_num(espacio, nan=0.0)
+            # Capacidad de la tienda menos lo que ya ocupa el stock actual; sin tamaño -> sin límite
+            capacidad = np.full(n_stores, np.inf)
+            capacidad[codes] = df["tamaño_m2"].to_numpy(dtype=float) * c.ocupacion_max
+            capacidad = np.nan_to_num(capacidad, nan=np.inf)
+            ocupado = np.bincount(codes, weights=espacio * np.maximum(0.0, df["stock_actual"].to_numpy(dtype=float)),
+                                  minlength=n_stores)
+            out["espacio_unitario"] = espacio
+            out["espacio_libre"] = capacidad - ocupado
 
-    def run(self, verbose: bool = False) -> pd.DataFrame:
+        if "presupuesto_semanal" in df:
+            presupuesto = np.full(n_stores, np.inf)
+            presupuesto[codes] = df["presupuesto_semanal"].to_numpy(dtype=float)
+        elif c.presupuesto_semanal is None:
+            presupuesto = None
+        elif np.isscalar(c.presupuesto_semanal):
+            presupuesto = np.full(n_stores, float(c.presupuesto_semanal))
+        else:
+            presupuesto = pd.Series(c.presupuesto_semanal, dtype=float).reindex(master.tiendas).to_numpy()
+        if presupuesto is not None:
+            out["costo_unitario"] = np.nan_to_num(df["costo_unitario"].to_numpy(dtype=float), nan=0.0)
+            out["presupuesto"] = np.nan_to_num(presupuesto, nan=np.inf)
+        if rows is not None:
+            for key in ("espacio_unitario", "costo_unitario"):
+                if key in out:
+                    out[key] = out[key][rows]
+        return out
+
+    def _optimize(
+        self, master, df: pd.DataFrame, dist: Optional[DemandDistributions], rows: Optional[np.ndarray] = None
+    ) -> Dict[str, np.ndarray]:
+        """Columnas del plan para las filas `rows` de `df` (todas si None)."""
+        def col(name: str) -> np.ndarray:
+            values = df[name].to_numpy(dtype=float)
+            return values if rows is None else values[rows]
+
+        inputs = dict(
+            mu_week=col("mu_semana"),
+            sigma_week=col("sigma_semana"),
+            stock_actual=col("stock_actual"),
+            margen_unitario=col("margen_unitario"),
+            costo_overstock_unitario=col("costo_overstock"),
+        )
+        out: Dict[str, np.ndarray] = {}
+        if self.demand_model != "normal":
+            opt = self.optimizer.compute_order_quantities_dist(
+                dist if rows is None else dist.take(rows),
+                inputs["stock_actual"], inputs["margen_unitario"], inputs["costo_overstock_unitario"],
+            )
+        elif self.constraints is None:
+            opt = self.optimizer.compute_order_quantities(**inputs)
+        else:
+            codes = master.tienda_code if rows is None else master.tienda_code[rows]
+            opt, lam, nu = self.optimizer.compute_order_quantities_constrained(
+                codes, **inputs, **self._constraint_arrays(master, df, rows)
+            )
+            out["precio_sombra_m2"] = lam[codes]
+            out["precio_sombra_presupuesto"] = nu[codes]
+
+        out["Q_objetivo_semana"] = opt.Q_objetivo
+        out["pedido_sugerido"] = opt.pedido_sugerido
+        out["p_critico_agresividad"] = opt.p_critico
+        out["service_level_approx"] = opt.service_level_approx
+        out["costo_esperado_stockout"] = opt.expected_stockout_cost
+        out["costo_esperado_overstock"] = opt.expected_overstock_cost
+        out["costo_total_esperado"] = opt.expected_stockout_cost + opt.expected_overstock_cost
+        return out
+
+    def _output(self, master, df: pd.DataFrame, rows: Optional[np.ndarray] = None) -> pd.DataFrame:
+        """Salida amigable: columnas del plan ordenadas por (id_tienda, id_producto)."""
+        cols = [
+            "id_tienda", "id_producto", "nombre",
+            "stock_actual", "Q_objetivo_semana", "pedido_sugerido",
+            "mu_semana", "sigma_semana",
+            "margen_unitario", "costo_overstock",
+            "p_critico_agresividad", "service_level_approx",
+            "costo_esperado_stockout", "costo_esperado_overstock", "costo_total_esperado",
+            "ciudad", "tamaño_m2",
+        ]
+        if "metodo" in df:
+            cols.append("metodo")
+        if "precio_sombra_m2" in df:
+            cols += ["precio_sombra_m2", "precio_sombra_presupuesto"]
+
+        # Los códigos del maestro siguen el orden de los ids: ordenar por códigos = por ids
+        rows = np.arange(len(df)) if rows is None else np.asarray(rows)
+        order = rows[np.lexsort((master.producto_code[rows], master.tienda_code[rows]))]
+        return df[cols].iloc[order].reset_index(drop=True)
+
+    @staticmethod
+    def _patched(column: pd.Series, rows: np.ndarray, values: np.ndarray) -> np.ndarray:
+        """Copia de `column` con `values` en `rows`; conserva el dtype entero si los valores lo son."""
+        out = column.to_numpy()
+        values = np.asarray(values)
+        if out.dtype.kind in "iu" and not np.all(np.mod(values, 1) == 0):
+            out = out.astype(float)
+        else:
+            out = out.copy()
+        out[rows] = values
+        return out
+
+    def what_if(
+        self,
+        catalogo: pd.DataFrame,
+        only_changed: bool = False,
+        state: Optional[PlanState] = None,
+    ) -> pd.DataFrame:
+        """
+        Escenario de costos sin volver a pronosticar, sobre `state` (por defecto la última corrida).
+
+        `catalogo`: filas con `id_producto` y cualquiera de `costo_unitario`, `precio_venta`,
+        `costo_almacenamiento_semanal` (los productos que no aparecen quedan igual). Solo se
+        recalculan margen_unitario / costo_overstock y el optimizador en las filas cuyas
+        entradas cambiaron (con `constraints`, en todas las filas de sus tiendas).
+
+        Retorna el plan completo como `run` (o solo las filas recalculadas si `only_changed`).
+        El estado no se modifica: cada escenario parte del plan base.
+        """
+        state = state or self.last_state
+        if state is None:
+            raise ValueError("No hay plan base: ejecuta run() o pasa un PlanState")
+        master, base = state.master, state.frame
+        cost_cols = [c for c in ("costo_unitario", "precio_venta", "costo_almacenamiento_semanal") if c in catalogo]
+
+        prod = master.productos.get_indexer(catalogo["id_producto"].astype(str).to_numpy())
+        known = prod >= 0
+        scen = base.copy(deep=False)
+        changed = np.zeros(len(base), dtype=bool)
+        for c in cost_cols:
+            # Valor nuevo por producto (NaN = sin cambio) y gather por fila maestra
+            table = np.full(len(master.productos), np.nan)
+            table[prod[known]] = catalogo[c].to_numpy(dtype=float)[known]
+            new = table[master.producto_code]
+            old = base[c].to_numpy(dtype=float)
+            diff = ~np.isnan(new) & (new != old)
+            if diff.any():
+                scen[c] = self._patched(base[c], diff, new[diff])
+                changed |= diff
+
+        rows = np.flatnonzero(changed)
+        if self.constraints is not None and len(rows):
+            rows = np.flatnonzero(np.isin(master.tienda_code, np.unique(master.tienda_code[rows])))
+
+        if len(rows):
+            # Mismas definiciones que MasterIndex.build, solo en las filas afectadas
+            precio = scen["precio_venta"].to_numpy(dtype=float)[rows]
+            costo = scen["costo_unitario"].to_numpy(dtype=float)[rows]
+            almacenamiento = scen["costo_almacenamiento_semanal"].to_numpy(dtype=float)[rows]
+            for c, values in (
+                ("margen_unitario", np.maximum(precio - costo, 0)),
+                ("costo_overstock", np.maximum(costo + almacenamiento, 0)),
+            ):
+                scen[c] = self._patched(base[c], rows, values)
+
+            for c, values in self._optimize(master, scen, state.dist, rows).items():
+                scen[c] = self._patched(base[c], rows, values)
+
+        return self._output(master, scen, rows if only_changed else None)
+
+    def run(self, verbose: bool = False, partitions: Optional[List[str]] = None) -> pd.DataFrame:
         """
         Ejecuta el pipeline completo de optimización de inventario.
         
@@ -225,72 +1101,176 @@ class ReplenishmentPlanner:
         -----------
         verbose : bool
             Si True, imprime información de progreso
+        partitions : list, opcional
+            Si el repositorio usa un layout particionado (`DataSource.from_partitions`),
+            planifica solo estas particiones (tiendas o ciudades) leyendo solo sus archivos.
+            El panel usa la grilla de fechas de todo el origen (`sales_date_range()`), así
+            las filas son iguales a las de la corrida completa.
             
         Retorna:
         --------
         DataFrame con recomendaciones de pedido para cada SKU-tienda
         """
+        if partitions is None:
+            return self._plan(self.repo, verbose=verbose, time_budget_s=self.time_budget_s)
+        return self._plan(
+            self.repo.with_partitions(partitions),
+            verbose=verbose,
+            time_budget_s=self.time_budget_s,
+            date_range=self.repo.sales_date_range(),
+        )
+
+    def run_streaming(
+        self,
+        stores_per_block: int = 1,
+        output_path: Optional[str] = None,
+        verbose: bool = False,
+    ) -> Iterator[pd.DataFrame]:
+        """
+        Modo streaming: planifica `stores_per_block` tiendas a la vez (con layout particionado,
+        `stores_per_block` particiones a la vez, leyendo solo sus archivos) y entrega el plan de
+        cada bloque apenas está listo. Panel, forecast, tabla maestra y resultado existen solo
+        para el bloque en curso. Con layout particionado la memoria pico la fija el bloque más
+        grande; sin particiones las ventas crudas ya están cargadas completas (`load()`) y cada
+        bloque toma sus filas de `repo.ventas`, así que el pico es esa tabla más el bloque. Para
+        acotar también la tabla cruda, particionar antes con `write_partitions` y abrir con
+        `DataSource.from_partitions`.
+
+        Si se pasa `output_path`, cada bloque se agrega al CSV (encabezado en el primero) antes
+        de entregarse, de modo que otros procesos pueden consumir pedidos mientras sigue la
+        corrida. Todos los bloques usan la grilla de fechas de todo el origen
+        (`sales_date_range()`), así cada serie se pronostica igual que en `run()`.
+
+        Sin particiones o con particiones por tienda, las tiendas salen en orden y la
+        concatenación de bloques es igual a `run()`. Con particiones por ciudad los bloques
+        salen por nombre de partición: las filas son las mismas que en `run()`, que se
+        recupera ordenando por (id_tienda, id_producto). Difieren de `run()` el presupuesto
+        (`time_budget_s` se reparte en partes iguales por bloque) y `hierarchy` (la
+        reconciliación no cruza bloques).
+
+        Uso:
+            for plan_bloque in planner.run_streaming(output_path="plan.csv"):
+                ...
+        """
+        blocks = self._store_blocks(stores_per_block)
+        budget = None if self.time_budget_s is None else self.time_budget_s / max(1, len(blocks))
+        date_range = self.repo.sales_date_range()
+        header = True
+        for i, make_repo in enumerate(blocks):
+            plan = self._plan(make_repo(), verbose=False, time_budget_s=budget, date_range=date_range)
+            if output_path is not None:
+                plan.to_csv(output_path, mode="w" if header else "a", header=header, index=False)
+                header = False
+            if verbose:
+                print(f"🏬 Bloque {i + 1}/{len(blocks)}: {plan['id_tienda'].nunique()} tiendas, "
+                      f"{plan['pedido_sugerido'].sum():.0f} unidades")
+            yield plan
+        # El estado de un bloque no sirve como plan base de escenarios
+        self.last_state = None
+
+    def _store_blocks(self, stores_per_block: int) -> List:
+        """
+        Bloques de tiendas en orden, como funciones que arman el DataSource de cada bloque
+        (perezosas: solo un bloque cargado a la vez).
+        """
+        repo = self.repo
+        if repo.partitions_dir is not None:
+            available = DataSource.read_partition_manifest(repo.partitions_dir)["partitions"]
+            names = sorted(available) if repo.partitions is None else [str(p) for p in repo.partitions]
+            return [
+                (lambda part=names[i:i + stores_per_block]: repo.with_partitions(part))
+                for i in range(0, len(names), stores_per_block)
+            ]
+
+        # Datos ya cargados (la tabla cruda completa vive en memoria): índices de filas por
+        # tienda (un solo argsort) y una copia de sus filas por bloque
+        ventas_tienda = repo.ventas["id_tienda"].astype(str).to_numpy()
+        inv_tienda = repo.inventario["id_tienda"].astype(str).to_numpy()
+        stores = np.unique(inv_tienda)
+        ventas_code = np.searchsorted(stores, ventas_tienda)
+        ventas_code[(ventas_code >= len(stores)) | (stores[np.minimum(ventas_code, len(stores) - 1)] != ventas_tienda)] = -1
+        inv_code = np.searchsorted(stores, inv_tienda)
+        ventas_order = np.argsort(ventas_code, kind="stable")
+        inv_order = np.argsort(inv_code, kind="stable")
+        ventas_sorted = ventas_code[ventas_order]
+        inv_sorted = inv_code[inv_order]
+
+        def make(a: int, b: int):
+            sub = copy.copy(repo)
+            v = ventas_order[np.searchsorted(ventas_sorted, a):np.searchsorted(ventas_sorted, b)]
+            i = inv_order[np.searchsorted(inv_sorted, a):np.searchsorted(inv_sorted, b)]
+            sub.ventas = repo.ventas.iloc[np.sort(v)].reset_index(drop=True)
+            sub.inventario = repo.inventario.iloc[np.sort(i)].reset_index(drop=True)
+            sub._master_index = None
+            return sub
+
+        return [
+            (lambda a=a: make(a, min(a + stores_per_block, len(stores))))
+            for a in range(0, len(stores), stores_per_block)
+        ]
+
+    def _plan(
+        self,
+        repo: DataSource,
+        verbose: bool = False,
+        time_budget_s: Optional[float] = None,
+        date_range: Optional[Tuple[pd.Timestamp, pd.Timestamp]] = None,
+    ) -> pd.DataFrame:
+        """Pipeline completo sobre `repo` (todas sus tiendas); `date_range` fija la grilla del panel."""
         if verbose:
             print("📊 Cargando datos históricos de ventas...")
-        sales_panel = self.repo.sales_daily()
-        
-        if verbose:
-            print("🔮 Generando pronósticos de demanda con incertidumbre...")
-        forecast = self.forecaster.fit_predict_week(sales_panel)
+        # Sin ventas (p. ej. un bloque de tiendas nuevas en `run_streaming`) todo queda sin historia
+        has_sales = len(repo.ventas) > 0
+        sales_panel = None
+        if has_sales:
+            sales_panel = repo.sales_matrix(date_range) if self.dense_panel else repo.sales_daily(date_range)
         
         if verbose:
             print("📦 Cargando inventario y costos actuales...")
-        master = self.repo.master_store()
+        master = repo.master_index()
+        df = master.to_frame()
 
-        # Unir forecast con tabla de stock/costos
-        df = master.merge(
-            forecast,
-            on=["id_tienda", "id_producto"],
-            how="left",
-        )
+        if verbose:
+            print("🔮 Generando pronósticos de demanda con incertidumbre...")
+        if not has_sales:
+            forecast = pd.DataFrame({c: [] for c in ("id_tienda", "id_producto", "mu_semana", "sigma_semana")})
+            if time_budget_s is not None:
+                forecast["metodo"] = []
+        elif time_budget_s is None:
+            forecast = self.forecaster.fit_predict_week(sales_panel)
+        else:
+            forecast = self.forecaster.fit_predict_week_budget(sales_panel, time_budget_s, value=df)
+            self.budget_report = self.forecaster.last_budget_report
+            if verbose:
+                r = self.budget_report
+                print(f"   ⏱️  {r['n_prophet']}/{r['n_series']} series con Prophet en {r['elapsed_s']:.1f}s "
+                      f"de {r['budget_s']:.1f}s ({r['valor_cubierto']:.0%} del valor)")
 
+        # Unir forecast con tabla de stock/costos: gather por códigos de (tienda, producto)
         # Si algún SKU-tienda no tuvo ventas históricas, asumir demanda 0 con sigma mínima
-        df["mu_semana"] = df["mu_semana"].fillna(0.0)
-        df["sigma_semana"] = df["sigma_semana"].fillna(1.0)
+        pos = master.align(forecast["id_tienda"].to_numpy(), forecast["id_producto"].to_numpy())
+        found = pos >= 0
+        mu = np.zeros(len(df))
+        sigma = np.ones(len(df))
+        mu[found] = forecast["mu_semana"].to_numpy(dtype=float)[pos[found]]
+        sigma[found] = forecast["sigma_semana"].to_numpy(dtype=float)[pos[found]]
+        df["mu_semana"] = mu
+        df["sigma_semana"] = sigma
+        if "metodo" in forecast:
+            metodo = np.full(len(df), "sin_historia", dtype=object)
+            metodo[found] = forecast["metodo"].to_numpy()[pos[found]]
+            df["metodo"] = metodo
 
         if verbose:
             print(f"⚙️  Optimizando política de pedidos para {len(df)} SKU-tiendas...")
         
-        # Calcular política óptima
-        results = []
-        for row in df.itertuples(index=False):
-            opt_result = self.optimizer.compute_order_quantity(
-                mu_week=row.mu_semana,
-                sigma_week=row.sigma_semana,
-                stock_actual=row.stock_actual,
-                margen_unitario=row.margen_unitario,
-                costo_overstock_unitario=row.costo_overstock,
-            )
-            results.append(opt_result)
-
-        # Agregar resultados al dataframe
-        df["Q_objetivo_semana"] = [r.Q_objetivo for r in results]
-        df["pedido_sugerido"] = [r.pedido_sugerido for r in results]
-        df["p_critico_agresividad"] = [r.p_critico for r in results]
-        df["service_level_approx"] = [r.service_level_approx for r in results]
-        df["costo_esperado_stockout"] = [r.expected_stockout_cost for r in results]
-        df["costo_esperado_overstock"] = [r.expected_overstock_cost for r in results]
-        df["costo_total_esperado"] = (
-            df["costo_esperado_stockout"] + df["costo_esperado_overstock"]
-        )
+        # Calcular política óptima (vectorizada sobre todas las filas)
+        dist = None if self.demand_model == "normal" else self._demand_distributions(master, df, sales_panel)
+        for name, values in self._optimize(master, df, dist).items():
+            df[name] = values
+        self.last_state = PlanState(master=master, frame=df, dist=dist)
 
-        # Salida amigable
-        cols = [
-            "id_tienda", "id_producto", "nombre",
-            "stock_actual", "Q_objetivo_semana", "pedido_sugerido",
-            "mu_semana", "sigma_semana",
-            "margen_unitario", "costo_overstock",
-            "p_critico_agresividad", "service_level_approx",
-            "costo_esperado_stockout", "costo_esperado_overstock", "costo_total_esperado",
-            "ciudad", "tamaño_m2",
-        ]
-        
-        result_df = df[cols].sort_values(["id_tienda", "id_producto"]).reset_index(drop=True)
+        result_df = self._output(master, df)
         
         if verbose:
             print(f"✅ Optimización completada!")
@@ -0,0 +1,219 @@
+from dataclasses import dataclass
+import argparse
+import os
+import time
+from typing import Dict
+
+import numpy as np
+import pandas as pd
+
+
+CIUDADES = ("Bogotá", "Medellín", "Cali", "Barranquilla", "Bucaramanga", "Cartagena", "Pereira", "Manizales")
+NOMBRES = ("Tinto", "Café con Leche", "Cappuccino", "Pan de Bono", "Buñuelo", "Croissant", "Jugo", "Té")
+
+
+@dataclass(frozen=True)
+class SyntheticConfig:
+    """
+    Parámetros del generador de datos sintéticos de supply optimization.
+
+    - sparsity: proporción esperada de días sin venta por serie (0 = todas las series venden a
+      diario). Es la proporción total: los días con venta tienen al menos una unidad
+    - weekly_amplitude / yearly_amplitude: amplitud relativa de la estacionalidad
+    - write_zero_rows: si False (como un export transaccional), los días sin venta no se escriben
+    """
+    n_stores: int = 20
+    n_skus: int = 8
+    n_days: int = 91
+    start_date: str = "2024-01-01"
+    sparsity: float = 0.0
+    weekly_amplitude: float = 0.25
+    yearly_amplitude: float = 0.15
+    mean_daily_units: float = 8.0
+    n_cities: int = 4
+    write_zero_rows: bool = False
+    seed: int = 42
+    block_cells: int = 5_000_000   # celdas (tienda x sku x día) generadas por bloque
+
+
+class SyntheticSupplyData:
+    """
+    Generador reproducible (semilla) de `ventas_historicas`, `inventario_actual`,
+    `catalogo_productos` y `maestro_tiendas` con los mismos esquemas que los datos reales.
+
+    Las ventas se generan vectorizadas por bloques de tiendas y se escriben en modo append,
+    de modo que la memoria es acotada por `block_cells` y no por el tamaño del archivo.
+    """
+
+    def __init__(self, config: SyntheticConfig = SyntheticConfig()):
+        if not 0.0 <= config.sparsity < 1.0:
+            raise ValueError("sparsity debe estar en [0, 1)")
+        self.config = config
+        # Un stream independiente por tabla: cada tabla es reproducible sin importar el orden de llamada
+        self._seeds = dict(zip(
+            ("niveles", "catalogo", "tiendas", "inventario", "ventas"),
+            np.random.SeedSequence(config.seed).spawn(5),
+        ))
+
+        width_t = max(2, len(str(config.n_stores)))
+        width_p = max(3, len(str(config.n_skus)))
+        self.tiendas = np.array([f"STORE_{i:0{width_t}d}" for i in range(1, config.n_stores + 1)], dtype=object)
+        self.productos = np.array([f"PROD_{i:0{width_p}d}" for i in range(1, config.n_skus + 1)], dtype=object)
+        self.fechas = pd.date_range(config.start_date, periods=config.n_days, freq="D")
+
+        # Niveles base: tamaño de tienda y popularidad de SKU (lognormales)
+        rng = self._rng("niveles")
+        self.store_level = rng.lognormal(mean=0.0, sigma=0.35, size=config.n_stores)
+        self.sku_level = rng.lognormal(mean=0.0, sigma=0.5, size=config.n_skus)
+
+    def _rng(self, table: str) -> np.random.Generator:
+        return np.random.default_rng(self._seeds[table])
+
+    def _seasonality(self) -> np.ndarray:
+        c = self.config
+        dow = self.fechas.dayofweek.to_numpy()
+        doy = self.fechas.dayofyear.to_numpy()
+        weekly = 1.0 + c.weekly_amplitude * np.sin(2 * np.pi * (dow + 1) / 7.0)
+        yearly = 1.0 + c.yearly_amplitude * np.sin(2 * np.pi * doy / 365.25)
+        return (weekly * yearly).astype(np.float32)
+
+    def catalogo(self) -> pd.DataFrame:
+        n = self.config.n_skus
+        rng = self._rng("catalogo")
+        costo = rng.integers(5, 25, size=n) * 100
+        precio = (costo * rng.uniform(1.8, 3.2, size=n)).round(-2).astype(np.int64)
+        nombres = [
+            NOMBRES[i] if i < len(NOMBRES) else f"{NOMBRES[i % len(NOMBRES)]} {i // len(NOMBRES) + 1}"
+            for i in range(n)
+        ]
+        return pd.DataFrame({
+            "id_producto": self.productos,
+            "nombre": nombres,
+            "costo_unitario": costo,
+            "precio_venta": precio,
+            "costo_almacenamiento_semanal": rng.integers(2, 5, size=n) * 5,
+        })
+
+    def maestro_tiendas(self) -> pd.DataFrame:
+        c = self.config
+        rng = self._rng("tiendas")
+        ciudades = np.array(CIUDADES[:max(1, min(c.n_cities, len(CIUDADES)))], dtype=object)
+        return pd.DataFrame({
+            "id_tienda": self.tiendas,
+            "ciudad": ciudades[rng.integers(0, len(ciudades), size=c.n_stores)],
+            "tamaño_m2": np.round(25 + 30 * self.store_level).astype(np.int64),
+        })
+
+    def inventario(self) -> pd.DataFrame:
+        c = self.config
+        rng = self._rng("inventario")
+        weekly_mean = 7 * c.mean_daily_units * (1 - c.sparsity) * np.outer(self.store_level, self.sku_level)
+        stock = rng.poisson(weekly_mean * rng.uniform(0.0, 0.5, size=weekly_mean.shape))
+        return pd.DataFrame({
+            "id_tienda": np.repeat(self.tiendas, c.n_skus),
+            "id_producto": np.tile(self.productos, c.n_stores),
+            "stock_actual": stock.ravel(),
+        })
+
+    def _iter_blocks(self):
+        """Genera bloques de tiendas: (slice de tiendas, unidades (tiendas, skus, días), índices planos a escribir)."""
+        c = self.config
+        rng = self._rng("ventas")
+        season = self._seasonality()
+        stores_per_block = max(1, c.block_cells // max(1, c.n_skus * c.n_days))
+
+        for start in range(0, c.n_stores, stores_per_block):
+            stop = min(c.n_stores, start + stores_per_block)
+
+            # tasa (tiendas, skus, días) = nivel tienda * nivel sku * estacionalidad
+            rate = (
+                c.mean_daily_units
+                * self.store_level[start:stop, None, None].astype(np.float32)
+                * self.sku_level[None, :, None].astype(np.float32)
+                * season[None, None, :]
+            )
+            # Día con venta con probabilidad 1 - sparsity y entonces 1 + Poisson(tasa - 1): los
+            # ceros de Poisson no se suman a `sparsity` y la media diaria es (1 - sparsity)·max(tasa, 1)
+            sale = rng.random(rate.shape, dtype=np.float32) >= c.sparsity
+            units = np.where(sale, 1 + rng.poisson(np.maximum(rate - 1.0, 0.0)), 0).astype(np.int32)
+
+            flat = units.reshape(-1)
+            keep = np.arange(flat.size) if c.write_zero_rows else np.flatnonzero(flat)
+            yield slice(start, stop), units, keep
+
+    def iter_ventas(self):
+        """Genera `ventas_historicas` por bloques de tiendas (orden tienda, producto, fecha)."""
+        fechas_str = np.asarray(self.fechas.strftime("%Y-%m-%d"), dtype=object)
+        for stores, units, keep in self._iter_blocks():
+            store_idx, sku_idx, day_idx = np.unravel_index(keep, units.shape)
+            yield pd.DataFrame({
+                "fecha": fechas_str[day_idx],
+                "id_tienda": self.tiendas[stores][store_idx],
+                "id_producto": self.productos[sku_idx],
+                "unidades_vendidas": units.reshape(-1)[keep],
+            })
+
+    def _write_ventas_csv(self, f, verbose: bool = False) -> int:
+        """Escribe ventas bloque a bloque con `DataFrame.to_csv` (encabezado en el primero)."""
+        t0 = time.perf_counter()
+        n_rows = 0
+        header = True
+        for block in self.iter_ventas():
+            block.to_csv(f, header=header, index=False, lineterminator="\n")
+            header = False
+            n_rows += len(block)
+            if verbose:
+                print(f"  ventas: {n_rows:,} filas ({time.perf_counter() - t0:.1f}s)")
+        if header:
+            f.write("fecha,id_tienda,id_producto,unidades_vendidas\n")
+        return n_rows
+
+    def write(self, out_dir: str, verbose: bool = False) -> Dict[str, str]:
+        """Escribe los cuatro CSV en `out_dir` y retorna sus rutas."""
+        os.makedirs(out_dir, exist_ok=True)
+        paths = {
+            "ventas": os.path.join(out_dir, "ventas_historicas.csv"),
+            "inventario": os.path.join(out_dir, "inventario_actual.csv"),
+            "catalogo": os.path.join(out_dir, "catalogo_productos.csv"),
+            "tiendas": os.path.join(out_dir, "maestro_tiendas.csv"),
+        }
+        self.catalogo().to_csv(paths["catalogo"], index=False)
+        self.maestro_tiendas().to_csv(paths["tiendas"], index=False)
+        self.inventario().to_csv(paths["inventario"], index=False)
+
+        with open(paths["ventas"], "w", encoding="utf-8", newline="") as f:
+            self._write_ventas_csv(f, verbose=verbose)
+        return paths
+
+
+def generate_supply_data(out_dir: str, verbose: bool = False, **kwargs) -> Dict[str, str]:
+    """Atajo: `generate_supply_data(out_dir, n_stores=1000, n_skus=5000, n_days=730, sparsity=0.6)`."""
+    return SyntheticSupplyData(SyntheticConfig(**kwargs)).write(out_dir, verbose=verbose)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Genera datos sintéticos de supply optimization")
+    parser.add_argument("out_dir")
+    parser.add_argument("--stores", type=int, default=SyntheticConfig.n_stores)
+    parser.add_argument("--skus", type=int, default=SyntheticConfig.n_skus)
+    parser.add_argument("--days", type=int, default=SyntheticConfig.n_days)
+    parser.add_argument("--sparsity", type=float, default=SyntheticConfig.sparsity)
+    parser.add_argument("--weekly-amplitude", type=float, default=SyntheticConfig.weekly_amplitude)
+    parser.add_argument("--yearly-amplitude", type=float, default=SyntheticConfig.yearly_amplitude)
+    parser.add_argument("--start-date", default=SyntheticConfig.start_date)
+    parser.add_argument("--seed", type=int, default=SyntheticConfig.seed)
+    args = parser.parse_args()
+
+    paths = generate_supply_data(
+        args.out_dir,
+        verbose=True,
+        n_stores=args.stores,
+        n_skus=args.skus,
+        n_days=args.days,
+        sparsity=args.sparsity,
+        weekly_amplitude=args.weekly_amplitude,
+        yearly_amplitude=args.yearly_amplitude,
+        start_date=args.start_date,
+        seed=args.seed,
+    )
+    print(paths)
@@ -0,0 +1,26 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+
+from data_source import DataSource  # noqa: E402
+from synthetic_data import generate_supply_data  # noqa: E402
+
+
+@pytest.fixture(scope="session")
+def supply_paths(tmp_path_factory):
+    """CSV sintéticos pequeños (12 tiendas x 6 SKUs x 70 días) compartidos por toda la sesión."""
+    out = tmp_path_factory.mktemp("supply")
+    return generate_supply_data(str(out), n_stores=12, n_skus=6, n_days=70, sparsity=0.3, n_cities=3, seed=7)
+
+
+def make_source(paths, **kwargs) -> DataSource:
+    return DataSource(
+        ventas_path=paths["ventas"],
+        inventario_path=paths["inventario"],
+        catalogo_path=paths["catalogo"],
+        tiendas_path=paths["tiendas"],
+        **kwargs,
+    )
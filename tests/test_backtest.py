@@ -0,0 +1,25 @@
+import pandas as pd
+import pytest
+
+from backtest import RollingOriginBacktest
+from conftest import make_source
+from forecast import DemandForecaster
+
+
+@pytest.mark.parametrize("engine", ["fourier", "prophet"])
+def test_parallel_backtest_matches_serial(supply_paths, engine):
+    panel = make_source(supply_paths).load().sales_daily()
+    if engine == "prophet":
+        # Prophet es lento: un subconjunto basta para cubrir el camino por serie
+        keep = panel["id_tienda"].isin(sorted(panel["id_tienda"].unique())[:2])
+        panel = panel[keep & panel["id_producto"].isin(sorted(panel["id_producto"].unique())[:2])]
+
+    def run(n_jobs):
+        forecaster = DemandForecaster(engine=engine, random_state=0, registry_size=0, min_history_days=14)
+        backtest = RollingOriginBacktest(forecaster, n_cutoffs=2, n_jobs=n_jobs, series_per_task=3)
+        return backtest.run(panel)
+
+    serial, parallel = run(1), run(2)
+    pd.testing.assert_frame_equal(parallel.predictions, serial.predictions)
+    pd.testing.assert_frame_equal(parallel.per_series, serial.per_series)
+    assert parallel.overall == serial.overall
@@ -0,0 +1,193 @@
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from conftest import make_source
+
+
+@pytest.mark.parametrize("chunksize", [50, 333, 10_000_000])
+def test_sales_daily_streaming_matches_sales_daily(supply_paths, chunksize):
+    repo = make_source(supply_paths).load()
+    expected = repo.sales_daily()
+    got = make_source(supply_paths).sales_daily_streaming(chunksize=chunksize)
+    pd.testing.assert_frame_equal(got, expected)
+
+
+TABLES = ("ventas", "inventario", "catalogo", "tiendas")
+
+
+def _as_csv(df: pd.DataFrame) -> pd.DataFrame:
+    """Valores comparables entre el CSV y el snapshot: textos, fechas como texto y floats."""
+    out = {}
+    for name in df.columns:
+        s = df[name]
+        if pd.api.types.is_datetime64_any_dtype(s.dtype):
+            s = s.dt.strftime("%Y-%m-%d")
+        elif pd.api.types.is_numeric_dtype(s.dtype):
+            s = s.astype(np.float64)
+        else:
+            s = s.astype(str)
+        out[name] = s.to_numpy()
+    return pd.DataFrame(out)
+
+
+def test_snapshot_matches_csv_and_rebuilds_on_change(supply_paths, tmp_path):
+    # Copia de los CSV: el test modifica uno y el fixture es de toda la sesión
+    paths = {}
+    for key, path in supply_paths.items():
+        paths[key] = str(tmp_path / os.path.basename(path))
+        shutil.copy(path, paths[key])
+    snapshot_dir = str(tmp_path / "snapshot")
+
+    csv = make_source(paths).load()
+    built = make_source(paths, snapshot_dir=snapshot_dir).load()
+    reread = make_source(paths, snapshot_dir=snapshot_dir).load()
+    for table in TABLES:
+        expected = _as_csv(getattr(csv, table))
+        for loaded in (built, reread):
+            df = getattr(loaded, table)
+            # Columnas tipadas tal como quedan en el snapshot
+            for name in df.columns:
+                dtype = df[name].dtype
+                if name.startswith("id_"):
+                    assert isinstance(dtype, pd.CategoricalDtype), (table, name)
+                elif name == "fecha":
+                    assert pd.api.types.is_datetime64_any_dtype(dtype)
+                elif pd.api.types.is_numeric_dtype(dtype):
+                    assert dtype.itemsize <= 4, (table, name, dtype)
+            pd.testing.assert_frame_equal(_as_csv(df), expected, check_dtype=False)
+
+    inventario = pd.read_csv(paths["inventario"])
+    inventario["stock_actual"] += 1
+    inventario.iloc[:-3].to_csv(paths["inventario"], index=False)
+    changed = make_source(paths, snapshot_dir=snapshot_dir).load()
+    pd.testing.assert_frame_equal(_as_csv(changed.inventario), _as_csv(make_source(paths).load().inventario))
+
+
+def test_sales_matrix_matches_long_panel(supply_paths):
+    repo = make_source(supply_paths).load()
+    keys = ["id_tienda", "id_producto", "fecha"]
+    long = repo.sales_daily().sort_values(keys).reset_index(drop=True)
+    dense = repo.sales_matrix().to_panel().sort_values(keys).reset_index(drop=True)
+    # La resolución de las fechas (s / us / ns) depende de cómo pandas las construye
+    for panel in (long, dense):
+        panel["fecha"] = panel["fecha"].astype("datetime64[ns]")
+    pd.testing.assert_frame_equal(dense, long)
+
+
+def test_master_index_align_inverts_rows(supply_paths):
+    repo = make_source(supply_paths).load()
+    master = repo.master_index()
+    frame = master.to_frame()
+    # Subconjunto desordenado, con un id desconocido y un par repetido (gana la última aparición)
+    pick = frame.sample(frac=0.6, random_state=0)
+    tiendas = list(pick["id_tienda"]) + ["NO_EXISTE", pick["id_tienda"].iloc[0]]
+    productos = list(pick["id_producto"]) + [pick["id_producto"].iloc[0], pick["id_producto"].iloc[0]]
+
+    pos = master.align(tiendas, productos)
+
+    expected = {}
+    for i, key in enumerate(zip(tiendas, productos)):
+        expected[key] = i
+    for row, (t, p) in enumerate(zip(frame["id_tienda"], frame["id_producto"])):
+        assert pos[row] == expected.get((t, p), -1)
+
+
+def test_master_index_uses_first_row_of_duplicated_ids(supply_paths):
+    repo = make_source(supply_paths).load()
+    expected = repo.master_index().to_frame()
+
+    # Copias repetidas (con otros valores) al final del catálogo y del maestro de tiendas
+    catalogo = repo.catalogo.iloc[[0, 1]].copy()
+    catalogo["precio_venta"] += 100
+    tiendas = repo.tiendas.iloc[[0]].copy()
+    tiendas["tamaño_m2"] += 100
+    repo.catalogo = pd.concat([repo.catalogo, catalogo], ignore_index=True)
+    repo.tiendas = pd.concat([repo.tiendas, tiendas], ignore_index=True)
+    repo._master_index = None
+
+    pd.testing.assert_frame_equal(repo.master_index().to_frame(), expected)
+
+
+def test_write_partitions_by_city_keeps_unmapped_stores(supply_paths, tmp_path):
+    repo = make_source(supply_paths).load()
+    dropped = repo.tiendas["id_tienda"].astype(str).iloc[0]
+    repo.tiendas = repo.tiendas[repo.tiendas["id_tienda"].astype(str) != dropped]
+
+    manifest = repo.write_partitions(str(tmp_path), by="ciudad")
+
+    assert manifest["partitions"][repo.SIN_CIUDAD]["tiendas"] == [dropped]
+    loaded = type(repo).from_partitions(str(tmp_path)).load()
+    assert len(loaded.ventas) == len(repo.ventas)
+    assert len(loaded.inventario) == len(repo.inventario)
+
+
+def test_shared_tables_roundtrip(supply_paths):
+    from data_source import SharedTables
+
+    repo = make_source(supply_paths).load()
+    master = repo.master_store()
+    matrix = repo.sales_matrix()
+    with repo.publish_shared() as shared:
+        attached = SharedTables.attach(shared.spec)
+        try:
+            got = attached["master"]
+            for col in ("id_tienda", "id_producto", "nombre", "ciudad"):
+                assert got[col].dtype == master[col].dtype
+            # Los numéricos viajan en su dtype angosto sin pérdida
+            pd.testing.assert_frame_equal(got, master, check_dtype=False)
+            np.testing.assert_array_equal(attached["ventas"].values, matrix.values)
+            np.testing.assert_array_equal(attached["ventas"].id_tienda, matrix.id_tienda)
+        finally:
+            attached.close()
+
+
+def _split_ventas(paths, tmp_path, cut_days):
+    ventas = pd.read_csv(paths["ventas"])
+    fechas = pd.to_datetime(ventas["fecha"])
+    cuts = [fechas.max() - pd.Timedelta(days=d) for d in cut_days]
+    bounds = [fechas.min() - pd.Timedelta(days=1)] + cuts + [fechas.max()]
+    out = []
+    for k, (lo, hi) in enumerate(zip(bounds[:-1], bounds[1:])):
+        path = tmp_path / f"ventas_{k}.csv"
+        ventas[(fechas > lo) & (fechas <= hi)].to_csv(path, index=False)
+        out.append(str(path))
+    return out
+
+
+def test_update_sales_matrix_matches_full_build(supply_paths, tmp_path):
+    full = make_source(supply_paths).load().sales_matrix()
+    # Histórico + deltas de 3, 1 y 40 días: los dos primeros caben en la reserva, el último no
+    base, *deltas = _split_ventas(supply_paths, tmp_path, cut_days=[44, 41, 40])
+    repo = make_source({**supply_paths, "ventas": base}).load()
+    state = str(tmp_path / "state")
+
+    matrix = repo.update_sales_matrix(state)
+    capacity = matrix._buffer.shape[1]
+    for k, delta in enumerate(deltas):
+        matrix = repo.update_sales_matrix(state, delta)
+        if k < 2:
+            assert matrix._buffer.shape[1] == capacity
+    assert matrix._buffer.shape[1] > capacity
+
+    np.testing.assert_array_equal(matrix.values, full.values)
+    np.testing.assert_array_equal(matrix.id_tienda, full.id_tienda)
+    assert matrix.fechas.equals(full.fechas)
+
+
+def test_append_does_not_touch_previous_matrix(supply_paths, tmp_path):
+    base, delta = _split_ventas(supply_paths, tmp_path, cut_days=[5])
+    matrix = make_source({**supply_paths, "ventas": base}).load().sales_matrix()
+    delta = pd.read_csv(delta)
+    early = pd.to_datetime(delta["fecha"]) <= pd.to_datetime(delta["fecha"]).min() + pd.Timedelta(days=1)
+    first = matrix.append(delta[early])
+    snapshot = first.values.copy()
+    second = first.append(delta[~early])
+    # Una segunda rama desde `first` no puede reutilizar la reserva ya tomada por `second`
+    branch = first.append(delta[~early])
+    assert second._buffer is first._buffer and branch._buffer is not first._buffer
+    np.testing.assert_array_equal(first.values, snapshot)
+    np.testing.assert_array_equal(branch.values, second.values)
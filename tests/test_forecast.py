@@ -0,0 +1,301 @@
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from conftest import make_source
+from data_source import SalesMatrix
+from forecast import DemandForecaster, ModelCache
+
+
+@pytest.fixture(scope="module")
+def small_panel(supply_paths):
+    panel = make_source(supply_paths).load().sales_daily()
+    stores = sorted(panel["id_tienda"].unique())[:2]
+    products = sorted(panel["id_producto"].unique())[:2]
+    keep = panel["id_tienda"].isin(stores) & panel["id_producto"].isin(products)
+    return panel[keep].reset_index(drop=True)
+
+
+def test_parallel_matches_serial(small_panel):
+    serial = DemandForecaster(n_jobs=1, random_state=0, registry_size=0).fit_predict_week(small_panel)
+    parallel = DemandForecaster(n_jobs=2, chunk_size=1, random_state=0, registry_size=0).fit_predict_week(small_panel)
+    pd.testing.assert_frame_equal(parallel, serial)
+
+
+def test_series_seed_leaves_global_rng_untouched(small_panel):
+    np.random.seed(123)
+    expected = np.random.random(3)
+    np.random.seed(123)
+    DemandForecaster(random_state=0, registry_size=0).fit_predict_week(small_panel)
+    np.testing.assert_array_equal(np.random.random(3), expected)
+
+
+def test_default_samples_from_global_rng(small_panel):
+    # Sin random_state el muestreo de Prophet usa el RNG global, como antes de la siembra por serie
+    forecaster = DemandForecaster(registry_size=0)
+    np.random.seed(7)
+    first = forecaster.fit_predict_week(small_panel)
+    np.random.seed(7)
+    pd.testing.assert_frame_equal(forecaster.fit_predict_week(small_panel), first)
+    np.random.seed(8)
+    assert not np.allclose(forecaster.fit_predict_week(small_panel)["sigma_semana"], first["sigma_semana"])
+
+
+def test_budget_routes_intermittent_series(supply_paths):
+    panel = make_source(supply_paths).load().sales_daily()
+    # Historia mínima inalcanzable: las series no intermitentes quedan en el fallback en ambos caminos
+    forecaster = DemandForecaster(intermittent="sba", min_history_days=1000, registry_size=0)
+    full = forecaster.fit_predict_week(panel)
+    budget = forecaster.fit_predict_week_budget(panel, time_budget_s=60.0)
+
+    assert (budget["metodo"] == "sba").sum() == forecaster.last_budget_report["n_intermitente"] > 0
+    merged = full.merge(budget, on=["id_tienda", "id_producto"], suffixes=("", "_budget"))
+    assert len(merged) == len(full)
+    np.testing.assert_allclose(merged["mu_semana_budget"], merged["mu_semana"], rtol=1e-6)
+    np.testing.assert_allclose(merged["sigma_semana_budget"], merged["sigma_semana"], rtol=1e-6)
+    assert (merged["clase_demanda_budget"] == merged["clase_demanda"]).all()
+
+
+@pytest.mark.parametrize("kwargs", [{"engine": "fourier"}, {"hierarchy": "producto"}])
+def test_budget_rejects_engines_without_per_series_fits(small_panel, kwargs):
+    with pytest.raises(ValueError):
+        DemandForecaster(**kwargs).fit_predict_week_budget(small_panel, time_budget_s=1.0)
+
+
+def test_fourier_engine_recovers_weekly_sinusoid():
+    n_days = 84
+    t = np.arange(n_days + 14, dtype=float)
+    curves = np.stack([
+        20 + 0.05 * t + 5 * np.sin(2 * np.pi * t / 7 + 0.3) + 2 * np.cos(4 * np.pi * t / 7),
+        8 - 0.02 * t + 3 * np.sin(2 * np.pi * t / 7),
+    ])
+    matrix = SalesMatrix(
+        values=curves[:, :n_days].astype(np.float32),
+        id_tienda=np.array(["T1", "T2"], dtype=object),
+        id_producto=np.array(["P1", "P1"], dtype=object),
+        fechas=pd.date_range("2024-01-01", periods=n_days, freq="D"),
+    )
+    out = DemandForecaster(engine="fourier", fourier_window_days=None).fit_predict_horizons(matrix, n_weeks=2)
+
+    expected = curves[:, n_days:].reshape(2, 2, 7).sum(axis=2)
+    np.testing.assert_allclose(out.mu, expected, rtol=1e-4)
+    # Sin residuos, sigma queda en el piso de 1 unidad por semana
+    np.testing.assert_allclose(out.sigma, 1.0, rtol=1e-4)
+
+
+def test_model_cache_hits_and_invalidation(small_panel, tmp_path):
+    cache = ModelCache(str(tmp_path))
+    first = DemandForecaster(model_cache=cache, registry_size=0).fit_predict_week(small_panel)
+    assert (cache.hits, cache.misses) == (0, 4)
+
+    again = DemandForecaster(model_cache=cache, registry_size=0).fit_predict_week(small_panel)
+    assert (cache.hits, cache.misses) == (4, 4)
+    pd.testing.assert_frame_equal(again, first)
+
+    # Otro hiperparámetro es otra llave: se vuelve a ajustar
+    DemandForecaster(model_cache=cache, registry_size=0, changepoint_prior_scale=0.5).fit_predict_week(small_panel)
+    assert (cache.hits, cache.misses) == (4, 8)
+
+
+def test_model_cache_evicts_lru_to_low_watermark(tmp_path, monkeypatch):
+    walks = []
+    entries = ModelCache._entries
+    monkeypatch.setattr(ModelCache, "_entries", lambda self: walks.append(1) or entries(self))
+
+    entry = {"model": "x" * 1000, "forecasts": {}}
+    size = len(json.dumps(entry))
+    cache = ModelCache(str(tmp_path), max_bytes=10 * size, low_watermark=0.5)
+    keys = [f"{i:02d}" + "0" * 38 for i in range(12)]
+    for key in keys[:10]:
+        cache.put(key, entry)
+    assert cache.evictions == 0
+    assert cache.get(keys[0]) is not None      # la más antigua pasa a ser la más reciente
+
+    cache.put(keys[10], entry)                 # 11 entradas > 10: baja a 5
+    assert cache.evictions == 6
+    assert cache.get(keys[0]) is not None
+    assert all(cache.get(k) is None for k in keys[1:7])
+    assert all(cache.get(k) is not None for k in keys[7:11])
+
+    cache.put(keys[11], entry)                 # hay margen: sin evicción
+    assert cache.evictions == 6
+    assert len(walks) == 1
+
+
+@pytest.mark.parametrize("n_jobs", [1, 2])
+def test_warm_start_reproduces_cold_fit(small_panel, n_jobs):
+    cold = DemandForecaster(random_state=0, registry_size=0).fit_predict_week(small_panel)
+
+    forecaster = DemandForecaster(warm_start=True, n_jobs=n_jobs, chunk_size=1, random_state=0, registry_size=0)
+    cutoff = small_panel["fecha"].max() - pd.Timedelta(days=7)
+    forecaster.fit_predict_week(small_panel[small_panel["fecha"] <= cutoff])
+    assert len(forecaster.warm_params) == len(cold)
+    assert forecaster.__getstate__()["warm_params"] == {}
+
+    warm = forecaster.fit_predict_week(small_panel)
+    # Los tiempos son los de la última llamada: todos los ajustes partieron en caliente
+    report = forecaster.fit_time_report()
+    assert (report["n_warm"], report["n_cold"]) == (len(cold), 0)
+    np.testing.assert_allclose(warm["mu_semana"], cold["mu_semana"], rtol=0.02)
+    np.testing.assert_allclose(warm["sigma_semana"], cold["sigma_semana"], rtol=0.05)
+
+
+def test_split_panel_yields_views_matching_groupby_reindex():
+    fechas = pd.to_datetime(["2024-01-01", "2024-01-02", "2024-01-05", "2024-01-03", "2024-01-04", "2024-01-02"])
+    panel = pd.DataFrame({
+        "id_tienda": ["T2", "T2", "T2", "T1", "T1", "T1"],
+        "id_producto": ["P1", "P1", "P1", "P9", "P9", "P9"],
+        "fecha": fechas,
+        "unidades_vendidas": [1.0, 2.0, 5.0, 3.0, 4.0, 7.0],
+    })
+    series = list(DemandForecaster._split_panel(panel))
+
+    expected = []
+    for (t, p), g in panel.groupby(["id_tienda", "id_producto"]):
+        s = g.set_index("fecha")["unidades_vendidas"]
+        s = s.reindex(pd.date_range(s.index.min(), s.index.max(), freq="D"), fill_value=0.0)
+        expected.append((t, p, s.to_numpy(), s.index[0]))
+
+    assert [(t, p) for t, p, _, _ in series] == [(t, p) for t, p, _, _ in expected]
+    for (_, _, y, start), (_, _, y_exp, start_exp) in zip(series, expected):
+        np.testing.assert_array_equal(y, y_exp)
+        assert pd.Timestamp(start) == start_exp
+    # Todas las series son vistas de un único buffer, sin copias por grupo
+    base = series[0][2].base
+    assert base is not None and all(y.base is base for _, _, y, _ in series)
+
+
+def test_parallel_fit_ships_only_surviving_models_for_plots(small_panel, monkeypatch):
+    import matplotlib.pyplot as plt
+    from forecast import ModelRegistry
+
+    shipped = []
+    merge = ModelRegistry.update_from_json
+
+    def recording_merge(self, payload):
+        shipped.append(len(payload))
+        merge(self, payload)
+
+    monkeypatch.setattr(ModelRegistry, "update_from_json", recording_merge)
+
+    forecaster = DemandForecaster(n_jobs=2, chunk_size=1, registry_size=2)
+    out = forecaster.fit_predict_week(small_panel)
+    # Sólo viajan los modelos que sobreviven en el LRU final: los de las dos últimas series
+    assert shipped == [0] * (len(out) - 2) + [1, 1]
+    last = list(zip(out["id_tienda"], out["id_producto"]))[-2:]
+    assert all(series in forecaster.registry for series in last)
+
+    # Los gráficos reutilizan los modelos del ajuste en paralelo sin re-ajustar
+    def no_refit(*args, **kwargs):
+        raise AssertionError("re-ajuste inesperado")
+
+    monkeypatch.setattr(forecaster, "_fit_model", no_refit)
+    for tienda, producto in last:
+        plt.close(forecaster.plot_time_series(small_panel, tienda, producto))
+
+
+@pytest.mark.parametrize("reconciliation", ["top_down", "mint"])
+def test_hierarchical_children_sum_to_parent(reconciliation, monkeypatch):
+    # T1 es muy variable: con un padre pequeño MinT la empuja bajo cero antes del recorte
+    fechas = pd.date_range("2024-01-01", periods=28, freq="D")
+    ventas = {"T1": np.tile([0.0, 20.0], 14), "T2": np.full(28, 10.0), "T3": np.full(28, 1.0)}
+    panel = pd.DataFrame({
+        "id_tienda": np.repeat(list(ventas), len(fechas)),
+        "id_producto": "P1",
+        "fecha": np.tile(fechas, len(ventas)),
+        "unidades_vendidas": np.concatenate(list(ventas.values())),
+    })
+
+    forecaster = DemandForecaster(hierarchy="producto", reconciliation=reconciliation, registry_size=0)
+    # Padre fijo y casi sin varianza: el total reconciliado es el del padre
+    monkeypatch.setattr(forecaster, "_forecast_flat", lambda agg, block_days, n_blocks: (
+        agg.id_tienda, agg.id_producto, None, np.full((len(agg.id_tienda), n_blocks), 1.0),
+        np.full((len(agg.id_tienda), n_blocks), 1e-9), {},
+    ))
+    out = forecaster.fit_predict_week(panel)
+
+    assert (out["mu_semana"] >= 0).all()
+    assert out["mu_semana"].sum() == pytest.approx(1.0, rel=1e-6)
+
+
+@pytest.mark.parametrize("reconciliation", ["top_down", "mint"])
+def test_hierarchical_children_sigma_follows_parent(reconciliation, monkeypatch):
+    fechas = pd.date_range("2024-01-01", periods=28, freq="D")
+    ventas = {"T1": np.tile([0.0, 20.0], 14), "T2": np.full(28, 10.0), "T3": np.full(28, 1.0)}
+    panel = pd.DataFrame({
+        "id_tienda": np.repeat(list(ventas), len(fechas)),
+        "id_producto": "P1",
+        "fecha": np.tile(fechas, len(ventas)),
+        "unidades_vendidas": np.concatenate(list(ventas.values())),
+    })
+
+    forecaster = DemandForecaster(hierarchy="producto", reconciliation=reconciliation, registry_size=0)
+    # Padre grande y casi sin varianza: a las hijas solo les queda la incertidumbre del reparto
+    total = 400.0
+    monkeypatch.setattr(forecaster, "_forecast_flat", lambda agg, block_days, n_blocks: (
+        agg.id_tienda, agg.id_producto, None, np.full((len(agg.id_tienda), n_blocks), total),
+        np.full((len(agg.id_tienda), n_blocks), 1e-9), {},
+    ))
+    out = forecaster.fit_predict_week(panel)
+
+    q = out["mu_semana"].to_numpy() / total
+    expected = np.maximum(1.0, np.sqrt(q * (1.0 - q) * total))
+    np.testing.assert_allclose(out["sigma_semana"].to_numpy(), expected, rtol=1e-6)
+
+
+def test_classify_demand_thresholds():
+    # (clase esperada, días del rango, ventas no nulas al inicio del rango)
+    cases = [
+        ("smooth", 32, [5.0] * 25),             # ADI = 1.28
+        ("intermittent", 33, [5.0] * 25),       # ADI = 1.32 (límite inclusivo)
+        ("smooth", 20, [16.0, 4.0] * 10),       # CV² = 0.36
+        ("erratic", 20, [17.0, 3.0] * 10),      # CV² = 0.49 (límite inclusivo)
+        ("lumpy", 40, [17.0, 3.0] * 10),        # ADI = 2, CV² = 0.49
+    ]
+    width = max(days for _, days, _ in cases)
+    Y = np.zeros((len(cases), width), dtype=np.float32)
+    start = np.zeros(len(cases), dtype=np.int64)
+    end = np.zeros(len(cases), dtype=np.int64)
+    for i, (_, days, sales) in enumerate(cases):
+        start[i] = width - days
+        end[i] = width - 1
+        Y[i, start[i]:start[i] + len(sales)] = sales
+
+    clase = DemandForecaster.classify_demand(Y, start, end)
+    assert list(clase) == [expected for expected, _, _ in cases]
+
+
+@pytest.mark.parametrize("method, factor", [("croston", 1.0), ("sba", 0.95)])
+def test_intermittent_series_are_routed_to_estimator(method, factor):
+    fechas = pd.date_range("2024-01-01", periods=60, freq="D")
+    smooth = 10.0 + 3.0 * np.sin(2 * np.pi * np.arange(60) / 7)
+    sparse = np.where(np.arange(60) % 3 == 2, 4.0, 0.0)  # 4 unidades cada 3 días
+    panel = pd.DataFrame({
+        "id_tienda": "T1",
+        "id_producto": np.repeat(["P1", "P2"], len(fechas)),
+        "fecha": np.tile(fechas, 2),
+        "unidades_vendidas": np.concatenate([smooth, sparse]),
+    })
+
+    routed = DemandForecaster(engine="fourier", intermittent=method).fit_predict_week(panel)
+    plain = DemandForecaster(engine="fourier").fit_predict_week(panel)
+
+    assert list(routed["clase_demanda"]) == ["smooth", "intermittent"]
+    # La serie suave sigue en el motor; la intermitente recibe h * z / p (x (1 - alpha/2) en SBA)
+    assert routed.loc[0, "mu_semana"] == pytest.approx(plain.loc[0, "mu_semana"])
+    assert routed.loc[0, "sigma_semana"] == pytest.approx(plain.loc[0, "sigma_semana"])
+    assert routed.loc[1, "mu_semana"] == pytest.approx(7 * factor * 4.0 / 3.0)
+
+
+@pytest.mark.parametrize("engine", ["prophet", "fourier"])
+def test_horizons_week_one_matches_fit_predict_week(small_panel, engine):
+    forecaster = DemandForecaster(engine=engine, random_state=0, registry_size=0)
+    week = forecaster.fit_predict_week(small_panel)
+    horizons = forecaster.fit_predict_horizons(small_panel, n_weeks=4)
+
+    np.testing.assert_allclose(horizons.mu[:, 0], week["mu_semana"], rtol=1e-5)
+    # Prophet muestrea la incertidumbre sobre las 4 semanas: la sigma sólo coincide en distribución
+    rtol = 0.1 if engine == "prophet" else 1e-5
+    np.testing.assert_allclose(horizons.sigma[:, 0], week["sigma_semana"], rtol=rtol)
@@ -0,0 +1,249 @@
+import warnings
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from conftest import make_source
+from data_source import DataSource
+from forecast import DemandForecaster
+from optimizer import InventoryOptimizer, ReplenishmentPlanner
+
+FIELDS = ("Q_objetivo", "pedido_sugerido", "p_critico", "expected_stockout_cost",
+          "expected_overstock_cost", "service_level_approx")
+
+
+@pytest.mark.parametrize("optimizer", [InventoryOptimizer(), InventoryOptimizer(z_clip=(-1, 1.5), sigma_min=2)])
+def test_vector_matches_scalar(optimizer):
+    rng = np.random.default_rng(0)
+    n = 3000
+    mu = rng.uniform(-5, 100, n)
+    sigma = rng.uniform(0, 20, n)
+    stock = rng.uniform(-5, 80, n)
+    cu = rng.choice([0.0, 1.0, 5.0, -1.0, np.nan], n) * rng.uniform(0, 3, n)
+    co = rng.choice([0.0, 1.0, 5.0, -2.0, np.nan], n) * rng.uniform(0, 3, n)
+    mu[::97] = np.nan
+    sigma[::89] = np.nan
+    stock[::83] = np.nan
+
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        vec = optimizer.compute_order_quantities(mu, sigma, stock, cu, co)
+        for i in range(n):
+            res = optimizer.compute_order_quantity(mu[i], sigma[i], stock[i], cu[i], co[i])
+            for f in FIELDS:
+                assert np.isclose(getattr(res, f), getattr(vec, f)[i], rtol=1e-9, atol=1e-9), (f, i)
+
+
+def test_nan_costs_follow_scalar_special_cases():
+    opt = InventoryOptimizer()
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        r = opt.compute_order_quantities([10, 10, 10], [2, 2, 2], [0, 0, 0], [np.nan, 3.0, np.nan], [1.0, np.nan, np.nan])
+    np.testing.assert_allclose(r.p_critico, [0.01, 0.99, 0.5])
+
+
+def make_planner(repo, **kwargs) -> ReplenishmentPlanner:
+    forecaster = DemandForecaster(engine="fourier", registry_size=0)
+    return ReplenishmentPlanner(repo, forecaster, InventoryOptimizer(), **kwargs)
+
+
+def test_dense_panel_matches_long_panel(supply_paths):
+    repo = make_source(supply_paths).load()
+    long = make_planner(repo).run()
+    dense = make_planner(repo, dense_panel=True).run()
+    pd.testing.assert_frame_equal(dense, long)
+
+
+def test_partition_replan_matches_full_plan(supply_paths, tmp_path):
+    repo = make_source(supply_paths).load()
+    ciudad = str(repo.tiendas["ciudad"].iloc[0])
+    stores = repo.tiendas.loc[repo.tiendas["ciudad"].astype(str) == ciudad, "id_tienda"].astype(str)
+    # Las ventas de esa ciudad terminan 10 días antes que las del resto
+    fechas = pd.to_datetime(repo.ventas["fecha"])
+    early = repo.ventas["id_tienda"].astype(str).isin(stores) & (fechas > fechas.max() - pd.Timedelta(days=10))
+    repo.ventas = repo.ventas[~early].reset_index(drop=True)
+    repo.write_partitions(str(tmp_path), by="ciudad")
+
+    source = DataSource.from_partitions(str(tmp_path)).load()
+    full = make_planner(source).run()
+    part = make_planner(source).run(partitions=[ciudad])
+    expected = full[full["id_tienda"].isin(stores)].reset_index(drop=True)
+    pd.testing.assert_frame_equal(part, expected)
+
+
+@pytest.mark.parametrize("dense_panel", [False, True])
+def test_streaming_matches_full_run(supply_paths, dense_panel):
+    repo = make_source(supply_paths).load()
+    stores = repo.tiendas["id_tienda"].astype(str)
+    # Una tienda deja de vender 10 días antes que el resto y otra no tiene ventas
+    fechas = pd.to_datetime(repo.ventas["fecha"])
+    tienda = repo.ventas["id_tienda"].astype(str)
+    drop = (tienda == stores.iloc[0]) & (fechas > fechas.max() - pd.Timedelta(days=10))
+    drop |= tienda == stores.iloc[1]
+    repo.ventas = repo.ventas[~drop].reset_index(drop=True)
+
+    full = make_planner(repo, dense_panel=dense_panel).run()
+    blocks = list(make_planner(repo, dense_panel=dense_panel).run_streaming(stores_per_block=1))
+    assert len(blocks) == len(stores)
+    assert stores.iloc[1] in set(full["id_tienda"].astype(str))
+    streamed = pd.concat(blocks, ignore_index=True)
+    pd.testing.assert_frame_equal(streamed, full)
+
+
+def _constrained_case(rng, n_stores, n_skus):
+    """Tiendas con espacio y presupuesto entre 30% y 110% de lo que pide el newsvendor libre."""
+    n = n_stores * n_skus
+    case = {
+        "store_code": np.repeat(np.arange(n_stores), n_skus),
+        "mu_week": rng.uniform(20, 100, n),
+        "sigma_week": rng.uniform(3, 20, n),
+        "stock_actual": np.zeros(n),
+        "margen_unitario": rng.uniform(1, 10, n),
+        "costo_overstock_unitario": rng.uniform(1, 10, n),
+        "espacio_unitario": rng.uniform(0.1, 2, n),
+        "costo_unitario": rng.uniform(1, 10, n),
+    }
+    free = InventoryOptimizer().compute_order_quantities(
+        case["mu_week"], case["sigma_week"], case["stock_actual"],
+        case["margen_unitario"], case["costo_overstock_unitario"],
+    ).pedido_sugerido
+    for weight, limit in (("espacio_unitario", "espacio_libre"), ("costo_unitario", "presupuesto")):
+        used = np.bincount(case["store_code"], weights=case[weight] * free, minlength=n_stores)
+        case[limit] = rng.uniform(0.3, 1.1, n_stores) * used
+    return case
+
+
+def _expected_cost(pedido, case):
+    """Costo esperado total (faltante + exceso) con demanda Normal, y su gradiente en `pedido`."""
+    from scipy import stats
+
+    z = (pedido + case["stock_actual"] - case["mu_week"]) / case["sigma_week"]
+    cu, co = case["margen_unitario"], case["costo_overstock_unitario"]
+    shortage = stats.norm.pdf(z) - z * stats.norm.sf(z)
+    overage = stats.norm.pdf(z) + z * stats.norm.cdf(z)
+    cost = float(np.sum(case["sigma_week"] * (cu * shortage + co * overage)))
+    return cost, (cu + co) * stats.norm.cdf(z) - cu
+
+
+def _slsqp_orders(case):
+    from scipy import optimize
+
+    constraints = [
+        {"type": "ineq", "fun": lambda q, w=w, b=b: case[b][0] - case[w] @ q, "jac": lambda q, w=w: -case[w]}
+        for w, b in (("espacio_unitario", "espacio_libre"), ("costo_unitario", "presupuesto"))
+    ]
+    n = len(case["mu_week"])
+    ref = optimize.minimize(
+        _expected_cost, np.zeros(n), args=(case,), jac=True, method="SLSQP", constraints=constraints,
+        bounds=[(0, None)] * n, options={"ftol": 1e-12, "maxiter": 500},
+    )
+    return ref.x
+
+
+def test_constrained_orders_are_feasible_and_satisfy_kkt():
+    tol = 1e-3
+    case = _constrained_case(np.random.default_rng(0), n_stores=40, n_skus=6)
+    out, lam, nu = InventoryOptimizer().compute_order_quantities_constrained(**case, tol=tol)
+
+    pedido = out.pedido_sugerido
+    assert (pedido >= 0).all()
+    for mult, weight, limit in ((lam, "espacio_unitario", "espacio_libre"), (nu, "costo_unitario", "presupuesto")):
+        used = np.bincount(case["store_code"], weights=case[weight] * pedido, minlength=len(case[limit]))
+        assert (used <= case[limit] * (1 + 1e-9)).all()
+        assert (mult >= 0).all()
+        # Holgura complementaria: un precio sombra positivo exige la restricción justa
+        assert (used[mult > 0] >= case[limit][mult > 0] * (1 - tol)).all()
+    assert ((lam > 0) & (nu > 0)).any()
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_constrained_orders_match_slsqp(seed):
+    rng = np.random.default_rng(seed)
+    for _ in range(10):
+        case = _constrained_case(rng, n_stores=1, n_skus=int(rng.integers(2, 6)))
+        out, _, _ = InventoryOptimizer().compute_order_quantities_constrained(**case, tol=1e-7)
+        ref = _slsqp_orders(case)
+
+        cost = _expected_cost(out.pedido_sugerido, case)[0]
+        assert cost <= _expected_cost(ref, case)[0] * (1 + 1e-6)
+        np.testing.assert_allclose(out.pedido_sugerido, ref, atol=1e-2 * case["mu_week"].max())
+
+
+@pytest.mark.parametrize("overdispersed", [False, True])
+def test_count_distributions_match_scipy(overdispersed):
+    from scipy import stats
+    from optimizer import DemandDistributions
+
+    rng = np.random.default_rng(1)
+    mu = rng.uniform(0.2, 60, 200)
+    if overdispersed:
+        var = mu * rng.uniform(1.1, 6, len(mu))
+        dist = DemandDistributions.negative_binomial(mu, var)
+        ref = stats.nbinom(mu ** 2 / (var - mu), mu / var)
+    else:
+        dist = DemandDistributions.poisson(mu)
+        ref = stats.poisson(mu)
+
+    for p in (0.01, 0.2, 0.5, 0.9, 0.99):
+        np.testing.assert_array_equal(dist.ppf(np.full(len(mu), p)), ref.ppf(p))
+
+    # E[(D - Q)+] = Σ_{d > Q} (d - Q) f(d), también con Q fraccionario
+    Q = rng.uniform(0, 80, len(mu))
+    d = np.arange(2000)[:, None]
+    expected = (np.maximum(0.0, d - Q) * ref.pmf(d)).sum(axis=0)
+    np.testing.assert_allclose(dist.expected_shortage(Q), expected, rtol=1e-8, atol=1e-10)
+
+
+@pytest.mark.parametrize("demand_model", ["normal", "poisson", "negbin", "empirical"])
+def test_what_if_matches_full_rerun(supply_paths, demand_model):
+    repo = make_source(supply_paths).load()
+    planner = make_planner(repo, demand_model=demand_model)
+    planner.run()
+
+    productos = sorted(repo.catalogo["id_producto"].astype(str).unique())[:2]
+    cambios = pd.DataFrame({"id_producto": productos, "costo_unitario": [1, 40], "precio_venta": [9, 45]})
+    scenario = planner.what_if(cambios)
+
+    rerun_repo = make_source(supply_paths).load()
+    catalogo = rerun_repo.catalogo.set_index(rerun_repo.catalogo["id_producto"].astype(str))
+    for col in ("costo_unitario", "precio_venta"):
+        catalogo.loc[productos, col] = cambios[col].to_numpy()
+    rerun_repo.catalogo = catalogo.reset_index(drop=True)
+    pd.testing.assert_frame_equal(scenario, make_planner(rerun_repo, demand_model=demand_model).run())
+
+
+@pytest.mark.parametrize("kwargs", [
+    {"demand_model": "normal"},
+    {"demand_model": "empirical"},
+    {"constraints": "budget"},
+])
+def test_plan_state_round_trip_and_what_if(supply_paths, tmp_path, kwargs):
+    from optimizer import PlanState, StoreConstraints
+
+    repo = make_source(supply_paths).load()
+    if kwargs.get("constraints") == "budget":
+        # Presupuesto por tienda a la mitad de la compra sin restricciones: queda activo
+        free = make_planner(repo).run().merge(repo.catalogo.astype({"id_producto": str}), on="id_producto")
+        gasto = (free["pedido_sugerido"] * free["costo_unitario"]).groupby(free["id_tienda"]).sum()
+        kwargs = {"constraints": StoreConstraints(presupuesto_semanal=(0.5 * gasto).to_dict())}
+    planner = make_planner(repo, **kwargs)
+    plan = planner.run()
+    if "precio_sombra_presupuesto" in plan:
+        assert (plan["precio_sombra_presupuesto"] > 0).any()
+
+    planner.last_state.save(str(tmp_path / "state"))
+    state = PlanState.load(str(tmp_path / "state"))
+    pd.testing.assert_frame_equal(state.frame, planner.last_state.frame)
+    np.testing.assert_array_equal(state.master.tienda_code, planner.last_state.master.tienda_code)
+    np.testing.assert_array_equal(state.master.producto_code, planner.last_state.master.producto_code)
+    if planner.last_state.dist is not None:
+        np.testing.assert_array_equal(state.dist.samples, planner.last_state.dist.samples)
+
+    # Un planner nuevo (sin run) reproduce el plan y los escenarios desde el estado guardado
+    fresh = make_planner(make_source(supply_paths).load(), **kwargs)
+    pd.testing.assert_frame_equal(fresh.what_if(pd.DataFrame({"id_producto": []}), state=state), plan)
+    producto = str(repo.catalogo["id_producto"].iloc[0])
+    cambios = pd.DataFrame({"id_producto": [producto], "costo_unitario": [2], "precio_venta": [30]})
+    pd.testing.assert_frame_equal(fresh.what_if(cambios, state=state), planner.what_if(cambios))
+    assert PlanState.load(str(tmp_path / "missing")) is None
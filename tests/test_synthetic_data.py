@@ -0,0 +1,21 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from synthetic_data import SyntheticConfig, SyntheticSupplyData
+
+
+@pytest.mark.parametrize("sparsity", [0.0, 0.3, 0.8])
+def test_sparsity_is_the_share_of_zero_days(sparsity):
+    gen = SyntheticSupplyData(SyntheticConfig(n_stores=30, n_skus=10, n_days=120, sparsity=sparsity,
+                                              mean_daily_units=0.5, write_zero_rows=True, block_cells=10_000))
+    units = pd.concat(gen.iter_ventas(), ignore_index=True)["unidades_vendidas"].to_numpy()
+    assert len(units) == 30 * 10 * 120
+    assert abs(np.mean(units == 0) - sparsity) < 0.01
+
+
+def test_written_csv_matches_iter_ventas(tmp_path):
+    gen = SyntheticSupplyData(SyntheticConfig(n_stores=7, n_skus=4, n_days=30, sparsity=0.5, block_cells=200))
+    paths = gen.write(str(tmp_path))
+    expected = pd.concat(gen.iter_ventas(), ignore_index=True)
+    pd.testing.assert_frame_equal(pd.read_csv(paths["ventas"]), expected, check_dtype=False)